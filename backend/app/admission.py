@@ -0,0 +1,245 @@
+"""
+Контроль приёма транскрипций (backpressure).
+
+Очередь каждой модели измеряется в секундах аудио — ещё не распознанная часть задач в очереди
+и в работе — и переводится во время ожидания по измеренной скорости модели: сколько секунд аудио
+в секунду она распознаёт на одном слоте (по последним завершённым задачам), умноженной на число слотов.
+
+- принятая задача получает оценку начала и готовности по своему месту в очереди (estimate);
+- ожидание в очереди модели больше ADMISSION_MAX_WAIT_SECONDS — сервер перегружен: 503;
+- у пользователя незавершённой работы больше USER_MAX_QUEUED_AUDIO_SECONDS секунд аудио
+  или USER_MAX_QUEUED_JOBS задач — 429.
+Отказ содержит Retry-After: через сколько секунд очередь рассосётся до лимита.
+
+Та же оценка выбирает профиль декодирования задачи при запуске (decode_profile): если ожидание
+в очереди модели дошло до DECODE_FAST_QUEUE_SECONDS, задачи без выбранного пользователем профиля
+распознаются быстрым профилем — пик нагрузки снижает точность, а не раздувает очередь.
+
+Пользователь — user_id из access-токена (Authorization: Bearer), для анонимных запросов — IP клиента.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+import math
+
+from fastapi import Request
+
+from .auth import decode_token
+from .config import (
+    ADMISSION_MAX_WAIT_SECONDS, USER_MAX_QUEUED_AUDIO_SECONDS, USER_MAX_QUEUED_JOBS,
+    ADMISSION_DEFAULT_SPEED, ADMISSION_UNKNOWN_DURATION_SECONDS, DECODE_FAST_QUEUE_SECONDS
+)
+from .database import SessionLocal
+from .job_queue import job_audio_seconds, job_queue
+from .models import TranscriptionJob
+from .rtf import historical_rtf
+
+logger = logging.getLogger(__name__)
+
+# По скольким последним завершённым задачам модели измеряется её скорость
+SPEED_SAMPLE_JOBS = 20
+
+
+class AdmissionRejected(Exception):
+    """Транскрипцию сейчас не принять: status_code 503 (сервер перегружен) или 429 (лимит пользователя)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def client_id(request: Request) -> str:
+    """Кому засчитывать работу: "user:<id>" по access-токену, иначе "ip:<адрес>" """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        payload = decode_token(authorization[7:].strip())
+        if payload and payload.get("user_id") is not None:
+            return f"user:{payload['user_id']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def user_id(owner: Optional[str]) -> Optional[int]:
+    """user_id из идентификатора client_id (None для анонимных)"""
+    if owner and owner.startswith("user:"):
+        try:
+            return int(owner[5:])
+        except ValueError:
+            return None
+    return None
+
+
+def model_speed(db, model: str) -> float:
+    """Секунд аудио в секунду на одном слоте модели по последним завершённым задачам.
+
+    Задачи батча выполняются одновременно на одном воркере, поэтому время работы считается
+    как объединение интервалов [started_at, finished_at] каждого воркера, а не их сумма.
+    """
+    jobs = db.query(TranscriptionJob).filter(
+        TranscriptionJob.model == model,
+        TranscriptionJob.status == "done",
+        TranscriptionJob.duration_seconds.isnot(None),
+        TranscriptionJob.started_at.isnot(None),
+        TranscriptionJob.finished_at.isnot(None)
+    ).order_by(TranscriptionJob.id.desc()).limit(SPEED_SAMPLE_JOBS).all()
+    if not jobs:
+        # Задач модели в БД ещё нет — берём историческую скорость этого железа, если она есть
+        rtf = historical_rtf(model)
+        return 1.0 / rtf if rtf else ADMISSION_DEFAULT_SPEED
+
+    intervals: Dict[str, List[tuple]] = {}
+    for job in jobs:
+        intervals.setdefault(job.worker or "", []).append((job.started_at, job.finished_at))
+    busy = 0.0
+    for spans in intervals.values():
+        spans.sort()
+        start, end = spans[0]
+        for span_start, span_end in spans[1:]:
+            if span_start > end:
+                busy += (end - start).total_seconds()
+                start, end = span_start, span_end
+            else:
+                end = max(end, span_end)
+        busy += (end - start).total_seconds()
+
+    audio = sum(job_audio_seconds(job) for job in jobs)
+    if busy <= 0 or audio <= 0:
+        return ADMISSION_DEFAULT_SPEED
+    return audio / busy
+
+
+def _outstanding(db) -> List[TranscriptionJob]:
+    return db.query(TranscriptionJob).filter(TranscriptionJob.status.in_(["queued", "running"])).all()
+
+
+def _remaining(job: TranscriptionJob, speed: float, now: datetime) -> float:
+    """Сколько секунд аудио задачи ещё не распознано (у выполняемой — с учётом прошедшего времени)"""
+    audio = job_audio_seconds(job)
+    if job.status == "running" and job.started_at:
+        audio -= (now - job.started_at).total_seconds() * speed
+    return max(0.0, audio)
+
+
+def check(model: Optional[str], owner: str, duration_seconds: Optional[float]):
+    """Можно ли принять запись длительностью duration_seconds для модели model от owner.
+
+    Если нельзя — бросает AdmissionRejected.
+    model=None — проверить только лимиты пользователя (модель ещё неизвестна, ETA не считается).
+    duration_seconds=0 — проверка до приёма файла: не упёрлись ли уже в лимиты.
+    """
+    db = SessionLocal()
+    try:
+        jobs = _outstanding(db)
+        speeds = {name: model_speed(db, name) for name in {job.model for job in jobs} | ({model} if model else set())}
+    finally:
+        db.close()
+
+    now = datetime.utcnow()
+    if duration_seconds is None:
+        duration = ADMISSION_UNKNOWN_DURATION_SECONDS if model else 0.0
+    else:
+        duration = duration_seconds
+
+    def capacity(name: str) -> float:
+        # Секунд аудио в секунду, которые модель распознаёт всеми своими слотами
+        return speeds[name] * job_queue.concurrency_for(name)
+
+    own = [job for job in jobs if job.owner == owner]
+    if own:
+        own_audio = sum(_remaining(job, speeds[job.model], now) for job in own)
+        # Время, за которое рассосётся работа пользователя, — по самой медленной из его моделей
+        own_capacity = min(capacity(job.model) for job in own)
+        if USER_MAX_QUEUED_JOBS > 0 and len(own) >= USER_MAX_QUEUED_JOBS:
+            first = min(own, key=lambda job: job.id)
+            raise AdmissionRejected(
+                429,
+                f"У вас уже {len(own)} незавершённых транскрипций (лимит {USER_MAX_QUEUED_JOBS}). "
+                f"Дождитесь их окончания",
+                _remaining(first, speeds[first.model], now) / speeds[first.model]
+            )
+        # Запись длиннее лимита принимается, только если у пользователя нет другой работы
+        if USER_MAX_QUEUED_AUDIO_SECONDS > 0 and own_audio + duration > USER_MAX_QUEUED_AUDIO_SECONDS:
+            raise AdmissionRejected(
+                429,
+                f"У вас в очереди уже {own_audio / 3600:.1f} ч аудио "
+                f"(лимит {USER_MAX_QUEUED_AUDIO_SECONDS / 3600:.1f} ч). Дождитесь окончания обработки",
+                (own_audio + duration - USER_MAX_QUEUED_AUDIO_SECONDS) / own_capacity
+            )
+
+    if model is None:
+        return
+
+    backlog = sum(_remaining(job, speeds[model], now) for job in jobs if job.model == model)
+    wait = backlog / capacity(model)
+    if ADMISSION_MAX_WAIT_SECONDS > 0 and wait > ADMISSION_MAX_WAIT_SECONDS:
+        logger.warning(f"Rejecting {model} job from {owner}: queue wait {wait:.0f}s exceeds {ADMISSION_MAX_WAIT_SECONDS:.0f}s")
+        raise AdmissionRejected(
+            503,
+            f"Сервер перегружен: очередь модели {model} займёт около {wait / 60:.0f} мин. Попробуйте позже",
+            wait - ADMISSION_MAX_WAIT_SECONDS
+        )
+
+
+def estimate(file_id: str) -> Optional[dict]:
+    """Оценка для ожидающей задачи: место в очереди модели, через сколько секунд она начнётся
+    и будет готова (по порядку schedule и скорости модели). None — задача не ждёт в очереди.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(TranscriptionJob).filter(
+            TranscriptionJob.file_id == file_id,
+            TranscriptionJob.status == "queued"
+        ).order_by(TranscriptionJob.id.desc()).first()
+        ahead = job_queue.jobs_ahead(db, file_id) if job else None
+        if ahead is None:
+            return None
+        speed = model_speed(db, job.model)
+        running = db.query(TranscriptionJob).filter(
+            TranscriptionJob.model == job.model,
+            TranscriptionJob.status == "running"
+        ).all()
+    finally:
+        db.close()
+
+    now = datetime.utcnow()
+    slots = job_queue.concurrency_for(job.model)
+    if len(running) + len(ahead) < slots:
+        start = 0.0
+    else:
+        work = sum(_remaining(other, speed, now) for other in running) + sum(job_audio_seconds(other) for other in ahead)
+        start = work / (speed * slots)
+    return {
+        "queue_position": len(ahead) + 1,
+        "priority": job.priority,
+        "estimated_start_seconds": round(start),
+        "eta_seconds": round(start + job_audio_seconds(job) / speed)
+    }
+
+
+def decode_profile(model: str, requested: Optional[str] = None) -> str:
+    """Профиль декодирования для запускаемой задачи: выбранный пользователем, иначе по очереди модели"""
+    from .whisper_service import DECODE_PROFILES, decode_profile_name
+
+    if requested in DECODE_PROFILES:
+        return requested
+    profile = decode_profile_name()
+    if DECODE_FAST_QUEUE_SECONDS <= 0 or profile == "fast":
+        return profile
+    db = SessionLocal()
+    try:
+        queued = db.query(TranscriptionJob).filter(
+            TranscriptionJob.model == model,
+            TranscriptionJob.status == "queued"
+        ).all()
+        if not queued:
+            return profile
+        speed = model_speed(db, model)
+    finally:
+        db.close()
+    # Ожидание задач, которые стоят за этой: столько их очередь займёт при текущей скорости модели
+    wait = sum(job_audio_seconds(job) for job in queued) / (speed * job_queue.concurrency_for(model))
+    if wait >= DECODE_FAST_QUEUE_SECONDS:
+        logger.info(f"Queue of {model} is {wait:.0f}s deep, decoding with the fast profile")
+        return "fast"
+    return profile
@@ -4,10 +4,10 @@ AI Service для обработки транскрипций
 """
 import json
 import logging
-import threading
 from typing import Optional, Dict, List
 from pathlib import Path
-from .config import TEXT_DIR
+from .segment_store import plain_text, read_segments
+from .model_manager import model_manager
 
 logger = logging.getLogger(__name__)
 
@@ -27,127 +27,103 @@ except (ImportError, AttributeError) as e:
     GOOGLETRANS_AVAILABLE = False
     logger.warning(f"googletrans не установлен или несовместим. Перевод будет недоступен. Ошибка: {e}")
 
-# Кэш для моделей (чтобы не загружать каждый раз)
-_model_cache = {}
-# Трекинг загрузки моделей (защита от параллельной загрузки)
-_model_loading = {}
+# Примерный объём памяти AI-моделей (МБ) для менеджера моделей
+SENTIMENT_MODEL_SIZE_MB = 150
+SUMMARIZATION_MODEL_SIZE_MB = 1100
 
 
 def get_transcript_text(file_id: str) -> Optional[str]:
-    """Получить текст транскрипции по file_id"""
-    text_path = TEXT_DIR / f"{file_id}.txt"
-    if not text_path.exists():
-        return None
+    """Получить текст транскрипции по file_id (только слова, без таймкодов)"""
     try:
-        return text_path.read_text(encoding='utf-8')
+        segments = read_segments(file_id)
     except Exception as e:
         logger.error(f"Error reading transcript {file_id}: {e}")
         return None
+    if segments is None:
+        return None
+    return plain_text(segments)
 
 
 def _get_sentiment_model():
-    """Получить модель для sentiment analysis (кэшированная, с защитой от параллельной загрузки)"""
+    """Получить модель для sentiment analysis (через менеджер моделей: одна загрузка, выгрузка по простою)"""
     if not TRANSFORMERS_AVAILABLE:
         return None
     
-    cache_key = "sentiment"
-    
-    # Если модель уже загружена, возвращаем её
-    if cache_key in _model_cache:
-        return _model_cache[cache_key]
-    
-    # Проверяем, не загружается ли модель сейчас
-    if cache_key not in _model_loading:
-        _model_loading[cache_key] = threading.Lock()
-    
-    # Если модель загружается в другом потоке, ждем
-    if _model_loading[cache_key].locked():
-        logger.info("Sentiment model is being loaded in another thread, waiting...")
-        _model_loading[cache_key].acquire()
-        _model_loading[cache_key].release()
-        # После загрузки проверяем кэш снова
-        if cache_key in _model_cache:
-            return _model_cache[cache_key]
-    
-    # Загружаем модель
-    with _model_loading[cache_key]:
-        # Двойная проверка (double-check locking pattern)
-        if cache_key in _model_cache:
-            return _model_cache[cache_key]
-        
-        try:
-            # Используем русскоязычную модель для sentiment analysis
-            model_name = "cointegrated/rubert-tiny-sentiment-balanced"
-            logger.info(f"Loading sentiment model: {model_name} (this may take a while on first use)...")
-            _model_cache[cache_key] = pipeline(
-                "sentiment-analysis",
-                model=model_name,
-                tokenizer=model_name
-            )
-            logger.info(f"Loaded sentiment model: {model_name}")
-        except Exception as e:
-            logger.error(f"Error loading sentiment model: {e}")
-            return None
+    # Используем русскоязычную модель для sentiment analysis
+    model_name = "cointegrated/rubert-tiny-sentiment-balanced"
+    
+    def load():
+        logger.info(f"Loading sentiment model: {model_name} (this may take a while on first use)...")
+        model = pipeline(
+            "sentiment-analysis",
+            model=model_name,
+            tokenizer=model_name
+        )
+        logger.info(f"Loaded sentiment model: {model_name}")
+        return model
     
-    return _model_cache.get(cache_key)
+    try:
+        return model_manager.get("ai:sentiment", load, SENTIMENT_MODEL_SIZE_MB)
+    except Exception as e:
+        logger.error(f"Error loading sentiment model: {e}")
+        return None
 
 
 def _get_summarization_model():
-    """Получить модель для суммаризации (кэшированная, с защитой от параллельной загрузки)"""
+    """Получить модель для суммаризации (через менеджер моделей: одна загрузка, выгрузка по простою)"""
     if not TRANSFORMERS_AVAILABLE:
         return None
     
-    cache_key = "summarization"
-    
-    # Если модель уже загружена, возвращаем её
-    if cache_key in _model_cache:
-        return _model_cache[cache_key]
-    
-    # Проверяем, не загружается ли модель сейчас
-    if cache_key not in _model_loading:
-        _model_loading[cache_key] = threading.Lock()
-    
-    # Если модель загружается в другом потоке, ждем
-    if _model_loading[cache_key].locked():
-        logger.info("Summarization model is being loaded in another thread, waiting...")
-        _model_loading[cache_key].acquire()
-        _model_loading[cache_key].release()
-        # После загрузки проверяем кэш снова
-        if cache_key in _model_cache:
-            return _model_cache[cache_key]
-    
-    # Загружаем модель
-    with _model_loading[cache_key]:
-        # Двойная проверка (double-check locking pattern)
-        if cache_key in _model_cache:
-            return _model_cache[cache_key]
-        
-        try:
-            # Используем русскоязычную модель для суммаризации
-            model_name = "IlyaGusev/rut5_base_sum_gazeta"
-            logger.info(f"Loading summarization model: {model_name} (this may take a while on first use)...")
-            _model_cache[cache_key] = pipeline(
-                "summarization",
-                model=model_name,
-                tokenizer=model_name
+    # Используем русскоязычную модель для суммаризации
+    model_name = "IlyaGusev/rut5_base_sum_gazeta"
+    
+    def load():
+        logger.info(f"Loading summarization model: {model_name} (this may take a while on first use)...")
+        model = pipeline(
+            "summarization",
+            model=model_name,
+            tokenizer=model_name
+        )
+        logger.info(f"Loaded summarization model: {model_name}")
+        return model
+    
+    try:
+        return model_manager.get("ai:summarization", load, SUMMARIZATION_MODEL_SIZE_MB)
+    except ValueError as e:
+        # Специальная обработка ошибки torch версии
+        if "torch to at least v2.6" in str(e) or "CVE-2025-32434" in str(e):
+            logger.warning(
+                f"Summarization model requires torch 2.6+ (current: {__import__('torch').__version__}). "
+                f"Summarization will use fallback method (first sentences). "
+                f"To enable full summarization, upgrade torch: pip install --upgrade torch>=2.6.0"
             )
-            logger.info(f"Loaded summarization model: {model_name}")
-        except ValueError as e:
-            # Специальная обработка ошибки torch версии
-            if "torch to at least v2.6" in str(e) or "CVE-2025-32434" in str(e):
-                logger.warning(
-                    f"Summarization model requires torch 2.6+ (current: {__import__('torch').__version__}). "
-                    f"Summarization will use fallback method (first sentences). "
-                    f"To enable full summarization, upgrade torch: pip install --upgrade torch>=2.6.0"
-                )
-            else:
-                logger.warning(f"Could not load summarization model: {e}")
-            return None
-        except Exception as e:
+        else:
             logger.warning(f"Could not load summarization model: {e}")
-            return None
-    
-    return _model_cache.get(cache_key)
+        return None
+    except Exception as e:
+        logger.warning(f"Could not load summarization model: {e}")
+        return None
+
+
+def warmup(kind: str) -> bool:
+    """Загрузить AI-модель ("sentiment" или "summarization") и прогнать на ней короткий текст.
+
+    Возвращает False, если модель недоступна (нет transformers, старый torch) — тогда
+    функции работают на запасных методах, как и без предзагрузки.
+    """
+    loaders = {"sentiment": _get_sentiment_model, "summarization": _get_summarization_model}
+    if kind not in loaders:
+        raise ValueError(f"Unknown AI model: {kind}")
+    model = loaders[kind]()
+    if model is None:
+        return False
+    model_manager.pin(f"ai:{kind}")
+    sample = "Сегодня мы обсудили план работ на следующую неделю и распределили задачи."
+    if kind == "summarization":
+        model(sample, max_length=20, min_length=5)
+    else:
+        model(sample)
+    return True
 
 
 def generate_summary(text: str, max_length: int = 150, min_length: int = 30) -> Optional[str]:
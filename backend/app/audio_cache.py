@@ -0,0 +1,246 @@
+"""
+Кэш декодированного аудио: каждая запись декодируется (ffmpeg/PyAV) один раз в PCM 16 кГц моно
+float32 и хранится рядом с аудио в .npy. Дальше повторы, другие модели и куски длинных файлов
+читают его через memory-map — без повторного декодирования и временных копий файла.
+
+Файл PCM называется по SHA-256 аудио (одинаковые загрузки делят его), для старых записей
+без хэша — по file_id.
+
+Рядом с PCM хранится разметка речи Silero VAD — {ключ}.speech-{параметры}.npy, массив int64
+[[начало, конец], ...] в отсчётах. Она считается один раз на запись и набор параметров VAD:
+распознавание, нарезка длинных записей, диаризация, пакетный режим и плеер берут её отсюда.
+
+PCM занимает около 64 КБ на секунду записи, поэтому кэш чистится (prune_pcm): PCM записей, которые
+не ждут и не проходят распознавание, удаляется через PCM_CACHE_TTL_HOURS после последнего
+обращения, а сверх PCM_CACHE_MAX_MB — начиная с давно не использованных. Разметка речи
+маленькая и остаётся; PCM при следующем обращении декодируется заново.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .config import PCM_CACHE_MAX_MB, PCM_CACHE_TTL_HOURS, PCM_DIR
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Параметры VAD разметки по умолчанию: как у профиля balanced, диаризации и нарезки длинных записей
+DEFAULT_VAD_PARAMETERS = {"min_silence_duration_ms": 500}
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class PcmRef:
+    """Ссылка на участок закэшированного PCM [start, end) в отсчётах.
+
+    Лёгкая и сериализуемая: в пул процессов уходит путь, а не сами данные.
+    """
+
+    def __init__(self, path: Path, start: int = 0, end: Optional[int] = None):
+        self.path = Path(path)
+        self.start = start
+        self.end = end
+
+    def load(self) -> np.ndarray:
+        """Массив float32 через memory-map (данные читаются с диска по мере обращения)"""
+        audio = np.load(self.path, mmap_mode="r")
+        return audio[self.start:self.end]
+
+    def seconds(self) -> float:
+        """Длительность участка в секундах (читается только заголовок файла)"""
+        total = len(np.load(self.path, mmap_mode="r"))
+        end = total if self.end is None else min(self.end, total)
+        return max(0, end - self.start) / SAMPLE_RATE
+
+    def slice(self, start: int, end: Optional[int] = None) -> "PcmRef":
+        """Участок внутри этого участка (смещения относительно self.start; end=None — до конца)"""
+        return PcmRef(self.path, self.start + start, self.start + end if end is not None else self.end)
+
+
+def pcm_path(key: str) -> Path:
+    return PCM_DIR / f"{key}.npy"
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def ensure_pcm(audio_path: Path, key: str) -> PcmRef:
+    """Вернуть PCM записи, декодируя её только при первом обращении"""
+    path = pcm_path(key)
+    if path.exists():
+        _touch(path)
+        return PcmRef(path)
+
+    # Два воркера с одной записью не декодируют её дважды
+    with _lock_for(key):
+        if path.exists():
+            return PcmRef(path)
+        from faster_whisper.audio import decode_audio
+
+        PCM_DIR.mkdir(parents=True, exist_ok=True)
+        # Открываем файл сами и передаём объект: PyAV не трогает путь, поэтому
+        # не-ASCII имена не требуют временной копии
+        with open(audio_path, "rb") as f:
+            audio = decode_audio(f, sampling_rate=SAMPLE_RATE)
+        tmp_path = PCM_DIR / f"{key}.{uuid.uuid4().hex}.tmp.npy"
+        np.save(tmp_path, audio.astype(np.float32, copy=False))
+        os.replace(tmp_path, path)
+        logger.info(f"Decoded {audio_path.name} to PCM cache ({len(audio) / SAMPLE_RATE:.0f} sec)")
+        return PcmRef(path)
+
+
+def _touch(path: Path):
+    """Отметить обращение к PCM: по времени изменения файла prune_pcm выбирает, что удалить"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune_pcm(keep: Set[str]):
+    """Удалить PCM, к которому давно не обращались, и самый старый сверх бюджета.
+
+    keep — ключи записей, которые ждут или проходят распознавание: их PCM не трогается.
+    """
+    if not PCM_DIR.exists():
+        return
+    entries = []
+    total = 0  # Весь PCM, включая тот, что удалять нельзя
+    for path in PCM_DIR.glob("*.npy"):
+        key = path.stem
+        if "." in key:
+            # Разметка речи ({ключ}.speech-...) и недописанные файлы (.tmp)
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        total += stat.st_size
+        if key not in keep:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    now = time.time()
+    removed = 0
+    for mtime, size, path in entries:
+        expired = PCM_CACHE_TTL_HOURS > 0 and now - mtime > PCM_CACHE_TTL_HOURS * 3600
+        over_budget = PCM_CACHE_MAX_MB > 0 and total > PCM_CACHE_MAX_MB * 1024 * 1024
+        if not expired and not over_budget:
+            continue
+        try:
+            path.unlink()
+        except OSError as e:
+            # В Windows файл, открытый через memory-map, удалить нельзя — попробуем в следующий раз
+            logger.debug(f"Cannot remove PCM cache {path.name}: {e}")
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info(f"PCM cache pruned: {removed} files removed, {total / (1024 * 1024):.0f} MB left")
+
+
+def speech_path(key: str, vad_parameters: Optional[dict] = None) -> Path:
+    options = DEFAULT_VAD_PARAMETERS if vad_parameters is None else vad_parameters
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return PCM_DIR / f"{key}.speech-{digest}.npy"
+
+
+def _slice_regions(regions: np.ndarray, pcm: PcmRef) -> List[dict]:
+    """Участки речи всей записи -> участки внутри pcm (отсчёты от его начала)"""
+    end = pcm.start + round(pcm.seconds() * SAMPLE_RATE)
+    return [
+        {"start": max(int(start), pcm.start) - pcm.start, "end": min(int(stop), end) - pcm.start}
+        for start, stop in regions if stop > pcm.start and start < end
+    ]
+
+
+def speech_timeline(pcm: PcmRef, vad_parameters: Optional[dict] = None) -> List[dict]:
+    """Участки речи внутри pcm: [{start, end}] в отсчётах от его начала (как get_speech_timestamps).
+
+    VAD считается по всей записи при первом обращении с данными параметрами (None — DEFAULT_VAD_PARAMETERS)
+    и сохраняется рядом с PCM; куски и продолжения с чекпоинта получают вырезку из неё.
+    """
+    options = DEFAULT_VAD_PARAMETERS if vad_parameters is None else vad_parameters
+    path = speech_path(pcm.path.stem, options)
+    if not path.exists():
+        # Два воркера с одной записью не считают VAD дважды
+        with _lock_for(path.name):
+            if not path.exists():
+                from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+                audio = np.load(pcm.path, mmap_mode="r")
+                speech = get_speech_timestamps(audio, VadOptions(**options))
+                regions = np.array([[r["start"], r["end"]] for r in speech], dtype=np.int64).reshape(-1, 2)
+                tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp.npy")
+                np.save(tmp_path, regions)
+                os.replace(tmp_path, path)
+                logger.info(f"Speech timeline for {pcm.path.stem}: {len(regions)} regions, "
+                            f"{speech_seconds(speech):.0f} of {len(audio) / SAMPLE_RATE:.0f} sec")
+    return _slice_regions(np.load(path), pcm)
+
+
+def cached_speech_seconds(key: str) -> Optional[float]:
+    """Длительность речи записи по уже посчитанной разметке (None — её ещё нет)"""
+    path = speech_path(key)
+    if not path.exists():
+        return None
+    regions = np.load(path)
+    return float((regions[:, 1] - regions[:, 0]).sum()) / SAMPLE_RATE
+
+
+def speech_seconds(speech: List[dict]) -> float:
+    return sum(r["end"] - r["start"] for r in speech) / SAMPLE_RATE
+
+
+def remove_pcm(key: str):
+    """Удалить закэшированный PCM и разметку речи (игнорируя ошибки)"""
+    try:
+        pcm_path(key).unlink(missing_ok=True)
+        for path in PCM_DIR.glob(f"{key}.speech-*.npy"):
+            path.unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Cannot remove PCM cache {key}: {e}")
+
+
+@contextmanager
+def ascii_path(path: Path) -> Iterator[Path]:
+    """Путь к файлу без не-ASCII символов (для библиотек, не открывающих Unicode-пути, как потоки на Windows).
+
+    Вместо копии файла создаётся жёсткая ссылка с ASCII-именем: рядом с файлом (та же файловая
+    система), а если каталог сам не ASCII — во временном каталоге. Если ссылку сделать нельзя,
+    отдаётся исходный путь.
+    """
+    path = Path(path)
+    if str(path).isascii():
+        yield path
+        return
+    name = f"wf_{uuid.uuid4().hex}{path.suffix.lower() if path.suffix.isascii() else ''}"
+    link_dir = path.parent if str(path.parent).isascii() else Path(tempfile.gettempdir())
+    link = link_dir / name
+    try:
+        os.link(path, link)
+    except OSError as e:
+        logger.warning(f"Cannot hardlink {path.name} to an ASCII name ({e}), using the original path")
+        yield path
+        return
+    try:
+        yield link
+    finally:
+        try:
+            link.unlink(missing_ok=True)
+        except OSError:
+            pass
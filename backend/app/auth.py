@@ -79,3 +79,13 @@ def verify_reset_token(token: str):
         return None
     except JWTError:
         return None
+
+def decode_token(token: str):
+    """Возвращает данные access-токена или None, если токен недействителен или истёк"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload.get("type") == "password_reset":
+            return None
+        return payload
+    except JWTError:
+        return None
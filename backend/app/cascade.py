@@ -0,0 +1,138 @@
+"""
+Каскадное распознавание: вся запись — быстрой моделью, сомнительные места — ещё раз большой.
+
+После первого прохода сегмент считается слабым, если у него
+- низкая средняя логвероятность токенов (avg_logprob < CASCADE_MIN_AVG_LOGPROB),
+- высокая вероятность тишины при непустом тексте (no_speech_prob > CASCADE_MAX_NO_SPEECH_PROB) —
+  похоже на галлюцинацию,
+- или текст сжимается слишком хорошо (compression_ratio > CASCADE_MAX_COMPRESSION_RATIO) —
+  модель зациклилась на повторах.
+Подряд идущие слабые сегменты объединяются в окно; окно с небольшим запасом по краям
+(не заходя на соседние хорошие сегменты) распознаётся моделью уточнения, и её сегменты
+заменяют слабые (если речи в окне она не нашла, слабые сегменты выбрасываются — обычно это
+галлюцинации первого прохода на шуме). На чистой записи уточнять почти нечего, поэтому каскад стоит чуть дороже
+быстрой модели, а качество в трудных местах — как у большой.
+"""
+from typing import Callable, List, Optional, Tuple
+import logging
+import threading
+import zlib
+
+from .audio_cache import SAMPLE_RATE, PcmRef
+from .config import (
+    CASCADE_MAX_COMPRESSION_RATIO, CASCADE_MAX_NO_SPEECH_PROB, CASCADE_MIN_AVG_LOGPROB, CASCADE_PAD_SECONDS
+)
+from .metrics import merge_stats
+from .utils import format_clock
+
+logger = logging.getLogger(__name__)
+
+# Окно короче этого не распознаётся заново
+MIN_WINDOW_SECONDS = 0.2
+
+
+def compression_ratio(text: str) -> float:
+    """Степень сжатия текста zlib — как у Whisper: у зациклившегося вывода она высокая"""
+    data = text.encode("utf-8")
+    return len(data) / len(zlib.compress(data)) if data else 0.0
+
+
+def is_weak(seg: dict) -> bool:
+    """Сегмент первого прохода, который стоит распознать заново большой моделью"""
+    if not seg.get("text"):
+        return False
+    if seg.get("avg_logprob") is not None and seg["avg_logprob"] < CASCADE_MIN_AVG_LOGPROB:
+        return True
+    if seg.get("no_speech_prob") is not None and seg["no_speech_prob"] > CASCADE_MAX_NO_SPEECH_PROB:
+        return True
+    return compression_ratio(seg["text"]) > CASCADE_MAX_COMPRESSION_RATIO
+
+
+def weak_windows(segments: List[dict], total_seconds: float) -> List[Tuple[int, int, float, float]]:
+    """Окна для уточнения: (первый слабый сегмент, следующий за последним, начало, конец окна в секундах).
+
+    Окно — серия подряд идущих слабых сегментов плюс CASCADE_PAD_SECONDS с каждой стороны,
+    но не дальше соседних сегментов, которые остаются как есть.
+    """
+    windows = []
+    i = 0
+    while i < len(segments):
+        if not is_weak(segments[i]):
+            i += 1
+            continue
+        first = i
+        while i < len(segments) and is_weak(segments[i]):
+            i += 1
+        start = segments[first]["start"] - CASCADE_PAD_SECONDS
+        end = segments[i - 1]["end"] + CASCADE_PAD_SECONDS
+        if first > 0:
+            start = max(start, segments[first - 1]["end"])
+        if i < len(segments):
+            end = min(end, segments[i]["start"])
+        windows.append((first, i, max(0.0, start), min(total_seconds, end)))
+    return windows
+
+
+def refine(pcm: PcmRef, segments: List[dict], refine_model: str, language: Optional[str],
+           segment_source: Callable, word_timestamps: bool = False, profile: Optional[str] = None,
+           progress_callback: Optional[Callable[[float, str], None]] = None,
+           cancel_event: Optional[threading.Event] = None, stats: Optional[dict] = None) -> List[dict]:
+    """Распознать окна слабых сегментов моделью refine_model и вклеить результат на их место.
+
+    segments — сегменты первого прохода с таймкодами от начала pcm.
+    language — язык записи (при автоопределении — тот, что определил первый проход):
+    в коротком окне модель определила бы его хуже.
+    progress_callback получает долю распознанного аудио окон (0–100).
+    stats — сюда добавляются audio_seconds (сколько аудио распознано заново) и статистика
+    распознавания окон (речь, а в режиме process — ресурсы процесса пула) для метрик задачи.
+    """
+    windows = weak_windows(segments, pcm.seconds())
+    if not windows:
+        return segments
+    total = sum(end - start for _, _, start, end in windows)
+    logger.info(f"Cascade: refining {sum(last - first for first, last, _, _ in windows)} of {len(segments)} segments "
+                f"({total:.1f} sec in {len(windows)} windows) with {refine_model}")
+
+    result = []
+    position = 0
+    done = 0.0
+    for n, (first, last, start, end) in enumerate(windows, 1):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        if end - start < MIN_WINDOW_SECONDS:
+            # Соседние сегменты перекрываются — уточнять нечего, оставляем как есть
+            continue
+        if progress_callback:
+            progress_callback(100.0 * done / total,
+                              f"Уточнение моделью {refine_model}: фрагмент {n} из {len(windows)} ({format_clock(start)})...")
+        piece = pcm.slice(int(start * SAMPLE_RATE), int(end * SAMPLE_RATE))
+        refined = []
+        window_stats = {}
+        source = segment_source(piece, refine_model, language, None, word_timestamps, window_stats, profile)
+        try:
+            for seg in source:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                refined.append(_place(seg, start, end))
+        finally:
+            source.close()
+        if stats is not None:
+            merge_stats(stats, window_stats)
+            stats["audio_seconds"] = stats.get("audio_seconds", 0.0) + end - start
+        result.extend(segments[position:first])
+        result.extend(seg for seg in refined if seg["text"])
+        position = last
+        done += end - start
+    result.extend(segments[position:])
+    if progress_callback:
+        progress_callback(100.0, "Уточнение завершено")
+    return result
+
+
+def _place(seg: dict, start: float, end: float) -> dict:
+    """Сегмент окна — на шкалу всей записи, в пределах окна"""
+    seg = dict(seg, start=min(seg["start"] + start, end), end=min(seg["end"] + start, end))
+    if seg.get("words"):
+        seg["words"] = [dict(w, start=min(w["start"] + start, end), end=min(w["end"] + start, end))
+                        for w in seg["words"]]
+    return seg
@@ -0,0 +1,234 @@
+"""
+Параллельная транскрипция длинных записей.
+
+Аудио берётся из кэша PCM (декодируется один раз), режется по паузам из сохранённой разметки
+речи Silero VAD (входит в faster-whisper, считается один раз на запись), куски распознаются одновременно, а сегменты сшиваются обратно
+с абсолютными таймкодами.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+import logging
+import re
+import threading
+
+import numpy as np
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+from .audio_cache import PcmRef, speech_timeline
+from .config import LONG_FILE_CHUNK_SECONDS, LONG_FILE_WORKERS
+from .metrics import merge_stats
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Если речь идёт без пауз дольше куска, режем принудительно и даём кускам перекрыться
+OVERLAP_SECONDS = 2.0
+
+
+class Chunk:
+    """Кусок аудио: [start, end) — что декодируем, [keep_from, keep_to) — за какие сегменты отвечаем"""
+
+    def __init__(self, start: int, end: int, keep_from: int, keep_to: int):
+        self.start = start
+        self.end = end
+        self.keep_from = keep_from
+        self.keep_to = keep_to
+
+
+def split_at_silences(audio: np.ndarray, chunk_seconds: float = LONG_FILE_CHUNK_SECONDS,
+                      speech: Optional[List[dict]] = None) -> List[Chunk]:
+    """Разбить аудио на куски ~chunk_seconds, разрезая посередине пауз между фразами"""
+    if speech is None:
+        speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    if not speech:
+        return []
+
+    target = int(chunk_seconds * SAMPLE_RATE)
+    overlap = int(OVERLAP_SECONDS * SAMPLE_RATE)
+    total = len(audio)
+
+    # Точки разреза в отсчётах: (позиция, разрез внутри речи?)
+    cuts = [(0, False)]
+    chunk_start = speech[0]["start"]
+    for i, region in enumerate(speech):
+        if i > 0 and region["end"] - chunk_start > target:
+            # Следующая фраза не помещается — режем в середине паузы перед ней
+            cuts.append(((speech[i - 1]["end"] + region["start"]) // 2, False))
+            chunk_start = region["start"]
+        # Фраза длиннее куска: режем принудительно внутри неё
+        while region["end"] - chunk_start > target + overlap:
+            chunk_start += target
+            cuts.append((chunk_start, True))
+    cuts.append((total, False))
+
+    chunks = []
+    for (keep_from, forced_from), (keep_to, forced_to) in zip(cuts, cuts[1:]):
+        if keep_to <= keep_from:
+            continue
+        has_speech = any(r["start"] < keep_to and r["end"] > keep_from for r in speech)
+        if not has_speech:
+            continue
+        # Перекрытие нужно только там, где разрез прошёл по речи
+        chunks.append(Chunk(
+            start=max(0, keep_from - overlap) if forced_from else keep_from,
+            end=min(total, keep_to + overlap) if forced_to else keep_to,
+            keep_from=keep_from,
+            keep_to=keep_to
+        ))
+    return chunks
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _drop_repeated_prefix(prev_text: str, text: str, max_words: int = 8) -> str:
+    """Убрать из начала text слова, которыми заканчивается prev_text (дубли на стыке кусков)"""
+    prev_words = _words(prev_text)
+    words = text.split()
+    normalized = [_words(w) for w in words]
+    for n in range(min(max_words, len(prev_words), len(words)), 0, -1):
+        head = [w for part in normalized[:n] for w in part]
+        if head and head == prev_words[-len(head):]:
+            return " ".join(words[n:])
+    return text
+
+
+def stitch_segments(results: List[Tuple[Chunk, List[dict]]]) -> List[dict]:
+    """Сшить сегменты кусков: сдвинуть таймкоды, отбросить чужие и повторённые на стыке"""
+    stitched: List[dict] = []
+    for chunk, segments in sorted(results, key=lambda r: r[0].start):
+        stitch_chunk(stitched, chunk, segments)
+    return stitched
+
+
+def stitch_chunk(stitched: List[dict], chunk: Chunk, segments: List[dict]) -> List[dict]:
+    """Пришить к stitched сегменты следующего по порядку куска. Возвращает добавленные сегменты"""
+    added = []
+    offset = chunk.start / SAMPLE_RATE
+    keep_to = chunk.keep_to / SAMPLE_RATE
+    first_in_chunk = True
+    for seg in segments:
+        seg = dict(seg, start=seg["start"] + offset, end=seg["end"] + offset)
+        if seg.get("words"):
+            seg["words"] = [dict(w, start=w["start"] + offset, end=w["end"] + offset) for w in seg["words"]]
+        # Сегменты, начавшиеся в зоне следующего куска, возьмём из него
+        if seg["start"] >= keep_to:
+            continue
+        # Сегменты из перекрытия, уже покрытые предыдущим куском
+        if stitched and seg["end"] <= stitched[-1]["end"]:
+            continue
+        if stitched and first_in_chunk:
+            prev = stitched[-1]
+            seg["start"] = max(seg["start"], prev["end"])
+            seg["text"] = _drop_repeated_prefix(prev["text"], seg["text"])
+            if seg.get("words"):
+                # Слова, уже вошедшие в предыдущий сегмент
+                seg["words"] = [w for w in seg["words"] if w["end"] > prev["end"]]
+        first_in_chunk = False
+        if seg["text"] and seg["end"] > seg["start"]:
+            stitched.append(seg)
+            added.append(seg)
+    return added
+
+
+def transcribe_long(pcm: Union[PcmRef, np.ndarray], model_name: str,
+                    language: Optional[str] = None,
+                    progress_callback: Optional[Callable[[float, str], None]] = None,
+                    segment_source: Optional[Callable] = None,
+                    word_timestamps: bool = False,
+                    speech: Optional[List[dict]] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    stats: Optional[dict] = None,
+                    profile: Optional[str] = None) -> Iterator[dict]:
+    """Транскрибирует длинную запись (PCM 16 кГц) кусками параллельно и отдаёт сегменты по порядку.
+
+    speech — участки речи VAD (в отсчётах); по умолчанию для PcmRef — из разметки записи в кэше.
+    cancel_event — флаг отмены: куски бросают распознавание на ближайшем сегменте, новые не начинаются.
+    stats — словарь для метрик: статистика кусков складывается (см. metrics.merge_stats).
+    profile — профиль декодирования всех кусков.
+    """
+    if segment_source is None:
+        from .whisper_service import transcribe_segments as segment_source
+
+    audio = pcm.load() if isinstance(pcm, PcmRef) else pcm
+
+    if progress_callback:
+        progress_callback(0.0, "Поиск пауз...")
+    if speech is None and isinstance(pcm, PcmRef):
+        speech = speech_timeline(pcm)
+    chunks = split_at_silences(audio, speech=speech)
+    if not chunks:
+        return
+
+    total_samples = sum(c.end - c.start for c in chunks)
+    done_samples = 0
+    lock = threading.Lock()
+    logger.info(f"Long file split into {len(chunks)} chunks, decoding with {LONG_FILE_WORKERS} workers")
+
+    # Остановка остальных кусков, если один упал или распознавание прервали
+    stop = threading.Event()
+
+    def cancelled() -> bool:
+        return stop.is_set() or (cancel_event is not None and cancel_event.is_set())
+
+    def run_chunk(chunk: Chunk) -> Tuple[Chunk, List[dict]]:
+        segments = []
+        if cancelled():
+            return chunk, segments
+        # Куски передаём ссылками на PCM: в пул процессов уходит путь, а не мегабайты данных
+        piece = pcm.slice(chunk.start, chunk.end) if isinstance(pcm, PcmRef) else audio[chunk.start:chunk.end]
+        # Прогресс — распознанное аудио всех кусков: конец очередного сегмента внутри куска
+        chunk_stats = {}
+        source = segment_source(piece, model_name, language, None, word_timestamps, chunk_stats, profile)
+        chunk_done = 0
+        try:
+            for seg in source:
+                if cancelled():
+                    return chunk, segments
+                segments.append(seg)
+                chunk_done = advance(chunk, chunk_done, int(seg["end"] * SAMPLE_RATE))
+        finally:
+            source.close()
+        advance(chunk, chunk_done, chunk.end - chunk.start)
+        if stats is not None:
+            with lock:
+                merge_stats(stats, chunk_stats)
+        return chunk, segments
+
+    def advance(chunk: Chunk, chunk_done: int, position: int) -> int:
+        nonlocal done_samples
+        position = min(max(position, chunk_done), chunk.end - chunk.start)
+        with lock:
+            done_samples += position - chunk_done
+            if progress_callback and position > chunk_done:
+                progress_callback(100.0 * done_samples / total_samples,
+                                  f"Распознано {done_samples * 100 // total_samples}% ({len(chunks)} фрагментов)...")
+        return position
+
+    if progress_callback:
+        progress_callback(0.0, f"Параллельное распознавание ({len(chunks)} фрагментов)...")
+
+    # Куски готовятся в произвольном порядке; сегменты отдаём, как только готов
+    # непрерывный префикс — так частичный результат виден до конца всей записи
+    stitched: List[dict] = []
+    done = {}
+    next_index = 0
+    executor = ThreadPoolExecutor(max_workers=LONG_FILE_WORKERS, thread_name_prefix="chunk")
+    try:
+        futures = {executor.submit(run_chunk, chunk): i for i, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            if cancelled():
+                break
+            done[futures[future]] = future.result()
+            while next_index in done:
+                yield from stitch_chunk(stitched, *done.pop(next_index))
+                next_index += 1
+    finally:
+        # Ошибка куска (или закрытие генератора) не ждёт распознавания остальных: ожидающие куски
+        # снимаются, выполняемые останавливаются на следующем сегменте
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if progress_callback:
+        progress_callback(100.0, "Распознавание завершено")
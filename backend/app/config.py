@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 SECRET_KEY = "CHANGE_ME"
@@ -9,3 +10,155 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 STORAGE_DIR = BASE_DIR / "storage"
 AUDIO_DIR = STORAGE_DIR / "audio"
 TEXT_DIR = STORAGE_DIR / "transcripts"
+RESULT_CACHE_DIR = STORAGE_DIR / "cache"
+PCM_DIR = AUDIO_DIR / "pcm"  # Декодированное аудио (16 кГц float32), см. audio_cache.py
+# Недокачанные файлы докачиваемых загрузок (рядом с AUDIO_DIR: готовый файл переносится без копирования)
+UPLOAD_PARTS_DIR = AUDIO_DIR / "partial"
+
+
+def _parse_model_map(value: str) -> dict:
+    """Разбирает строку вида "tiny=2,base=1" в словарь {модель: число}"""
+    result = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, count = item.split("=", 1)
+        try:
+            result[name.strip()] = max(1, int(count))
+        except ValueError:
+            continue
+    return result
+
+
+# Очередь транскрипций
+# Количество рабочих потоков (по умолчанию половина ядер: Whisper сам использует несколько потоков)
+TRANSCRIPTION_WORKERS = max(1, int(os.getenv("TRANSCRIPTION_WORKERS", max(1, (os.cpu_count() or 2) // 2))))
+# Лимит одновременных задач на модель, например "tiny=2,base=2,small=1"
+MODEL_CONCURRENCY = _parse_model_map(os.getenv("MODEL_CONCURRENCY", ""))
+# Как часто воркеры проверяют очередь в БД, если их не разбудили (секунды)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+# Сколько попыток (включая первую) даётся задаче, прерываемой перезапусками: до этого она
+# продолжается с чекпоинта, потом помечается failed (защита от записи, роняющей сервер)
+RESUME_MAX_ATTEMPTS = int(os.getenv("RESUME_MAX_ATTEMPTS", "3"))
+# Где выполнять распознавание: "thread" — в потоках процесса API,
+# "process" — в пуле отдельных процессов (обходит GIL, падение процесса не роняет сервер)
+TRANSCRIPTION_EXECUTOR = os.getenv("TRANSCRIPTION_EXECUTOR", "thread").lower()
+
+# Контроль приёма: очередь модели считается в секундах аудио и переводится во время ожидания
+# по измеренной скорости распознавания
+# Максимальное ожидание в очереди модели (секунды): сверх него загрузка отклоняется с 503 (0 — без ограничения)
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "21600"))
+# Сколько секунд аудио один пользователь может держать в очереди и в работе (0 — без ограничения)
+USER_MAX_QUEUED_AUDIO_SECONDS = float(os.getenv("USER_MAX_QUEUED_AUDIO_SECONDS", "14400"))
+# Сколько незавершённых транскрипций может быть у одного пользователя (0 — без ограничения)
+USER_MAX_QUEUED_JOBS = int(os.getenv("USER_MAX_QUEUED_JOBS", "20"))
+# Скорость (секунд аудио в секунду на слот), пока модель не завершила ни одной задачи
+ADMISSION_DEFAULT_SPEED = float(os.getenv("ADMISSION_DEFAULT_SPEED", "1.0"))
+# Длительность, которую засчитывать записи, если её не удалось определить (секунды)
+ADMISSION_UNKNOWN_DURATION_SECONDS = float(os.getenv("ADMISSION_UNKNOWN_DURATION_SECONDS", "600"))
+
+# Порядок очереди: сначала интерактивные задачи, затем массовые; внутри класса пользователи
+# получают воркеры по очереди пропорционально весам (взвешенная справедливая очередь)
+# Записи не длиннее этого (секунды) считаются интерактивными, остальные — массовыми
+INTERACTIVE_MAX_AUDIO_SECONDS = float(os.getenv("INTERACTIVE_MAX_AUDIO_SECONDS", "300"))
+# Массовая задача, прождавшая дольше этого (секунды), встаёт в один ряд с интерактивными
+PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "1800"))
+# За какой период (секунды) учитывать, сколько аудио пользователю уже распознано
+FAIR_SHARE_WINDOW_SECONDS = float(os.getenv("FAIR_SHARE_WINDOW_SECONDS", "3600"))
+# Веса пользователей, например "user:1=3,user:7=2" (по умолчанию 1)
+FAIR_SHARE_WEIGHTS = _parse_model_map(os.getenv("FAIR_SHARE_WEIGHTS", ""))
+
+# Профили декодирования (whisper_service.DECODE_PROFILES): fast, balanced, accurate.
+# Пользователь может выбрать профиль сам, иначе он выбирается при запуске задачи по очереди модели
+# Профиль, если пользователь не выбрал свой и очередь неглубокая
+DECODE_PROFILE_DEFAULT = os.getenv("DECODE_PROFILE_DEFAULT", "balanced")
+# Ожидание в очереди модели (секунды), начиная с которого задачи без выбранного профиля
+# распознаются профилем fast (0 — не переключать)
+DECODE_FAST_QUEUE_SECONDS = float(os.getenv("DECODE_FAST_QUEUE_SECONDS", "1800"))
+# Потоков CTranslate2 на одну задачу (0 — по умолчанию CTranslate2). Задаётся при загрузке модели,
+# поэтому общий для всех профилей; при нескольких воркерах разумно около (ядра / TRANSCRIPTION_WORKERS)
+WHISPER_CPU_THREADS = max(0, int(os.getenv("WHISPER_CPU_THREADS", "0")))
+
+# Каскад (refine_model при загрузке): запись распознаёт выбранная модель, а слабые сегменты —
+# ещё раз модель уточнения. Сегмент слабый, если avg_logprob ниже порога, no_speech_prob выше
+# порога или текст сжимается zlib сильнее порога (повторы)
+CASCADE_MIN_AVG_LOGPROB = float(os.getenv("CASCADE_MIN_AVG_LOGPROB", "-0.7"))
+CASCADE_MAX_NO_SPEECH_PROB = float(os.getenv("CASCADE_MAX_NO_SPEECH_PROB", "0.5"))
+CASCADE_MAX_COMPRESSION_RATIO = float(os.getenv("CASCADE_MAX_COMPRESSION_RATIO", "2.0"))
+# Запас аудио по краям окна уточнения (секунды): не дальше соседних хороших сегментов
+CASCADE_PAD_SECONDS = float(os.getenv("CASCADE_PAD_SECONDS", "0.5"))
+
+# Длинные записи: режут по паузам (VAD) на куски и распознают их параллельно
+# Порог длительности в секундах (0 — режим выключен)
+LONG_FILE_THRESHOLD_SECONDS = float(os.getenv("LONG_FILE_THRESHOLD_SECONDS", "1200"))
+# Целевая длина куска в секундах
+LONG_FILE_CHUNK_SECONDS = float(os.getenv("LONG_FILE_CHUNK_SECONDS", "300"))
+# Сколько кусков одного файла распознавать одновременно
+LONG_FILE_WORKERS = max(1, int(os.getenv("LONG_FILE_WORKERS", "2")))
+
+# Пакетная обработка коротких записей: ожидающие задачи одной модели и языка
+# собираются в батч и распознаются одним проходом модели
+# Максимальная длительность "короткой" записи в секундах (0 — пакетный режим выключен)
+BATCH_MAX_AUDIO_SECONDS = float(os.getenv("BATCH_MAX_AUDIO_SECONDS", "120"))
+# Максимум записей в батче
+BATCH_MAX_SIZE = max(1, int(os.getenv("BATCH_MAX_SIZE", "8")))
+# Сколько ждать, пока в очередь придут ещё записи для батча (миллисекунды)
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "500"))
+
+# Как часто сохранять в БД тики прогресса одной задачи (секунды); смены статуса пишутся сразу
+PROGRESS_FLUSH_SECONDS = float(os.getenv("PROGRESS_FLUSH_SECONDS", "5"))
+
+# Как часто сбрасывать на диск (fsync) сегменты, дописываемые во время распознавания (секунды)
+SEGMENT_FSYNC_SECONDS = float(os.getenv("SEGMENT_FSYNC_SECONDS", "5"))
+
+
+def _default_model_budget_mb() -> float:
+    """Половина физической памяти машины, либо 4 ГБ, если её не узнать"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024) / 2
+    except (ValueError, OSError, AttributeError):
+        return 4096.0
+
+
+# Память под загруженные модели (Whisper + AI) на процесс, МБ; при превышении выгружаются
+# давно не использованные модели. 0 — без ограничения
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", _default_model_budget_mb()))
+# Через сколько секунд простоя модель выгружается из памяти (0 — не выгружать)
+MODEL_IDLE_TTL_SECONDS = float(os.getenv("MODEL_IDLE_TTL_SECONDS", "1800"))
+
+# Модели, которые загружаются и прогреваются при старте, например "base,small,summarization"
+# (имена Whisper-моделей, а также "sentiment" и "summarization" для AI)
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip()]
+
+# Разметка речи (VAD) при загрузке: запись декодируется и размечается в фоне, пока ждёт очереди,
+# и сразу получает оценку длительности речи (иначе — только когда дойдёт до распознавания)
+SPEECH_ANALYSIS_ON_UPLOAD = os.getenv("SPEECH_ANALYSIS_ON_UPLOAD", "true").lower() in ("true", "1", "yes", "on")
+# Кэш декодированного PCM (audio_cache.py, около 64 КБ на секунду записи). PCM записей, которые не ждут
+# и не проходят распознавание, удаляется через столько часов после последнего обращения (0 — не удалять по времени)
+PCM_CACHE_TTL_HOURS = float(os.getenv("PCM_CACHE_TTL_HOURS", "24"))
+# Размер кэша PCM, МБ: сверх него удаляется давно не использованный (0 — без ограничения)
+PCM_CACHE_MAX_MB = float(os.getenv("PCM_CACHE_MAX_MB", "10240"))
+
+# Кэш результатов: повторная загрузка того же аудио (по SHA-256) с той же моделью,
+# языком и параметрами декодирования завершается сразу, без Whisper
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("true", "1", "yes", "on")
+
+# Распознавание говорящих (speaker_recognition): кластеризация голосовых эмбеддингов участков речи
+# Порог косинусного расстояния, ниже которого участки считаются одним говорящим
+DIARIZATION_THRESHOLD = float(os.getenv("DIARIZATION_THRESHOLD", "0.2"))
+# Максимум говорящих в одной записи
+DIARIZATION_MAX_SPEAKERS = max(1, int(os.getenv("DIARIZATION_MAX_SPEAKERS", "8")))
+
+# Докачиваемая загрузка (/uploads): рекомендуемый размер куска и сколько хранить брошенную загрузку
+UPLOAD_CHUNK_BYTES = max(64 * 1024, int(os.getenv("UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024))))
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+# Потоковое распознавание с микрофона (/ws/transcribe)
+# Сколько сессий может идти одновременно (каждая постоянно занимает ядро CPU)
+STREAM_MAX_SESSIONS = max(1, int(os.getenv("STREAM_MAX_SESSIONS", "2")))
+# Как часто перераспознавать текущую фразу для промежуточного результата (секунды нового аудио)
+STREAM_STEP_SECONDS = float(os.getenv("STREAM_STEP_SECONDS", "1.0"))
+# Пауза, после которой фраза считается законченной и отдаётся как финальная (миллисекунды)
+STREAM_MIN_SILENCE_MS = int(os.getenv("STREAM_MIN_SILENCE_MS", "600"))
+# Максимальная длина окна без паузы: дольше — фраза фиксируется принудительно (секунды)
+STREAM_MAX_WINDOW_SECONDS = float(os.getenv("STREAM_MAX_WINDOW_SECONDS", "15"))
@@ -0,0 +1,229 @@
+"""
+Распознавание говорящих (диаризация) на CPU.
+
+Работает по уже декодированному PCM и участкам речи от VAD (тем же, что режут длинные записи):
+1. участки речи режутся на окна по WINDOW_SECONDS с шагом STEP_SECONDS;
+2. для всех окон разом считаются MFCC (батчами кадров, одним rfft и матричными умножениями),
+   эмбеддинг окна — среднее и разброс MFCC (через префиксные суммы, без цикла по окнам);
+3. эмбеддинги кластеризуются: агломеративно (average linkage, косинусное расстояние) на выборке
+   окон, затем уточняются k-means по всем окнам;
+4. каждому сегменту транскрипции назначается говорящий, чьи окна сильнее всего его перекрывают.
+
+Стоимость — доли процента от времени Whisper: нет нейросети, всё векторизовано в numpy.
+"""
+from typing import List, Optional
+import logging
+
+import numpy as np
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+from .audio_cache import SAMPLE_RATE
+from .config import DIARIZATION_MAX_SPEAKERS, DIARIZATION_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 1.5
+STEP_SECONDS = 0.75
+# Участки речи короче этого не дают окон (слишком мало звука для голоса)
+MIN_WINDOW_SECONDS = 0.5
+
+FRAME = 400  # 25 мс
+HOP = 320  # 20 мс: для статистик голоса хватает, а FFT вдвое меньше, чем при обычных 10 мс
+N_FFT = 512
+N_MELS = 40
+N_MFCC = 20
+# Кадров на один батч FFT: ограничивает память на многочасовых записях
+FRAME_BATCH = 20000
+# Окон в агломеративной кластеризации (O(n^2) памяти); остальные окна приписываются k-means
+MAX_LINKAGE_WINDOWS = 1000
+KMEANS_ITERATIONS = 10
+
+
+def _mel_filterbank() -> np.ndarray:
+    """Треугольные мел-фильтры (N_MELS x N_FFT/2+1)"""
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+    mel_points = np.linspace(hz_to_mel(0), hz_to_mel(SAMPLE_RATE / 2), N_MELS + 2)
+    bins = np.floor((N_FFT + 1) * mel_to_hz(mel_points) / SAMPLE_RATE).astype(int)
+    fb = np.zeros((N_MELS, N_FFT // 2 + 1), dtype=np.float32)
+    for m in range(1, N_MELS + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            fb[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            fb[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return fb
+
+
+def _dct_matrix() -> np.ndarray:
+    """DCT-II (N_MFCC x N_MELS) без нулевого коэффициента (громкость к голосу отношения не имеет)"""
+    n = np.arange(N_MELS)
+    k = np.arange(1, N_MFCC + 1)[:, None]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * N_MELS)) * np.sqrt(2.0 / N_MELS)).astype(np.float32)
+
+
+_MEL_FB = _mel_filterbank()
+_DCT = _dct_matrix()
+_WINDOW_FN = np.hamming(FRAME).astype(np.float32)
+
+
+def _mfcc(audio: np.ndarray, frame_starts: np.ndarray) -> np.ndarray:
+    """MFCC кадров, начинающихся в frame_starts (кадры собираются и считаются батчами)"""
+    features = np.empty((len(frame_starts), N_MFCC), dtype=np.float32)
+    offsets = np.arange(FRAME)
+    for begin in range(0, len(frame_starts), FRAME_BATCH):
+        starts = frame_starts[begin:begin + FRAME_BATCH]
+        frames = np.asarray(audio[starts[:, None] + offsets], dtype=np.float32) * _WINDOW_FN
+        spectrum = np.fft.rfft(frames, n=N_FFT)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        log_mel = np.log(power @ _MEL_FB.T + 1e-10)
+        features[begin:begin + len(starts)] = log_mel @ _DCT.T
+    return features
+
+
+def _windows(speech: List[dict]) -> np.ndarray:
+    """Окна внутри участков речи: массив [[start, end], ...] в отсчётах"""
+    size = int(WINDOW_SECONDS * SAMPLE_RATE)
+    step = int(STEP_SECONDS * SAMPLE_RATE)
+    minimum = int(MIN_WINDOW_SECONDS * SAMPLE_RATE)
+    windows = []
+    for region in speech:
+        start, end = region["start"], region["end"]
+        if end - start < minimum:
+            continue
+        positions = range(start, max(start + 1, end - size + 1), step)
+        windows.extend((pos, min(pos + size, end)) for pos in positions)
+        # Хвост участка, не накрытый последним окном
+        if windows[-1][1] < end and end - windows[-1][0] > size:
+            windows.append((max(start, end - size), end))
+    return np.array(windows, dtype=np.int64).reshape(-1, 2)
+
+
+def embed_windows(audio: np.ndarray, windows: np.ndarray) -> np.ndarray:
+    """Эмбеддинги окон: среднее и стандартное отклонение MFCC единичной длины"""
+    # Кадры всех окон: окна перекрываются, поэтому считаем кадры по сетке HOP один раз
+    first = windows[:, 0] // HOP
+    last = np.maximum(first + 1, (windows[:, 1] - FRAME) // HOP + 1)
+    grid = np.unique(np.concatenate([np.arange(a, b) for a, b in zip(first, last)]))
+    grid = grid[grid * HOP + FRAME <= len(audio)]
+    features = _mfcc(audio, grid * HOP)
+
+    # Префиксные суммы: сумма кадров любого окна — разность двух строк
+    cumsum = np.vstack([np.zeros((1, N_MFCC)), np.cumsum(features, axis=0, dtype=np.float64)])
+    cumsq = np.vstack([np.zeros((1, N_MFCC)), np.cumsum(features.astype(np.float64) ** 2, axis=0)])
+    lo = np.searchsorted(grid, first)
+    hi = np.maximum(lo + 1, np.searchsorted(grid, last))
+    hi = np.minimum(hi, len(grid))
+    lo = np.minimum(lo, hi - 1)
+    count = (hi - lo)[:, None]
+    mean = (cumsum[hi] - cumsum[lo]) / count
+    std = np.sqrt(np.maximum((cumsq[hi] - cumsq[lo]) / count - mean ** 2, 0.0))
+    # Без нормировки по записи: z-score раздувает разброс внутри одного голоса до уровня разных голосов
+    return _normalize(np.hstack([mean, std]))
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-9)
+
+
+def _agglomerative(embeddings: np.ndarray, threshold: float, max_speakers: int) -> np.ndarray:
+    """Average linkage по косинусному расстоянию: сливаем ближайшие кластеры, пока ближе порога"""
+    n = len(embeddings)
+    distance = 1.0 - embeddings @ embeddings.T
+    np.fill_diagonal(distance, np.inf)
+    sizes = np.ones(n)
+    labels = np.arange(n)
+    clusters = n
+    while clusters > 1:
+        flat = int(np.argmin(distance))
+        i, j = divmod(flat, n)
+        if distance[i, j] > threshold and clusters <= max_speakers:
+            break
+        # Расстояние до объединённого кластера — взвешенное среднее (формула Ланса — Уильямса)
+        merged = (sizes[i] * distance[i] + sizes[j] * distance[j]) / (sizes[i] + sizes[j])
+        distance[i, :] = merged
+        distance[:, i] = merged
+        distance[i, i] = np.inf
+        distance[j, :] = np.inf
+        distance[:, j] = np.inf
+        sizes[i] += sizes[j]
+        labels[labels == j] = i
+        clusters -= 1
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def cluster(embeddings: np.ndarray, threshold: float = DIARIZATION_THRESHOLD,
+            max_speakers: int = DIARIZATION_MAX_SPEAKERS) -> np.ndarray:
+    """Номер говорящего для каждого эмбеддинга"""
+    n = len(embeddings)
+    if n < 2:
+        return np.zeros(n, dtype=int)
+    sample = np.arange(n)
+    if n > MAX_LINKAGE_WINDOWS:
+        sample = np.sort(np.random.default_rng(0).choice(n, MAX_LINKAGE_WINDOWS, replace=False))
+    sample_labels = _agglomerative(embeddings[sample], threshold, max_speakers)
+
+    # Центроиды кластеров выборки, затем k-means по всем окнам
+    centroids = _normalize(np.stack([embeddings[sample][sample_labels == k].mean(axis=0)
+                                     for k in range(sample_labels.max() + 1)]))
+    labels = np.argmax(embeddings @ centroids.T, axis=1)
+    for _ in range(KMEANS_ITERATIONS):
+        used = np.unique(labels)
+        centroids = _normalize(np.stack([embeddings[labels == k].mean(axis=0) for k in used]))
+        updated = np.argmax(embeddings @ centroids.T, axis=1)
+        if np.array_equal(updated, np.searchsorted(used, labels)):
+            break
+        labels = updated
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def assign_speakers(segments: List[dict], windows: np.ndarray, labels: np.ndarray) -> List[dict]:
+    """Проставить сегментам говорящего с наибольшим перекрытием; номера — по порядку появления, с 1"""
+    if not len(windows):
+        return segments
+    starts = windows[:, 0] / SAMPLE_RATE
+    ends = windows[:, 1] / SAMPLE_RATE
+    n_labels = labels.max() + 1
+    raw = []
+    for seg in segments:
+        if seg.get("start") is None:
+            raw.append(None)
+            continue
+        lo = np.searchsorted(starts, seg["start"] - WINDOW_SECONDS)
+        hi = np.searchsorted(starts, seg["end"])
+        overlap = np.minimum(ends[lo:hi], seg["end"]) - np.maximum(starts[lo:hi], seg["start"])
+        overlap = np.maximum(overlap, 0.0)
+        if overlap.sum() > 0:
+            raw.append(int(np.argmax(np.bincount(labels[lo:hi], weights=overlap, minlength=n_labels))))
+        else:
+            # Сегмент вне окон (VAD его не увидел) — ближайшее окно
+            nearest = int(np.argmin(np.abs((starts + ends) / 2 - (seg["start"] + seg["end"]) / 2)))
+            raw.append(int(labels[nearest]))
+
+    numbering = {}
+    result = []
+    for seg, label in zip(segments, raw):
+        if label is not None:
+            seg = dict(seg, speaker=numbering.setdefault(label, len(numbering) + 1))
+        result.append(seg)
+    return result
+
+
+def diarize(audio: np.ndarray, segments: List[dict], speech: Optional[List[dict]] = None) -> List[dict]:
+    """Разметить сегменты транскрипции номерами говорящих (поле speaker).
+
+    speech — участки речи VAD в отсчётах, если уже посчитаны (иначе считаются здесь).
+    """
+    if speech is None:
+        speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    windows = _windows(speech)
+    if not len(windows):
+        return segments
+    labels = cluster(embed_windows(audio, windows))
+    result = assign_speakers(segments, windows, labels)
+    logger.info(f"Diarization: {len(windows)} windows, {labels.max() + 1} speakers")
+    return result
@@ -0,0 +1,83 @@
+"""
+Шина событий о ходе транскрипций для push-канала (SSE /events/jobs).
+
+Воркеры публикуют события из своих потоков, а каждое SSE-подключение получает их
+через собственную asyncio.Queue в цикле событий сервера.
+"""
+from typing import Optional, Set
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Сколько событий держим для медленного клиента; сверх этого отбрасываются самые старые тики прогресса
+_SUBSCRIBER_QUEUE_SIZE = 1000
+# Итоговые статусы: такие события не отбрасываются никогда, иначе клиент не узнает о завершении
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class EventBroker:
+    """Публикация событий из любых потоков, подписка — из asyncio"""
+
+    def __init__(self):
+        self._subscribers = {}  # asyncio.Queue -> (цикл событий подписчика, нужные file_id или None — все)
+        self._lock = threading.Lock()
+
+    def subscribe(self, file_ids: Optional[Set[str]] = None) -> asyncio.Queue:
+        """Подписаться на события (вызывать внутри цикла событий); file_ids — только по этим файлам"""
+        # Без maxsize: размер ограничивает _deliver, чтобы при переполнении выбирать, что отбросить
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[queue] = (asyncio.get_running_loop(), file_ids)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, event: dict):
+        """Отправить событие всем подписчикам (потокобезопасно)"""
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, (loop, file_ids) in subscribers:
+            if file_ids is not None and event["file_id"] not in file_ids:
+                continue
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт — подписчик больше не существует
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, event: dict):
+        """Положить событие в очередь подписчика; у переполненной очереди вытесняется самый старый
+        тик прогресса (следующие события по тому же файлу его перекрывают), итоговые статусы остаются"""
+        if queue.qsize() >= _SUBSCRIBER_QUEUE_SIZE:
+            pending = [queue.get_nowait() for _ in range(queue.qsize())]
+            stale = next((i for i, old in enumerate(pending) if old["status"] not in TERMINAL_STATUSES), None)
+            if stale is not None:
+                del pending[stale]
+            for old in pending:
+                queue.put_nowait(old)
+            if stale is None and event["status"] not in TERMINAL_STATUSES:
+                # В очереди одни итоговые статусы — отбрасывается сам новый тик
+                return
+        queue.put_nowait(event)
+
+
+event_broker = EventBroker()
+
+
+def publish_job_event(file_id: str, status: str, progress: Optional[float] = None,
+                      status_message: Optional[str] = None, error_message: Optional[str] = None,
+                      eta_seconds: Optional[float] = None):
+    """Опубликовать изменение статуса/прогресса транскрипции (eta_seconds — сколько ещё ждать)"""
+    event_broker.publish({
+        "file_id": file_id,
+        "status": status,
+        "progress": progress,
+        "status_message": status_message,
+        "error_message": error_message,
+        "eta_seconds": eta_seconds
+    })
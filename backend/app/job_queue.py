@@ -0,0 +1,523 @@
+"""
+Очередь транскрипций: задачи хранятся в БД (transcription_jobs) и переживают перезапуск,
+а выполняет их пул воркеров фиксированного размера с лимитом параллельности на модель.
+
+Порядок выполнения (schedule):
+1. интерактивные задачи (короткие записи) — раньше массовых; массовая задача, прождавшая
+   PRIORITY_AGING_SECONDS, встаёт в один ряд с интерактивными и не голодает;
+2. внутри класса — взвешенная справедливая очередь по владельцам: следующей берётся задача
+   того, кому за FAIR_SHARE_WINDOW_SECONDS распознано меньше всего аудио с учётом веса
+   (FAIR_SHARE_WEIGHTS). Пакет записей одного пользователя не блокирует остальных;
+3. у одного владельца и при равенстве — FIFO.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import logging
+import threading
+import time
+
+from .database import SessionLocal
+from .events import publish_job_event
+from .progress import progress_registry
+from .models import Transcript, TranscriptionJob
+from .config import (
+    TRANSCRIPTION_WORKERS, MODEL_CONCURRENCY, JOB_POLL_INTERVAL,
+    BATCH_MAX_AUDIO_SECONDS, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, RESUME_MAX_ATTEMPTS,
+    INTERACTIVE_MAX_AUDIO_SECONDS, PRIORITY_AGING_SECONDS, FAIR_SHARE_WINDOW_SECONDS, FAIR_SHARE_WEIGHTS,
+    ADMISSION_UNKNOWN_DURATION_SECONDS
+)
+from .utils import format_timestamp
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "bulk")
+
+
+def job_priority(duration_seconds: Optional[float], requested: Optional[str] = None) -> str:
+    """Класс задачи: короткие записи интерактивные; массовый класс можно запросить явно"""
+    if requested == "bulk":
+        return "bulk"
+    if duration_seconds is not None and duration_seconds <= INTERACTIVE_MAX_AUDIO_SECONDS:
+        return "interactive"
+    return "bulk"
+
+
+def job_audio_seconds(job: TranscriptionJob) -> float:
+    """Сколько аудио задаче распознавать (с чекпоинта, если она продолжается)"""
+    duration = job.duration_seconds if job.duration_seconds else ADMISSION_UNKNOWN_DURATION_SECONDS
+    return max(0.0, duration - (job.resume_from or 0.0))
+
+
+class JobQueue:
+    """Пул воркеров, разбирающих очередь transcription_jobs (порядок — см. schedule)"""
+
+    def __init__(self, workers: int, model_concurrency: Dict[str, int]):
+        self.workers = workers
+        self.model_concurrency = model_concurrency
+        self._running: Dict[str, int] = {}  # модель -> сколько задач сейчас выполняется
+        self._cancel_events: Dict[str, threading.Event] = {}  # file_id выполняемой задачи -> флаг отмены
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Счётчик событий, после которых стоит заново просмотреть очередь (новая задача, свободный слот):
+        # schedule строится без блокировки, и уведомление, пришедшее за это время, не должно теряться
+        self._changes = 0
+        self._threads = []
+        self._stopped = False
+
+    def concurrency_for(self, model: str) -> int:
+        """Сколько задач модели можно выполнять одновременно"""
+        return min(self.model_concurrency.get(model, self.workers), self.workers)
+
+    def running_jobs(self) -> int:
+        """Сколько задач (батч — одна) выполняется сейчас во всех моделях"""
+        with self._lock:
+            return sum(self._running.values())
+
+    def start(self):
+        """Запустить воркеры (вызывается один раз при старте приложения)"""
+        if self._threads:
+            return
+        self._stopped = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"transcription-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Transcription queue started: {self.workers} workers, per-model limits: {self.model_concurrency or 'default'}")
+
+    def stop(self):
+        """Остановить воркеры после завершения текущих задач"""
+        with self._wakeup:
+            self._stopped = True
+            self._changes += 1
+            self._wakeup.notify_all()
+
+    def enqueue(self, file_id: str, model: str, language: Optional[str] = None, speaker_recognition: bool = False,
+                duration_seconds: Optional[float] = None, word_timestamps: bool = False,
+                owner: Optional[str] = None, priority: Optional[str] = None,
+                decode_profile: Optional[str] = None, refine_model: Optional[str] = None) -> int:
+        """Поставить транскрипцию в очередь. Возвращает id задачи.
+
+        owner — кто поставил (см. admission.py), priority — "bulk", чтобы явно пропустить
+        интерактивные задачи вперёд (иначе класс определяется по длительности).
+        decode_profile — профиль декодирования, выбранный пользователем (None — выбрать при запуске).
+        refine_model — модель, которая заново распознаёт слабые сегменты (каскад, см. cascade.py).
+        """
+        db = SessionLocal()
+        try:
+            job = TranscriptionJob(
+                file_id=file_id,
+                model=model,
+                language=language,
+                speaker_recognition=1 if speaker_recognition else 0,
+                word_timestamps=1 if word_timestamps else 0,
+                duration_seconds=duration_seconds,
+                owner=owner,
+                priority=job_priority(duration_seconds, priority),
+                decode_profile=decode_profile,
+                refine_model=refine_model,
+                status="queued",
+                created_at=datetime.utcnow()
+            )
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        finally:
+            db.close()
+
+        with self._wakeup:
+            self._changes += 1
+            self._wakeup.notify()
+        publish_job_event(file_id, "pending", status_message="В очереди...")
+        logger.info(f"Job {job_id} queued for {file_id} (model={model})")
+        return job_id
+
+    def queue_position(self, file_id: str) -> Optional[int]:
+        """Позиция задачи в очереди своей модели (1 = следующая), None если задача не ждёт"""
+        db = SessionLocal()
+        try:
+            ahead = self.jobs_ahead(db, file_id)
+            return len(ahead) + 1 if ahead is not None else None
+        finally:
+            db.close()
+
+    def jobs_ahead(self, db, file_id: str) -> Optional[List[TranscriptionJob]]:
+        """Ожидающие задачи той же модели, которые по schedule выполнятся раньше; None если задача не ждёт"""
+        order = self.schedule(db)
+        for index, job in enumerate(order):
+            if job.file_id == file_id:
+                return [other for other in order[:index] if other.model == job.model]
+        return None
+
+    def schedule(self, db) -> List[TranscriptionJob]:
+        """Ожидающие задачи в порядке выполнения (без учёта свободных слотов моделей).
+
+        Порядок строится как в справедливой очереди: у каждого владельца очередь своих задач,
+        следующей берётся голова очереди владельца с наименьшим (класс, распознано/вес, id);
+        после выбора владельцу засчитывается аудио задачи.
+        """
+        queued = db.query(TranscriptionJob).filter(
+            TranscriptionJob.status == "queued"
+        ).order_by(TranscriptionJob.id).all()
+        if not queued:
+            return []
+
+        now = datetime.utcnow()
+
+        def rank(job: TranscriptionJob) -> int:
+            priority = job.priority or job_priority(job.duration_seconds)
+            if priority == "interactive":
+                return 0
+            waited = (now - job.created_at).total_seconds() if job.created_at else 0.0
+            return 0 if waited >= PRIORITY_AGING_SECONDS else 1
+
+        # Сколько аудио владельцам уже распознано/распознаётся за окно справедливости
+        served: Dict[str, float] = {}
+        since = now - timedelta(seconds=FAIR_SHARE_WINDOW_SECONDS)
+        recent = db.query(TranscriptionJob).filter(
+            TranscriptionJob.started_at.isnot(None),
+            TranscriptionJob.started_at >= since
+        ).all()
+        for job in recent:
+            served[job.owner or ""] = served.get(job.owner or "", 0.0) + job_audio_seconds(job)
+
+        pending: Dict[str, List[TranscriptionJob]] = {}
+        for job in sorted(queued, key=lambda j: (rank(j), j.id)):
+            pending.setdefault(job.owner or "", []).append(job)
+
+        order = []
+        while pending:
+            owner = min(pending, key=lambda o: (
+                rank(pending[o][0]), served.get(o, 0.0) / FAIR_SHARE_WEIGHTS.get(o, 1), pending[o][0].id
+            ))
+            job = pending[owner].pop(0)
+            if not pending[owner]:
+                del pending[owner]
+            served[owner] = served.get(owner, 0.0) + job_audio_seconds(job)
+            order.append(job)
+        return order
+
+    def cancel(self, file_id: str) -> Optional[str]:
+        """Отменить транскрипцию.
+
+        Ожидающая задача снимается с очереди сразу ("cancelled"), выполняемая получает флаг
+        отмены и останавливается между сегментами ("cancelling"): воркер освобождает слот и
+        удаляет частичный результат. None — отменять нечего.
+        """
+        db = SessionLocal()
+        try:
+            dropped = db.query(TranscriptionJob).filter(
+                TranscriptionJob.file_id == file_id,
+                TranscriptionJob.status == "queued"
+            ).update({
+                "status": "cancelled",
+                "finished_at": datetime.utcnow(),
+                "error_message": "Cancelled"
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+        if dropped:
+            from .tasks import discard_cancelled
+
+            discard_cancelled(file_id)
+            progress_registry.transition(file_id, "cancelled", message="Отменено")
+            logger.info(f"Queued job for {file_id} cancelled")
+            return "cancelled"
+
+        event = self._cancel_events.get(file_id)
+        if event is None:
+            return None
+        event.set()
+        logger.info(f"Cancelling running job for {file_id}")
+        return "cancelling"
+
+    def stats(self) -> dict:
+        """Глубина очереди и загрузка воркеров по моделям"""
+        db = SessionLocal()
+        try:
+            jobs = db.query(TranscriptionJob.model, TranscriptionJob.status).filter(
+                TranscriptionJob.status.in_(["queued", "running"])
+            ).all()
+        finally:
+            db.close()
+
+        by_model = {}
+        for model, status in jobs:
+            entry = by_model.setdefault(model, {"queued": 0, "running": 0, "concurrency": self.concurrency_for(model)})
+            entry[status] += 1
+
+        return {
+            "workers": self.workers,
+            "queued": sum(m["queued"] for m in by_model.values()),
+            "running": sum(m["running"] for m in by_model.values()),
+            "by_model": by_model
+        }
+
+    def recover(self):
+        """Восстановить очередь после перезапуска.
+
+        Прерванные задачи возвращаются в очередь и продолжаются с чекпоинта — конца последнего
+        сегмента, уже записанного в хранилище. Задача, прерванная RESUME_MAX_ATTEMPTS раз подряд,
+        помечается как failed.
+        """
+        from .segment_store import checkpoint, read_partial
+
+        db = SessionLocal()
+        try:
+            interrupted = db.query(TranscriptionJob).filter(TranscriptionJob.status == "running").all()
+            resumed, failed = 0, 0
+            for job in interrupted:
+                transcript = db.query(Transcript).filter(Transcript.file_id == job.file_id).first()
+                if not transcript or (job.attempts or 0) >= RESUME_MAX_ATTEMPTS:
+                    job.status = "failed"
+                    job.finished_at = datetime.utcnow()
+                    job.error_message = "Server was restarted"
+                    if transcript:
+                        transcript.status = "failed"
+                        transcript.error_message = "Server was restarted. Click Retry to process again."
+                        transcript.status_message = "Interrupted - click Retry"
+                    failed += 1
+                    continue
+                offset = checkpoint(read_partial(job.file_id))
+                job.status = "queued"
+                job.resume_from = offset or None
+                job.started_at = None
+                job.worker = None
+                transcript.status = "pending"
+                transcript.status_message = (
+                    f"Продолжение после перезапуска с {format_timestamp(offset)}" if offset else "В очереди..."
+                )
+                resumed += 1
+            db.flush()
+
+            queued_ids = {
+                file_id for (file_id,) in
+                db.query(TranscriptionJob.file_id).filter(TranscriptionJob.status == "queued").all()
+            }
+            # Транскрипции без задачи в очереди (например, созданные до появления очереди) — ставим заново
+            orphans = db.query(Transcript).filter(Transcript.status.in_(["pending", "processing"])).all()
+            orphans = [t for t in orphans if t.file_id not in queued_ids]
+            for t in orphans:
+                db.add(TranscriptionJob(
+                    file_id=t.file_id,
+                    model=t.model,
+                    language=t.language,
+                    duration_seconds=t.duration_seconds,
+                    status="queued",
+                    created_at=datetime.utcnow()
+                ))
+                t.status = "pending"
+                t.status_message = "В очереди..."
+            db.commit()
+
+            if resumed or orphans:
+                logger.warning(f"Re-queued {resumed + len(orphans)} interrupted transcripts to resume after restart")
+            if failed:
+                logger.warning(f"Reset {failed} transcripts interrupted {RESUME_MAX_ATTEMPTS} times to failed")
+            if queued_ids:
+                logger.info(f"Resuming {len(queued_ids)} queued transcription jobs")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error recovering transcription queue: {e}", exc_info=True)
+        finally:
+            db.close()
+
+    def _claim_next(self) -> Optional[TranscriptionJob]:
+        """Взять первую по schedule задачу, для модели которой есть свободный слот.
+
+        schedule строится без блокировки (enqueue вызывается из обработчиков запросов);
+        под блокировкой только занимается слот модели, и он возвращается, если задачу
+        успел забрать другой воркер.
+        """
+        db = SessionLocal()
+        try:
+            for job in self.schedule(db):
+                with self._lock:
+                    if self._running.get(job.model, 0) >= self.concurrency_for(job.model):
+                        continue
+                    self._running[job.model] = self._running.get(job.model, 0) + 1
+                claimed = False
+                try:
+                    claimed = self._try_claim(db, job)
+                finally:
+                    if not claimed:
+                        self._release(job.model)
+                if claimed:
+                    return job
+            return None
+        finally:
+            db.close()
+
+    def _try_claim(self, db, job: TranscriptionJob) -> bool:
+        """Атомарно забрать задачу (защита от второго процесса с той же БД)"""
+        # Флаг отмены заводим до смены статуса: отмена между ними не должна потеряться
+        self._cancel_events[job.file_id] = threading.Event()
+        claimed = db.query(TranscriptionJob).filter(
+            TranscriptionJob.id == job.id,
+            TranscriptionJob.status == "queued"
+        ).update({
+            "status": "running",
+            "started_at": datetime.utcnow(),
+            "attempts": (job.attempts or 0) + 1,
+            "worker": threading.current_thread().name
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            db.refresh(job)
+            db.expunge(job)
+        else:
+            self._cancel_events.pop(job.file_id, None)
+        return bool(claimed)
+
+    @staticmethod
+    def _is_batchable(job: TranscriptionJob) -> bool:
+        """Короткие записи без распознавания говорящих и таймкодов слов можно обрабатывать пакетом
+        (пакет декодируется жадно, как профиль fast, поэтому задачи с другим выбранным профилем
+        и с каскадом — нет)"""
+        return (
+            BATCH_MAX_AUDIO_SECONDS > 0 and BATCH_MAX_SIZE > 1
+            and job.duration_seconds is not None
+            and job.duration_seconds <= BATCH_MAX_AUDIO_SECONDS
+            and not job.speaker_recognition
+            and not job.word_timestamps
+            and not job.resume_from
+            and job.decode_profile in (None, "fast")
+            and not job.refine_model
+        )
+
+    def _claim_batch_siblings(self, first: TranscriptionJob, limit: int) -> List[TranscriptionJob]:
+        """Забрать ожидающие короткие задачи с той же моделью и языком — в порядке schedule,
+        чтобы батч не обходил классы приоритета и справедливую очередь"""
+        db = SessionLocal()
+        try:
+            claimed = []
+            for job in self.schedule(db):
+                if len(claimed) >= limit:
+                    break
+                if job.model != first.model or job.language != first.language or not self._is_batchable(job):
+                    continue
+                if self._try_claim(db, job):
+                    claimed.append(job)
+            return claimed
+        finally:
+            db.close()
+
+    def _collect_batch(self, first: TranscriptionJob) -> List[TranscriptionJob]:
+        """Собрать батч коротких задач, ожидая новые не дольше BATCH_MAX_WAIT_MS"""
+        batch = [first]
+        deadline = time.monotonic() + BATCH_MAX_WAIT_MS / 1000
+        while len(batch) < BATCH_MAX_SIZE:
+            batch += self._claim_batch_siblings(first, BATCH_MAX_SIZE - len(batch))
+            if len(batch) >= BATCH_MAX_SIZE or time.monotonic() >= deadline:
+                break
+            time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+        return batch
+
+    def _finish(self, job: TranscriptionJob, success: bool, error: Optional[str] = None):
+        """Записать результат задачи и освободить слот модели"""
+        self._record_result(job, success, error)
+        self._release(job.model)
+        self._prune_pcm()
+
+    @staticmethod
+    def _prune_pcm():
+        """PCM завершённых записей больше не держится распознаванием — кэш можно почистить"""
+        from .tasks import prune_pcm_cache
+        prune_pcm_cache()
+
+    def _record_result(self, job: TranscriptionJob, success: bool, error: Optional[str] = None):
+        event = self._cancel_events.pop(job.file_id, None)
+        status = "done" if success else "failed"
+        if not success and event is not None and event.is_set():
+            status, error = "cancelled", "Cancelled"
+        db = SessionLocal()
+        try:
+            db.query(TranscriptionJob).filter(TranscriptionJob.id == job.id).update({
+                "status": status,
+                "finished_at": datetime.utcnow(),
+                "error_message": error
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error finishing job {job.id}: {e}")
+        finally:
+            db.close()
+
+    def _release(self, model: str):
+        with self._wakeup:
+            self._running[model] = max(0, self._running.get(model, 0) - 1)
+            self._changes += 1
+            self._wakeup.notify_all()
+
+    def _worker_loop(self):
+        while True:
+            with self._wakeup:
+                if self._stopped:
+                    return
+                changes = self._changes
+            try:
+                job = self._claim_next()
+            except Exception as e:
+                logger.error(f"Error claiming transcription job: {e}", exc_info=True)
+                job = None
+            if job is None:
+                with self._wakeup:
+                    # Пока строился schedule, могла прийти задача или освободиться слот — тогда без ожидания
+                    if self._changes == changes and not self._stopped:
+                        self._wakeup.wait(timeout=JOB_POLL_INTERVAL)
+                continue
+
+            if self._is_batchable(job):
+                self._run_batch(self._collect_batch(job))
+            else:
+                self._run(job)
+
+    def _run(self, job: TranscriptionJob):
+        from .admission import decode_profile
+        from .tasks import process_transcription_background
+
+        try:
+            # Профиль — по глубине очереди в момент запуска, если пользователь не выбрал свой
+            profile = decode_profile(job.model, job.decode_profile)
+            logger.info(f"Job {job.id} started for {job.file_id} (model={job.model}, profile={profile})")
+            success = process_transcription_background(
+                job.file_id, job.model, job.language, bool(job.speaker_recognition), bool(job.word_timestamps),
+                job.resume_from, self._cancel_events.get(job.file_id), profile, job.refine_model
+            )
+            self._finish(job, success, None if success else "Transcription failed")
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            self._mark_transcript_failed(job.file_id, str(e))
+            self._finish(job, False, str(e))
+
+    def _run_batch(self, jobs: List[TranscriptionJob]):
+        """Выполнить батч коротких задач; весь батч занимает один слот модели"""
+        from .tasks import process_transcription_batch
+
+        if len(jobs) == 1:
+            self._run(jobs[0])
+            return
+
+        logger.info(f"Batch of {len(jobs)} short jobs started (model={jobs[0].model}): {[j.id for j in jobs]}")
+        try:
+            results = process_transcription_batch(
+                jobs, {job.file_id: self._cancel_events[job.file_id] for job in jobs if job.file_id in self._cancel_events}
+            )
+            for job in jobs:
+                success = results.get(job.id, False)
+                self._record_result(job, success, None if success else "Transcription failed")
+        except Exception as e:
+            logger.error(f"Batch {[j.id for j in jobs]} failed: {e}", exc_info=True)
+            for job in jobs:
+                self._mark_transcript_failed(job.file_id, str(e))
+                self._record_result(job, False, str(e))
+        finally:
+            self._release(jobs[0].model)
+            self._prune_pcm()
+
+    def _mark_transcript_failed(self, file_id: str, error: str):
+        progress_registry.transition(file_id, "failed", message="Ошибка", error=error)
+
+
+job_queue = JobQueue(TRANSCRIPTION_WORKERS, MODEL_CONCURRENCY)
@@ -16,11 +16,14 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-from .routes import upload, auth, transcripts, folders, export, ai, conversation
-from .database import Base, engine, SessionLocal
-from .config import AUDIO_DIR, TEXT_DIR
+from .routes import upload, uploads, auth, transcripts, folders, export, ai, conversation, jobs, events, live, admin
+from .database import Base, engine
+from .config import AUDIO_DIR, TEXT_DIR, TRANSCRIPTION_EXECUTOR
 from . import models  # импортируем модели для создания таблиц
-from .models import Transcript, TranscriptAI
+from .models import TranscriptAI
+from .job_queue import job_queue
+from .progress import progress_registry
+from .preload import preloader
 
 # преобразуем строки в Path
 AUDIO_DIR = Path(AUDIO_DIR)
@@ -46,27 +49,14 @@ app = FastAPI(title="WhisperFlow")
 @app.on_event("startup")
 async def startup_events():
     """Все события при старте сервера"""
-    # Сбрасываем зависшие транскрипции
-    db = SessionLocal()
-    try:
-        stuck = db.query(Transcript).filter(
-            Transcript.status.in_(['pending', 'processing'])
-        ).all()
-        
-        if stuck:
-            logger.warning(f"Found {len(stuck)} stuck transcripts, resetting to failed...")
-            for t in stuck:
-                t.status = 'failed'
-                t.error_message = 'Server was restarted. Click Retry to process again.'
-                t.status_message = 'Interrupted - click Retry'
-            db.commit()
-            logger.info(f"Reset {len(stuck)} stuck transcripts")
-        else:
-            logger.info("No stuck transcripts found")
-    except Exception as e:
-        logger.error(f"Error resetting stuck transcripts: {e}")
-    finally:
-        db.close()
+    # Восстанавливаем очередь транскрипций и запускаем воркеры
+    if TRANSCRIPTION_EXECUTOR == "process":
+        from .process_pool import process_pool
+        process_pool.start()
+    job_queue.recover()
+    job_queue.start()
+    # Предзагрузка моделей идёт в фоне: порт поднимается сразу, готовность — /health/ready
+    preloader.start()
     
     # Проверяем доступность googletrans (без загрузки моделей)
     from .ai_service import GOOGLETRANS_AVAILABLE
@@ -77,8 +67,32 @@ async def startup_events():
     else:
         logger.info("✓ googletrans доступен для переводов")
     
-    # AI модели будут загружаться по требованию (lazy loading) для экономии памяти
-    logger.info("AI models will be loaded on-demand to save memory")
+    # Остальные модели загружаются по требованию (lazy loading) для экономии памяти
+    logger.info("Models not listed in PRELOAD_MODELS will be loaded on-demand to save memory")
+
+
+@app.on_event("shutdown")
+async def shutdown_events():
+    """Остановка воркеров очереди"""
+    job_queue.stop()
+    progress_registry.flush_all()
+    if TRANSCRIPTION_EXECUTOR == "process":
+        from .process_pool import process_pool
+        process_pool.shutdown()
+
+
+@app.get("/health")
+async def health():
+    """Процесс жив и принимает запросы"""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Готовность: модели из PRELOAD_MODELS загружены и прогреты (иначе 503)"""
+    from fastapi.responses import JSONResponse
+    state = preloader.state()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
 
 
 # CORS для фронтенда
@@ -91,12 +105,17 @@ app.add_middleware(
 
 # подключаем роуты
 app.include_router(upload.router)
+app.include_router(uploads.router)
 app.include_router(auth.router)
 app.include_router(transcripts.router)
 app.include_router(folders.router)
 app.include_router(export.router)
 app.include_router(ai.router)
 app.include_router(conversation.router)
+app.include_router(jobs.router)
+app.include_router(events.router)
+app.include_router(live.router)
+app.include_router(admin.router)
 
 # Раздаём статические файлы фронтенда (CSS, JS, компоненты)
 if FRONTEND_DIR.exists():
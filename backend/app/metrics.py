@@ -0,0 +1,187 @@
+"""
+Метрики завершённых транскрипций и оценка пропускной способности сервера (/admin/capacity).
+
+По каждой успешной задаче в job_metrics пишется: сколько аудио распознано, сколько в нём речи
+после VAD, время распознавания, процессорное время, пиковая память процесса и модель.
+
+Процессорное время в режиме process измеряет сам процесс пула (он выполняет одну задачу
+за раз), в режиме thread — процесс API целиком: если задачи шли параллельно, оно включает
+и чужую работу, поэтому в оценку процессора идут только задачи, выполнявшиеся в одиночку.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import sys
+import time
+
+from .config import TRANSCRIPTION_EXECUTOR
+from .database import SessionLocal
+from .job_queue import job_queue
+from .models import JobMetric
+from .rtf import hardware_signature
+
+try:
+    import resource
+except ImportError:  # Windows: пиковую память не узнать
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних задач модели учитывать в оценке
+CAPACITY_SAMPLE_JOBS = 1000
+
+
+def process_usage() -> Tuple[float, Optional[float]]:
+    """(процессорное время текущего процесса в секундах, пиковый RSS процесса в МБ)"""
+    cpu = time.process_time()
+    if resource is None:
+        return cpu, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: на Linux в КБ, на macOS в байтах
+    return cpu, peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class UsageMeter:
+    """Процессорное время и пиковая память процесса с момента создания"""
+
+    def __init__(self):
+        self._cpu_start, _ = process_usage()
+
+    def stats(self) -> dict:
+        cpu, peak = process_usage()
+        return {"cpu_seconds": cpu - self._cpu_start, "peak_rss_mb": peak}
+
+
+def merge_stats(total: dict, part: dict):
+    """Добавить к total статистику куска: речь и процессорное время суммируются, память — максимум,
+    язык — первый определённый"""
+    for key in ("speech_seconds", "cpu_seconds"):
+        if part.get(key) is not None:
+            total[key] = total.get(key, 0.0) + part[key]
+    if part.get("peak_rss_mb") is not None:
+        total["peak_rss_mb"] = max(total.get("peak_rss_mb") or 0.0, part["peak_rss_mb"])
+    if part.get("language") and not total.get("language"):
+        total["language"] = part["language"]
+
+
+def record(file_id: str, model: str, mode: str, audio_seconds: float, wall_seconds: float,
+           stats: dict, concurrent_jobs: int):
+    """Записать метрики завершённого распознавания.
+
+    stats — {speech_seconds, cpu_seconds, peak_rss_mb}: из процесса пула или UsageMeter процесса API.
+    """
+    db = SessionLocal()
+    try:
+        db.add(JobMetric(
+            file_id=file_id,
+            model=model,
+            hardware=hardware_signature(),
+            executor=TRANSCRIPTION_EXECUTOR,
+            mode=mode,
+            audio_seconds=audio_seconds,
+            speech_seconds=stats.get("speech_seconds"),
+            wall_seconds=wall_seconds,
+            cpu_seconds=stats.get("cpu_seconds"),
+            peak_rss_mb=stats.get("peak_rss_mb"),
+            concurrent_jobs=concurrent_jobs,
+            created_at=datetime.utcnow()
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Cannot record metrics for {file_id}: {e}")
+    finally:
+        db.close()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0–100) с линейной интерполяцией; values отсортированы"""
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _model_capacity(model: str, rows: List[JobMetric]) -> dict:
+    rtfs = sorted(row.wall_seconds / row.audio_seconds for row in rows)
+    audio = sum(row.audio_seconds for row in rows)
+    with_speech = [row for row in rows if row.speech_seconds is not None]
+    # Процессорное время без чужой работы: процесс пула или задача, шедшая в одиночку
+    clean = [row for row in rows if row.cpu_seconds is not None
+             and (row.executor == "process" or (row.concurrent_jobs or 1) <= 1)]
+    peaks = [row.peak_rss_mb for row in rows if row.peak_rss_mb is not None]
+
+    slots = job_queue.concurrency_for(model)
+    rtf = {name: round(_percentile(rtfs, q), 3) for name, q in (("p50", 50), ("p90", 90), ("p99", 99))}
+    # Секунд аудио в секунду = часов аудио в час: все слоты модели заняты, RTF как у прошлых задач
+    by_slots = slots / _percentile(rtfs, 50)
+    conservative = slots / _percentile(rtfs, 90)
+    cpu_rate = None
+    by_cpu = None
+    if clean:
+        cpu_rate = sum(row.cpu_seconds for row in clean) / sum(row.audio_seconds for row in clean)
+        if cpu_rate > 0:
+            # Больше не выжать, даже добавив воркеров: все ядра заняты
+            by_cpu = (os.cpu_count() or 1) / cpu_rate
+    sustainable = min(by_slots, by_cpu) if by_cpu else by_slots
+
+    return {
+        "jobs": len(rows),
+        "audio_hours": round(audio / 3600, 2),
+        "speech_ratio": round(
+            sum(row.speech_seconds for row in with_speech) / sum(row.audio_seconds for row in with_speech), 3
+        ) if with_speech else None,
+        "rtf": rtf,
+        "cpu_seconds_per_audio_second": round(cpu_rate, 3) if cpu_rate is not None else None,
+        "peak_rss_mb": round(max(peaks)) if peaks else None,
+        "concurrency": slots,
+        "audio_hours_per_hour": round(sustainable, 2),
+        "audio_hours_per_hour_p90": round(min(conservative, by_cpu) if by_cpu else conservative, 2),
+        "limited_by": "cpu" if by_cpu and by_cpu < by_slots else "concurrency"
+    }
+
+
+def capacity(days: float) -> dict:
+    """Перцентили RTF по моделям за последние days дней на этом железе и сколько часов аудио
+    в час сервер выдержит при текущих лимитах параллельности (TRANSCRIPTION_WORKERS, MODEL_CONCURRENCY).
+    """
+    hardware = hardware_signature()
+    since = datetime.utcnow() - timedelta(days=days)
+    db = SessionLocal()
+    try:
+        models = [name for (name,) in db.query(JobMetric.model).filter(
+            JobMetric.hardware == hardware,
+            JobMetric.created_at >= since
+        ).distinct().all()]
+        rows: Dict[str, List[JobMetric]] = {}
+        for model in models:
+            rows[model] = db.query(JobMetric).filter(
+                JobMetric.model == model,
+                JobMetric.hardware == hardware,
+                JobMetric.created_at >= since,
+                JobMetric.audio_seconds > 0
+            ).order_by(JobMetric.id.desc()).limit(CAPACITY_SAMPLE_JOBS).all()
+    finally:
+        db.close()
+
+    by_model = {model: _model_capacity(model, jobs) for model, jobs in sorted(rows.items()) if jobs}
+
+    # Весь сервер — при том соотношении моделей, что было за период:
+    # на час аудио уходит сумма (доля модели / её пропускная способность) часов
+    total = None
+    audio = sum(entry["audio_hours"] for entry in by_model.values())
+    if audio > 0:
+        total = round(1 / sum(
+            entry["audio_hours"] / audio / entry["audio_hours_per_hour"] for entry in by_model.values()
+        ), 2)
+
+    return {
+        "hardware": hardware,
+        "executor": TRANSCRIPTION_EXECUTOR,
+        "workers": job_queue.workers,
+        "cpu_count": os.cpu_count(),
+        "window_days": days,
+        "models": by_model,
+        "audio_hours_per_hour": total
+    }
@@ -0,0 +1,212 @@
+"""
+Общий менеджер загруженных моделей (Whisper и AI-пайплайны).
+
+Следит за примерным объёмом памяти каждой модели и держит сумму в пределах
+MODEL_MEMORY_BUDGET_MB, выгружая давно не использованные модели (LRU).
+Модели, простаивающие дольше MODEL_IDLE_TTL_SECONDS, выгружаются фоновым потоком.
+Закреплённые модели (pin — предзагруженные из PRELOAD_MODELS) не выгружаются ни по простою, ни по бюджету.
+Бюджет действует на процесс: в режиме TRANSCRIPTION_EXECUTOR=process он у каждого воркера свой.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Set
+import gc
+import logging
+import os
+import threading
+import time
+
+from .config import MODEL_MEMORY_BUDGET_MB, MODEL_IDLE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _rss_mb() -> Optional[float]:
+    """Текущий RSS процесса в МБ (Linux), None если узнать нельзя"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Entry:
+    def __init__(self, model: Any, size_mb: float):
+        self.model = model
+        self.size_mb = size_mb
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+        self.hits = 0
+        self.in_use = 0  # Сколько потоков сейчас работают с моделью (такие не выгружаются)
+
+
+class ModelManager:
+    """LRU-кэш моделей с бюджетом памяти и выгрузкой по простою"""
+
+    def __init__(self, budget_mb: float, idle_ttl: float):
+        self.budget_mb = budget_mb
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._pinned: Set[str] = set()  # Ключи моделей, которые не выгружаются (см. pin)
+        self._evictions = 0
+        self._reaper: Optional[threading.Thread] = None
+
+    def fits(self, size_mb: float) -> bool:
+        """Поместится ли модель такого размера в бюджет (хотя бы одна, без соседей)"""
+        return self.budget_mb <= 0 or size_mb <= self.budget_mb
+
+    def pin(self, key: str):
+        """Закрепить модель: её не выгружают ни простой, ни нехватка бюджета (предзагрузка, /health/ready)"""
+        with self._lock:
+            self._pinned.add(key)
+
+    def is_loaded(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str, loader: Callable[[], Any], size_mb: float) -> Any:
+        """Вернуть модель из кэша или загрузить её через loader().
+
+        size_mb — оценка размера; если прирост RSS при загрузке больше, берётся он.
+        Исключения loader() пробрасываются, в кэш ничего не попадает.
+        """
+        model = self._touch(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Одну модель грузит только один поток, остальные ждут и берут её из кэша
+        with load_lock:
+            model = self._touch(key)
+            if model is not None:
+                return model
+
+            self._make_room(size_mb)
+            rss_before = _rss_mb()
+            model = loader()
+            rss_after = _rss_mb()
+            # Прирост RSS может быть меньше реального размера (аллокатор переиспользует
+            # память выгруженных моделей), поэтому оценку только увеличиваем
+            if rss_before is not None and rss_after is not None:
+                size_mb = max(size_mb, rss_after - rss_before)
+
+            with self._lock:
+                self._entries[key] = _Entry(model, size_mb)
+            logger.info(f"Model {key} loaded (~{size_mb:.0f} MB, total ~{self._used_mb():.0f}/{self.budget_mb:.0f} MB)")
+
+        self._ensure_reaper()
+        # Оценка могла оказаться заниженной — выгружаем соседей, если вышли за бюджет
+        self._make_room(0, keep=key)
+        return model
+
+    @contextmanager
+    def hold(self, key: str):
+        """Пометить модель занятой на время работы с ней, чтобы её не выгрузили посреди задачи"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if entry is not None:
+                    entry.in_use -= 1
+                    entry.last_used = time.monotonic()
+
+    def unload(self, key: str) -> bool:
+        """Выгрузить модель. Потоки, которые уже её используют, доработают со своей ссылкой"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        del entry
+        gc.collect()
+        logger.info(f"Model {key} unloaded")
+        return True
+
+    def stats(self) -> dict:
+        """Загруженные модели, их оценочный размер и время простоя"""
+        now = time.monotonic()
+        with self._lock:
+            models = [
+                {
+                    "key": key,
+                    "size_mb": round(entry.size_mb, 1),
+                    "idle_seconds": round(now - entry.last_used, 1),
+                    "hits": entry.hits,
+                    "in_use": entry.in_use,
+                    "pinned": key in self._pinned,
+                    "loaded_at": entry.loaded_at
+                }
+                for key, entry in reversed(self._entries.items())
+            ]
+            used = sum(entry.size_mb for entry in self._entries.values())
+        rss = _rss_mb()
+        return {
+            "budget_mb": round(self.budget_mb),
+            "used_mb": round(used, 1),
+            "idle_ttl_seconds": self.idle_ttl,
+            "evictions": self._evictions,
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "models": models
+        }
+
+    def _touch(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.last_used = time.monotonic()
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            return entry.model
+
+    def _used_mb(self) -> float:
+        with self._lock:
+            return sum(entry.size_mb for entry in self._entries.values())
+
+    def _make_room(self, size_mb: float, keep: Optional[str] = None):
+        """Выгружать самые давно использованные модели, пока новая не влезет в бюджет"""
+        if self.budget_mb <= 0:
+            return
+        while True:
+            with self._lock:
+                used = sum(entry.size_mb for entry in self._entries.values())
+                victims = [key for key, entry in self._entries.items()
+                           if key != keep and not entry.in_use and key not in self._pinned]
+                if used + size_mb <= self.budget_mb or not victims:
+                    return
+                victim = victims[0]
+                self._evictions += 1
+            logger.info(f"Memory budget {self.budget_mb:.0f} MB exceeded, evicting {victim}")
+            self.unload(victim)
+
+    def _ensure_reaper(self):
+        if self.idle_ttl <= 0 or (self._reaper and self._reaper.is_alive()):
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, name="model-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        """Выгрузка моделей, которые не использовались дольше idle_ttl"""
+        interval = max(5.0, min(60.0, self.idle_ttl / 2))
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self._lock:
+                idle = [
+                    key for key, entry in self._entries.items()
+                    if not entry.in_use and key not in self._pinned and now - entry.last_used >= self.idle_ttl
+                ]
+            for key in idle:
+                logger.info(f"Model {key} idle for {self.idle_ttl:.0f}s, unloading")
+                self.unload(key)
+
+
+model_manager = ModelManager(MODEL_MEMORY_BUDGET_MB, MODEL_IDLE_TTL_SECONDS)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Text
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Float, ForeignKey, Text
 from datetime import datetime
 from .database import Base
 
@@ -24,14 +24,98 @@ class Transcript(Base):
     filename = Column(String)
     model = Column(String)
     language = Column(String, nullable=True)  # Язык аудио (None = автоопределение)
-    status = Column(String, default="pending")  # pending, processing, completed, failed
+    status = Column(String, default="pending")  # pending, processing, completed, failed, cancelled
     progress = Column(Float, default=0.0)  # 0.0 - 100.0
     status_message = Column(String, nullable=True)  # Текущий этап обработки
     duration_seconds = Column(Float, nullable=True)  # Длительность аудио в секундах
+    speech_seconds = Column(Float, nullable=True)  # Сколько в записи речи по VAD (None — ещё не размечена)
+    audio_hash = Column(String, nullable=True, index=True)  # SHA-256 содержимого аудиофайла
+    decode_profile = Column(String, nullable=True)  # Профиль декодирования, которым распознана запись
+    refine_model = Column(String, nullable=True)  # Модель уточнения слабых сегментов (каскад), None — без каскада
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     error_message = Column(String, nullable=True)
 
+class TranscriptCacheEntry(Base):
+    """Готовый результат транскрипции для аудио с данным хэшем, моделью, языком и параметрами"""
+    __tablename__ = "transcript_cache"
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String, unique=True, nullable=False)  # sha256 от (хэш аудио, модель, язык, параметры)
+    audio_hash = Column(String, nullable=False, index=True)
+    model = Column(String, nullable=False)
+    language = Column(String, nullable=True)  # None = автоопределение
+    source_file_id = Column(String, nullable=True)  # Транскрипция, из которой взят результат
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, nullable=True)
+
+class TranscriptionJob(Base):
+    """Задача в очереди транскрипции (переживает перезапуск сервера)"""
+    __tablename__ = "transcription_jobs"
+    id = Column(Integer, primary_key=True)  # Порядок id = порядок FIFO
+    file_id = Column(String, nullable=False, index=True)
+    model = Column(String, nullable=False)
+    language = Column(String, nullable=True)
+    speaker_recognition = Column(Integer, default=0)  # 0 или 1
+    word_timestamps = Column(Integer, default=0)  # 0 или 1: сохранять таймкоды слов
+    resume_from = Column(Float, nullable=True)  # С какой секунды продолжить после перезапуска (чекпоинт)
+    duration_seconds = Column(Float, nullable=True)  # Длительность аудио (копия из transcripts)
+    owner = Column(String, nullable=True, index=True)  # Кто поставил задачу: "user:<id>" или "ip:<адрес>" (лимиты на пользователя)
+    priority = Column(String, nullable=True)  # interactive или bulk: интерактивные задачи идут раньше массовых
+    decode_profile = Column(String, nullable=True)  # Профиль, выбранный пользователем (None — по очереди при запуске)
+    refine_model = Column(String, nullable=True)  # Модель уточнения слабых сегментов (каскад)
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed, cancelled
+    attempts = Column(Integer, default=0)
+    worker = Column(String, nullable=True)  # Имя воркера, который взял задачу
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    error_message = Column(String, nullable=True)
+
+class UploadSession(Base):
+    """Докачиваемая загрузка: файл приходит кусками (PUT с Content-Range) и переживает обрывы связи"""
+    __tablename__ = "upload_sessions"
+    id = Column(String, primary_key=True)  # uuid загрузки
+    filename = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)  # Полный размер файла (байт)
+    sha256 = Column(String, nullable=True)  # Заявленный клиентом хэш: сверяется при завершении
+    model = Column(String, nullable=False)
+    language = Column(String, nullable=True)
+    speaker_recognition = Column(Integer, default=0)
+    word_timestamps = Column(Integer, default=0)
+    force = Column(Integer, default=0)
+    decode_profile = Column(String, nullable=True)
+    refine_model = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class RealtimeFactor(Base):
+    """Историческая скорость распознавания модели на этом железе (оценка времени до первых сегментов)"""
+    __tablename__ = "realtime_factors"
+    id = Column(Integer, primary_key=True)
+    model = Column(String, nullable=False)
+    hardware = Column(String, nullable=False)  # Процессор или GPU: на разных машинах RTF несравним
+    rtf = Column(Float, nullable=False)  # Секунд работы на секунду аудио (скользящее среднее)
+    samples = Column(Integer, default=0)  # По скольким задачам усреднено
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class JobMetric(Base):
+    """Ресурсы, затраченные на одну завершённую транскрипцию (планирование мощности, /admin/capacity)"""
+    __tablename__ = "job_metrics"
+    id = Column(Integer, primary_key=True)
+    file_id = Column(String, nullable=False, index=True)
+    model = Column(String, nullable=False, index=True)
+    hardware = Column(String, nullable=False)  # Как в realtime_factors
+    executor = Column(String, nullable=False)  # thread или process (TRANSCRIPTION_EXECUTOR)
+    mode = Column(String, nullable=False)  # single, chunked, batch или cascade (уточнение слабых сегментов)
+    audio_seconds = Column(Float, nullable=False)  # Распознанное аудио (с чекпоинта, если задача продолжалась)
+    speech_seconds = Column(Float, nullable=True)  # Речь после VAD (None — не измерялась)
+    wall_seconds = Column(Float, nullable=False)  # Время распознавания (без очереди и диаризации)
+    cpu_seconds = Column(Float, nullable=True)  # Процессорное время
+    peak_rss_mb = Column(Float, nullable=True)  # Пиковая память процесса, в котором шло распознавание
+    concurrent_jobs = Column(Integer, default=1)  # Сколько задач выполнялось одновременно (максимум за время задачи)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
 class TranscriptAI(Base):
     __tablename__ = "transcript_ai"
     id = Column(Integer, primary_key=True)
@@ -0,0 +1,86 @@
+"""
+Предзагрузка и прогрев моделей при старте сервера (PRELOAD_MODELS).
+
+Модели грузятся в фоновом потоке, поэтому HTTP-порт поднимается сразу и остальные
+маршруты работают; /health/ready отвечает 200 только после прогрева всех моделей.
+Прогретые модели закрепляются в model_manager и не выгружаются ни по простою, ни по бюджету памяти.
+"""
+from typing import Dict, List
+import logging
+import threading
+import time
+
+from .config import PRELOAD_MODELS, TRANSCRIPTION_EXECUTOR
+
+logger = logging.getLogger(__name__)
+
+# Имена AI-моделей в PRELOAD_MODELS; всё остальное считается моделью Whisper
+AI_MODELS = ("sentiment", "summarization")
+
+
+class Preloader:
+    """Фоновая загрузка моделей с состоянием для проверки готовности"""
+
+    def __init__(self, models: List[str]):
+        self.models = models
+        # pending -> loading -> ready | unavailable (AI-модель недоступна, работают запасные методы) | failed
+        self.status: Dict[str, str] = {name: "pending" for name in models}
+        self.errors: Dict[str, str] = {}
+        self.seconds: Dict[str, float] = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread or not self.models:
+            return
+        self._thread = threading.Thread(target=self._run, name="model-preload", daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        """Все модели прогреты (недоступные AI-модели готовности не блокируют)"""
+        return all(state in ("ready", "unavailable") for state in self.status.values())
+
+    def state(self) -> dict:
+        return {
+            "ready": self.ready,
+            "models": dict(self.status),
+            "load_seconds": dict(self.seconds),
+            "errors": dict(self.errors)
+        }
+
+    def _run(self):
+        for name in self.models:
+            self.status[name] = "loading"
+            started = time.monotonic()
+            try:
+                warmed = self._warm(name)
+                self.status[name] = "ready" if warmed else "unavailable"
+                self.seconds[name] = round(time.monotonic() - started, 1)
+                logger.info(f"Preloaded model {name} in {self.seconds[name]}s")
+            except Exception as e:
+                self.status[name] = "failed"
+                self.errors[name] = str(e)
+                logger.error(f"Preloading model {name} failed: {e}", exc_info=True)
+        if self.ready:
+            logger.info("All preloaded models are warm, server is ready")
+
+    @staticmethod
+    def _warm(name: str) -> bool:
+        if name in AI_MODELS:
+            from .ai_service import warmup
+            return warmup(name)
+
+        from .whisper_service import allowed_models
+        if name not in allowed_models():
+            raise ValueError(f"Model {name} does not fit into MODEL_MEMORY_BUDGET_MB")
+        if TRANSCRIPTION_EXECUTOR == "process":
+            # Модели Whisper живут в процессах пула — прогреваем каждый
+            from .process_pool import process_pool
+            process_pool.warmup(name)
+        else:
+            from .whisper_service import warmup
+            warmup(name)
+        return True
+
+
+preloader = Preloader(PRELOAD_MODELS)
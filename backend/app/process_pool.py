@@ -0,0 +1,290 @@
+"""
+Пул долгоживущих процессов для транскрипции (режим TRANSCRIPTION_EXECUTOR=process).
+
+Каждый процесс держит свои модели Whisper в памяти и получает задачи через Pipe,
+а сегменты и прогресс отправляет обратно по мере готовности. Падение процесса
+(например, OOM-kill) роняет только текущую задачу: процесс перезапускается,
+веб-сервер продолжает работать.
+"""
+from typing import Callable, Iterator, List, Optional
+import logging
+import multiprocessing
+import threading
+
+from .config import TRANSCRIPTION_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# spawn: дочерний процесс не наследует потоки и состояние torch/uvicorn родителя
+_mp = multiprocessing.get_context("spawn")
+
+# Как часто проверять, жив ли процесс, пока ждём от него сообщение (секунды)
+_POLL_INTERVAL = 1.0
+
+
+class WorkerCrashed(RuntimeError):
+    """Процесс-воркер завершился во время выполнения задачи"""
+
+
+def _worker_main(conn):
+    """Точка входа дочернего процесса: выполняет задачи из conn до команды stop"""
+    from .metrics import UsageMeter
+    from .whisper_service import transcribe_segments, transcribe_batch, warmup
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message[0] == "stop":
+            return
+
+        if message[0] == "warmup":
+            try:
+                warmup(message[1])
+                conn.send(("done",))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+            continue
+
+        if message[0] == "batch":
+            _, audios, model_name, language = message
+            try:
+                # Процесс выполняет одну задачу за раз: его ресурсы — ресурсы этой задачи
+                meter = UsageMeter()
+                stats = {}
+                results = transcribe_batch(audios, model_name, language, stats)
+                conn.send(("batch_result", results, {**stats, **meter.stats()}))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+            continue
+
+        _, audio_path, model_name, language, word_timestamps, profile = message
+        try:
+            def progress_callback(progress: float, status_message: str):
+                conn.send(("progress", progress, status_message))
+
+            meter = UsageMeter()
+            stats = {}
+            for seg in transcribe_segments(audio_path, model_name, language, progress_callback, word_timestamps, stats,
+                                           profile):
+                conn.send(("segment", seg))
+            conn.send(("stats", {**stats, **meter.stats()}))
+            conn.send(("done",))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class WorkerProcess:
+    """Один процесс-воркер и канал связи с ним"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.loaded_models = set()
+        self.in_flight = False  # Задача отправлена, но ответ "done"/"error" ещё не получен
+        self._start()
+
+    def _start(self):
+        self.conn, child_conn = _mp.Pipe()
+        self.process = _mp.Process(
+            target=_worker_main,
+            args=(child_conn,),
+            name=f"transcription-process-{self.index}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.loaded_models = set()
+        self.in_flight = False
+        logger.info(f"Started transcription process {self.index} (pid={self.process.pid})")
+
+    def restart(self):
+        """Перезапустить процесс после падения"""
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self._start()
+
+    def stop(self):
+        try:
+            self.conn.send(("stop",))
+        except Exception:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+    def _recv(self):
+        """Дождаться сообщения от процесса, следя за тем, что он жив"""
+        while True:
+            try:
+                if self.conn.poll(_POLL_INTERVAL):
+                    return self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if not self.process.is_alive():
+                break
+        raise WorkerCrashed(
+            f"Transcription process {self.index} died (exit code {self.process.exitcode})"
+        )
+
+    def run(self, audio_path, model_name: str, language: Optional[str],
+            progress_callback: Optional[Callable[[float, str], None]],
+            word_timestamps: bool = False, stats: Optional[dict] = None,
+            profile: Optional[str] = None) -> Iterator[dict]:
+        """Отправить задачу процессу и отдавать сегменты по мере их получения"""
+        self.in_flight = True
+        self.conn.send(("job", audio_path, model_name, language, word_timestamps, profile))
+        self.loaded_models.add(model_name)
+        while True:
+            message = self._recv()
+            kind = message[0]
+            if kind == "segment":
+                yield message[1]
+            elif kind == "progress":
+                if progress_callback:
+                    progress_callback(message[1], message[2])
+            elif kind == "stats":
+                if stats is not None:
+                    stats.update(message[1])
+            elif kind == "done":
+                self.in_flight = False
+                return
+            elif kind == "error":
+                self.in_flight = False
+                raise RuntimeError(message[1])
+
+    def run_warmup(self, model_name: str):
+        """Загрузить и прогреть модель в процессе"""
+        self.in_flight = True
+        self.conn.send(("warmup", model_name))
+        message = self._recv()
+        self.in_flight = False
+        if message[0] == "error":
+            raise RuntimeError(message[1])
+        self.loaded_models.add(model_name)
+
+    def run_batch(self, audios, model_name: str, language: Optional[str],
+                  stats: Optional[dict] = None) -> List[List[dict]]:
+        """Отправить процессу батч коротких записей и дождаться результата"""
+        self.in_flight = True
+        self.conn.send(("batch", audios, model_name, language))
+        self.loaded_models.add(model_name)
+        message = self._recv()
+        self.in_flight = False
+        if message[0] == "error":
+            raise RuntimeError(message[1])
+        if stats is not None:
+            stats.update(message[2])
+        return message[1]
+
+
+class ProcessPool:
+    """Пул процессов-воркеров с привязкой к уже загруженным моделям"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[WorkerProcess] = []
+        self._all: List[WorkerProcess] = []
+        self._lock = threading.Condition()
+
+    def start(self):
+        with self._lock:
+            if self._all:
+                return
+            for i in range(self.size):
+                worker = WorkerProcess(i)
+                self._all.append(worker)
+                self._idle.append(worker)
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._all:
+                worker.stop()
+            self._all.clear()
+            self._idle.clear()
+
+    def _acquire(self, model_name: str) -> WorkerProcess:
+        """Взять свободный процесс; предпочтительно тот, где модель уже загружена"""
+        with self._lock:
+            while not self._idle:
+                self._lock.wait()
+            for worker in self._idle:
+                if model_name in worker.loaded_models:
+                    break
+            else:
+                worker = self._idle[0]
+            self._idle.remove(worker)
+            return worker
+
+    def _release(self, worker: WorkerProcess):
+        with self._lock:
+            self._idle.append(worker)
+            # Ждать могут и задачи, и прогрев — будим всех, каждый проверит своё условие
+            self._lock.notify_all()
+
+    def warmup(self, model_name: str):
+        """Загрузить и прогреть модель во всех процессах пула (каждый держит свою копию)"""
+        if not self._all:
+            self.start()
+        while True:
+            with self._lock:
+                while True:
+                    cold = [w for w in self._idle if model_name not in w.loaded_models]
+                    if cold:
+                        break
+                    if all(model_name in w.loaded_models for w in self._all):
+                        return
+                    self._lock.wait()
+                worker = cold[0]
+                self._idle.remove(worker)
+            try:
+                worker.run_warmup(model_name)
+            finally:
+                if worker.in_flight:
+                    worker.restart()
+                self._release(worker)
+
+    def transcribe_segments(self, audio_path, model_name: str,
+                            language: Optional[str] = None,
+                            progress_callback: Optional[Callable[[float, str], None]] = None,
+                            word_timestamps: bool = False, stats: Optional[dict] = None,
+                            profile: Optional[str] = None) -> Iterator[dict]:
+        """То же, что whisper_service.transcribe_segments, но в отдельном процессе (путь или PCM-массив).
+
+        В stats, кроме speech_seconds, попадают cpu_seconds и peak_rss_mb процесса, выполнявшего задачу.
+        """
+        if not self._all:
+            self.start()
+        worker = self._acquire(model_name)
+        try:
+            yield from worker.run(audio_path, model_name, language, progress_callback, word_timestamps, stats, profile)
+        except WorkerCrashed:
+            logger.error(f"Transcription process {worker.index} crashed, restarting it")
+            raise
+        finally:
+            # Процесс упал или задачу бросили на середине: в канале могут остаться
+            # сообщения старой задачи, поэтому процесс перезапускаем
+            if worker.in_flight:
+                worker.restart()
+            self._release(worker)
+
+    def transcribe_batch(self, audios, model_name: str, language: Optional[str] = None,
+                         stats: Optional[dict] = None) -> List[List[dict]]:
+        """То же, что whisper_service.transcribe_batch, но в отдельном процессе (в stats ещё cpu_seconds и peak_rss_mb)"""
+        if not self._all:
+            self.start()
+        worker = self._acquire(model_name)
+        try:
+            return worker.run_batch(audios, model_name, language, stats)
+        finally:
+            if worker.in_flight:
+                worker.restart()
+            self._release(worker)
+
+
+process_pool = ProcessPool(TRANSCRIPTION_WORKERS)
@@ -0,0 +1,116 @@
+"""
+Реестр прогресса транскрипций в памяти процесса.
+
+Тики прогресса обновляют только память (и шину событий), а в БД попадают не чаще
+раза в PROGRESS_FLUSH_SECONDS на задачу. Смены состояния (processing/completed/failed)
+пишутся в БД сразу. Читатели статуса сначала смотрят сюда, потом в БД.
+
+Оценка оставшегося времени (eta_seconds) и текущий RTF живут только здесь: в БД их нет.
+"""
+from datetime import datetime
+from typing import Dict, Optional
+import logging
+import threading
+import time
+
+from .config import PROGRESS_FLUSH_SECONDS
+from .database import SessionLocal
+from .events import publish_job_event
+from .models import Transcript
+
+logger = logging.getLogger(__name__)
+
+# Поля Transcript, которые ведёт реестр
+_LIVE_FIELDS = ("status", "progress", "status_message", "error_message")
+# Оценка времени выполняемой задачи (см. rtf.py)
+_TIMING_FIELDS = ("eta_seconds", "realtime_factor")
+
+
+class ProgressRegistry:
+    """Живой прогресс задач с отложенной записью в БД"""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_id: str) -> Optional[dict]:
+        """Актуальное состояние задачи, если она выполняется в этом процессе"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            return {k: entry.get(k) for k in _LIVE_FIELDS + _TIMING_FIELDS} if entry else None
+
+    def apply(self, file_id: str, target: dict) -> dict:
+        """Подставить живые значения в словарь статуса, собранный из БД"""
+        live = self.get(file_id)
+        if live:
+            target.update({k: v for k, v in live.items() if k in target})
+        return target
+
+    def update(self, file_id: str, progress: float, message: str,
+               eta_seconds: Optional[float] = None, realtime_factor: Optional[float] = None):
+        """Тик прогресса: в память сразу, в БД — не чаще flush_interval"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.setdefault(file_id, {
+                "status": "processing", "progress": progress, "status_message": message,
+                "error_message": None, "flushed_at": now
+            })
+            entry["progress"] = progress
+            entry["status_message"] = message
+            if eta_seconds is not None:
+                entry["eta_seconds"] = round(eta_seconds)
+                entry["realtime_factor"] = round(realtime_factor, 3) if realtime_factor is not None else None
+            status = entry["status"]
+            eta = entry.get("eta_seconds")
+            need_flush = now - entry["flushed_at"] >= self.flush_interval
+            if need_flush:
+                entry["flushed_at"] = now
+        publish_job_event(file_id, status, progress, message, eta_seconds=eta)
+        if need_flush:
+            self._write(file_id, {"progress": progress, "status_message": message})
+
+    def transition(self, file_id: str, status: str, progress: Optional[float] = None,
+                   message: Optional[str] = None, error: Optional[str] = None):
+        """Смена состояния: сразу пишется в БД; завершённые задачи удаляются из реестра"""
+        fields = {"status": status, "status_message": message, "error_message": error}
+        if progress is not None:
+            fields["progress"] = progress
+        if status == "completed":
+            fields["completed_at"] = datetime.utcnow()
+
+        with self._lock:
+            if status in ("completed", "failed", "cancelled"):
+                self._entries.pop(file_id, None)
+            else:
+                entry = self._entries.setdefault(file_id, {"progress": progress or 0.0})
+                entry.update({k: v for k, v in fields.items() if k in _LIVE_FIELDS})
+                entry["flushed_at"] = time.monotonic()
+
+        self._write(file_id, fields)
+        publish_job_event(file_id, status, progress, message, error)
+
+    def flush_all(self):
+        """Записать в БД накопленный прогресс всех задач (при остановке сервера)"""
+        with self._lock:
+            pending = {fid: dict(e) for fid, e in self._entries.items()}
+        for file_id, entry in pending.items():
+            self._write(file_id, {"progress": entry["progress"], "status_message": entry["status_message"]})
+
+    @staticmethod
+    def _write(file_id: str, fields: dict):
+        db = SessionLocal()
+        try:
+            transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+            if transcript:
+                for key, value in fields.items():
+                    setattr(transcript, key, value)
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error saving progress for {file_id}: {e}")
+        finally:
+            db.close()
+
+
+progress_registry = ProgressRegistry(PROGRESS_FLUSH_SECONDS)
@@ -0,0 +1,123 @@
+"""
+Кэш результатов транскрипции по содержимому аудио.
+
+Ключ — SHA-256 аудиофайла + модель + язык + параметры декодирования (и каскада), поэтому повторная
+загрузка того же файла с теми же настройками завершается сразу, без запуска Whisper.
+Если профиль декодирования не выбран, подходит результат любого профиля (сначала точнейший).
+Сегменты лежат в RESULT_CACHE_DIR отдельно от транскрипций: удаление исходной
+транскрипции кэш не ломает.
+"""
+from datetime import datetime
+from typing import List, Optional
+import hashlib
+import json
+import logging
+
+from .config import (
+    CASCADE_MAX_COMPRESSION_RATIO, CASCADE_MAX_NO_SPEECH_PROB, CASCADE_MIN_AVG_LOGPROB, CASCADE_PAD_SECONDS,
+    RESULT_CACHE_DIR, RESULT_CACHE_ENABLED
+)
+from .database import SessionLocal
+from .models import Transcript, TranscriptCacheEntry
+from .segment_store import dump_segments, load_segments
+
+logger = logging.getLogger(__name__)
+
+
+# Порядок, в котором подходят результаты, если профиль не выбран
+PROFILE_PREFERENCE = ("accurate", "balanced", "fast")
+
+
+def cache_key(audio_hash: str, model: str, language: Optional[str], speaker_recognition: bool = False,
+              word_timestamps: bool = False, profile: Optional[str] = None,
+              refine_model: Optional[str] = None) -> str:
+    """Ключ кэша: меняется при смене модели, языка или параметров декодирования (и каскада)"""
+    from .whisper_service import decode_options, normalize_model_name
+
+    params = {
+        "decode": decode_options(profile),
+        "speaker_recognition": bool(speaker_recognition),
+        "word_timestamps": bool(word_timestamps)
+    }
+    if refine_model:
+        # Без каскада ключ прежний: уже накопленный кэш остаётся действительным
+        params["cascade"] = {
+            "model": normalize_model_name(refine_model),
+            "min_avg_logprob": CASCADE_MIN_AVG_LOGPROB,
+            "max_no_speech_prob": CASCADE_MAX_NO_SPEECH_PROB,
+            "max_compression_ratio": CASCADE_MAX_COMPRESSION_RATIO,
+            "pad_seconds": CASCADE_PAD_SECONDS
+        }
+    params = json.dumps(params, sort_keys=True)
+    raw = f"{audio_hash}|{normalize_model_name(model)}|{language or 'auto'}|{params}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def lookup(audio_hash: str, model: str, language: Optional[str], speaker_recognition: bool = False,
+           word_timestamps: bool = False, profile: Optional[str] = None,
+           refine_model: Optional[str] = None) -> Optional[List[dict]]:
+    """Готовые сегменты транскрипции из кэша или None (profile=None — любого профиля)"""
+    if not RESULT_CACHE_ENABLED or not audio_hash:
+        return None
+    keys = [cache_key(audio_hash, model, language, speaker_recognition, word_timestamps, name, refine_model)
+            for name in ([profile] if profile else PROFILE_PREFERENCE)]
+    db = SessionLocal()
+    try:
+        entries = {entry.cache_key: entry for entry in db.query(TranscriptCacheEntry).filter(
+            TranscriptCacheEntry.cache_key.in_(keys)
+        ).all()}
+        key = next((key for key in keys if key in entries), None)
+        if key is None:
+            return None
+        entry = entries[key]
+        path = RESULT_CACHE_DIR / f"{key}.jsonl"
+        if not path.exists():
+            # Файл кэша удалили вручную — запись больше не нужна
+            db.delete(entry)
+            db.commit()
+            return None
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_hit_at = datetime.utcnow()
+        db.commit()
+        return load_segments(path)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Result cache lookup failed: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def store(file_id: str, segments: List[dict], speaker_recognition: bool = False, word_timestamps: bool = False):
+    """Сохранить сегменты транскрипции file_id в кэш (если известен хэш её аудио)"""
+    if not RESULT_CACHE_ENABLED:
+        return
+    db = SessionLocal()
+    try:
+        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+        if not transcript or not transcript.audio_hash:
+            return
+        key = cache_key(transcript.audio_hash, transcript.model, transcript.language,
+                        speaker_recognition, word_timestamps, transcript.decode_profile, transcript.refine_model)
+
+        RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        dump_segments(RESULT_CACHE_DIR / f"{key}.jsonl", segments)
+
+        entry = db.query(TranscriptCacheEntry).filter(TranscriptCacheEntry.cache_key == key).first()
+        if entry is None:
+            db.add(TranscriptCacheEntry(
+                cache_key=key,
+                audio_hash=transcript.audio_hash,
+                model=transcript.model,
+                language=transcript.language,
+                source_file_id=file_id,
+                created_at=datetime.utcnow()
+            ))
+        else:
+            entry.source_file_id = file_id
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Cannot store {file_id} in result cache: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Query
+
+from .. import metrics
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/capacity")
+async def capacity(days: float = Query(7.0, gt=0, description="За сколько последних дней учитывать задачи")):
+    """Перцентили RTF по моделям и сколько часов аудио в час сервер выдержит при текущей параллельности"""
+    return metrics.capacity(days)
@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from ..database import SessionLocal
+from ..models import Transcript
+from ..events import event_broker
+from ..progress import progress_registry
+import asyncio
+import json
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# Комментарий-пинг, чтобы прокси (nginx) не закрывали простаивающее соединение
+HEARTBEAT_SECONDS = 15
+
+
+def _sse(event: dict) -> str:
+    return f"event: job\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _snapshot(file_ids: List[str]) -> List[dict]:
+    """Текущее состояние запрошенных файлов — чтобы клиент не пропустил события до подписки"""
+    db = SessionLocal()
+    try:
+        transcripts = db.query(Transcript).filter(Transcript.file_id.in_(file_ids)).all()
+        return [
+            progress_registry.apply(t.file_id, {
+                "file_id": t.file_id,
+                "status": t.status,
+                "progress": t.progress,
+                "status_message": t.status_message,
+                "error_message": t.error_message
+            })
+            for t in transcripts
+        ]
+    finally:
+        db.close()
+
+
+@router.get("/jobs")
+async def job_events(request: Request, file_id: Optional[List[str]] = Query(None)):
+    """Поток Server-Sent Events с прогрессом, сообщениями статуса и завершением транскрипций.
+
+    Без параметров приходят события по всем файлам; с ?file_id=...&file_id=... — только по указанным.
+    """
+    wanted = set(file_id) if file_id else None
+    queue = event_broker.subscribe(wanted)
+
+    async def stream():
+        try:
+            if wanted:
+                for event in _snapshot(list(wanted)):
+                    yield _sse(event)
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(event)
+        finally:
+            event_broker.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Отключаем буферизацию nginx
+        }
+    )
@@ -5,6 +5,8 @@ from pathlib import Path
 from ..config import TEXT_DIR
 from ..database import SessionLocal
 from ..models import Transcript
+from ..segment_store import read_segments
+from ..utils import format_timestamp
 import io
 import re
 import logging
@@ -47,57 +49,24 @@ def get_content_disposition(filename: str, ext: str) -> str:
 router = APIRouter(prefix="/export", tags=["export"])
 
 
-def parse_transcript_lines(text: str):
-    """Parse transcript text into segments with timestamps and text"""
-    segments = []
-    lines = text.strip().split('\n')
-    
-    # Pattern: [00:00:00 --> 00:00:05] or [00:00:00.000 --> 00:00:05.000]  Text here
-    pattern = r'\[(\d{2}:\d{2}:\d{2}(?:\.\d{3})?)\s*-->\s*(\d{2}:\d{2}:\d{2}(?:\.\d{3})?)\]\s*(.+)'
-    
-    for line in lines:
-        match = re.match(pattern, line.strip())
-        if match:
-            start_time = match.group(1)
-            end_time = match.group(2)
-            # Remove milliseconds for display
-            if '.' in start_time:
-                start_time = start_time.split('.')[0]
-            if '.' in end_time:
-                end_time = end_time.split('.')[0]
-            text_content = match.group(3).strip()
-            segments.append({
-                'start': start_time,
-                'end': end_time,
-                'text': text_content
-            })
-        elif line.strip():
-            # Line without timestamp
-            segments.append({
-                'start': None,
-                'end': None,
-                'text': line.strip()
-            })
-    
+def load_segments(file_id: str) -> list:
+    """Load transcript segments (float start/end in seconds) from the segment store"""
+    segments = read_segments(file_id)
+    if segments is None:
+        raise HTTPException(status_code=404, detail="Файл транскрипции не найден")
     return segments
 
 
-def time_to_srt_format(time_str: str) -> str:
-    """Convert HH:MM:SS to SRT format HH:MM:SS,000"""
-    if time_str:
-        return f"{time_str},000"
-    return "00:00:00,000"
+def segment_text(seg: dict) -> str:
+    """Segment text prefixed with the speaker label when speakers were recognized"""
+    if seg.get('speaker') is not None:
+        return f"Спикер {seg['speaker']}: {seg['text']}"
+    return seg['text']
 
 
-def time_to_seconds(time_str: str) -> float:
-    """Convert HH:MM:SS to seconds"""
-    if not time_str:
-        return 0.0
-    parts = time_str.split(':')
-    hours = int(parts[0])
-    minutes = int(parts[1])
-    seconds = int(parts[2])
-    return hours * 3600 + minutes * 60 + seconds
+def clock_time(seconds: float) -> str:
+    """HH:MM:SS for DOCX/XLSX: the stored transcript timestamp without milliseconds"""
+    return format_timestamp(seconds).split('.')[0]
 
 
 @router.get("/txt/{file_id}")
@@ -139,20 +108,15 @@ async def export_srt(file_id: str):
         if not transcript:
             raise HTTPException(status_code=404, detail="Транскрипция не найдена")
         
-        text_path = TEXT_DIR / f"{file_id}.txt"
-        if not text_path.exists():
-            raise HTTPException(status_code=404, detail="Файл транскрипции не найден")
-        
-        content = text_path.read_text(encoding='utf-8')
-        segments = parse_transcript_lines(content)
+        segments = load_segments(file_id)
         
         # Generate SRT format
         srt_lines = []
         for i, seg in enumerate(segments, 1):
-            if seg['start'] and seg['end']:
+            if seg['start'] is not None and seg['end'] is not None:
                 srt_lines.append(str(i))
-                srt_lines.append(f"{time_to_srt_format(seg['start'])} --> {time_to_srt_format(seg['end'])}")
-                srt_lines.append(seg['text'])
+                srt_lines.append(f"{format_timestamp(seg['start']).replace('.', ',')} --> {format_timestamp(seg['end']).replace('.', ',')}")
+                srt_lines.append(segment_text(seg))
                 srt_lines.append("")  # Empty line between entries
         
         srt_content = "\n".join(srt_lines)
@@ -188,12 +152,7 @@ async def export_docx(file_id: str):
         if not transcript:
             raise HTTPException(status_code=404, detail="Транскрипция не найдена")
         
-        text_path = TEXT_DIR / f"{file_id}.txt"
-        if not text_path.exists():
-            raise HTTPException(status_code=404, detail="Файл транскрипции не найден")
-        
-        content = text_path.read_text(encoding='utf-8')
-        segments = parse_transcript_lines(content)
+        segments = load_segments(file_id)
         
         # Create DOCX document
         doc = Document()
@@ -214,12 +173,12 @@ async def export_docx(file_id: str):
         # Content
         for seg in segments:
             p = doc.add_paragraph()
-            if seg['start'] and seg['end']:
-                timestamp_run = p.add_run(f"[{seg['start']} --> {seg['end']}] ")
+            if seg['start'] is not None and seg['end'] is not None:
+                timestamp_run = p.add_run(f"[{clock_time(seg['start'])} --> {clock_time(seg['end'])}] ")
                 timestamp_run.bold = True
                 timestamp_run.font.size = Pt(10)
             # Sanitize text for XML compatibility
-            p.add_run(sanitize_text(seg['text']))
+            p.add_run(sanitize_text(segment_text(seg)))
         
         filename = transcript.filename or 'transcript'
         
@@ -276,12 +235,7 @@ async def export_xlsx(file_id: str):
         if not transcript:
             raise HTTPException(status_code=404, detail="Транскрипция не найдена")
         
-        text_path = TEXT_DIR / f"{file_id}.txt"
-        if not text_path.exists():
-            raise HTTPException(status_code=404, detail="Файл транскрипции не найден")
-        
-        content = text_path.read_text(encoding='utf-8')
-        segments = parse_transcript_lines(content)
+        segments = load_segments(file_id)
         
         # Create workbook
         wb = Workbook()
@@ -310,18 +264,19 @@ async def export_xlsx(file_id: str):
         # Data
         for row, seg in enumerate(segments, 2):
             ws.cell(row=row, column=1, value=row-1).border = thin_border
-            ws.cell(row=row, column=2, value=seg['start'] or '').border = thin_border
-            ws.cell(row=row, column=3, value=seg['end'] or '').border = thin_border
+            has_times = seg['start'] is not None and seg['end'] is not None
+            ws.cell(row=row, column=2, value=clock_time(seg['start']) if has_times else '').border = thin_border
+            ws.cell(row=row, column=3, value=clock_time(seg['end']) if has_times else '').border = thin_border
             
             # Calculate duration
-            if seg['start'] and seg['end']:
-                duration = time_to_seconds(seg['end']) - time_to_seconds(seg['start'])
+            if has_times:
+                duration = seg['end'] - seg['start']
                 ws.cell(row=row, column=4, value=round(duration, 1)).border = thin_border
             else:
                 ws.cell(row=row, column=4, value='').border = thin_border
             
             # Sanitize text for XML compatibility
-            text_cell = ws.cell(row=row, column=5, value=sanitize_text(seg['text']))
+            text_cell = ws.cell(row=row, column=5, value=sanitize_text(segment_text(seg)))
             text_cell.border = thin_border
             text_cell.alignment = Alignment(wrap_text=True)
         
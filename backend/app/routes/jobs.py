@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException
+from ..database import SessionLocal
+from ..job_queue import job_queue
+from ..models import Transcript
+from ..model_manager import model_manager
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("/queue")
+async def queue_stats():
+    """Глубина очереди транскрипций и загрузка воркеров по моделям"""
+    return job_queue.stats()
+
+
+@router.get("/models")
+async def model_stats():
+    """Загруженные в процесс API модели, их размер и бюджет памяти; какие модели Whisper разрешены"""
+    from ..whisper_service import allowed_models
+    return {**model_manager.stats(), "allowed_whisper_models": allowed_models()}
+
+
+@router.post("/{file_id}/cancel")
+async def cancel_job(file_id: str):
+    """Отменить транскрипцию: из очереди задача снимается сразу, выполняемая останавливается между сегментами"""
+    db = SessionLocal()
+    try:
+        if not db.query(Transcript).filter(Transcript.file_id == file_id).first():
+            raise HTTPException(status_code=404, detail="Транскрипция не найдена")
+    finally:
+        db.close()
+
+    status = job_queue.cancel(file_id)
+    if status is None:
+        raise HTTPException(status_code=409, detail="Транскрипция не в очереди и не обрабатывается")
+    return {
+        "file_id": file_id,
+        "status": status,
+        "message": "Обработка отменена" if status == "cancelled" else "Обработка останавливается..."
+    }
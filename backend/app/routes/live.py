@@ -0,0 +1,117 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from ..config import STREAM_MAX_SESSIONS
+from ..streaming import AudioDecoder, StreamingSession, save_session
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["live"])
+
+_active_sessions = 0
+
+
+@router.websocket("/ws/transcribe")
+async def transcribe_stream(websocket: WebSocket, model: str = "base", language: str = "auto",
+                            format: str = "pcm_s16le", sample_rate: int = 16000, save: bool = True):
+    """Потоковое распознавание с микрофона.
+
+    Клиент шлёт бинарные сообщения с аудио (format: pcm_s16le/pcm_f32le с частотой sample_rate
+    или opus — по пакету на сообщение) и текстовое {"type": "stop"} в конце.
+    Сервер отвечает {"type": "ready"}, затем {"type": "partial", "text", ...} и
+    {"type": "final", "segments": [...]}; после закрытия — {"type": "done", "file_id"}:
+    сессия сохраняется как обычная транскрипция. save=false — не сохранять (короткие реплики
+    тренажёра диалогов): file_id будет null.
+    """
+    global _active_sessions
+    from ..whisper_service import allowed_models
+
+    await websocket.accept()
+    if model not in allowed_models():
+        await websocket.send_json({"type": "error", "detail": f"Модель '{model}' недоступна на этом сервере"})
+        await websocket.close(code=1008)
+        return
+    if _active_sessions >= STREAM_MAX_SESSIONS:
+        await websocket.send_json({"type": "error", "detail": "Слишком много потоковых сессий, попробуйте позже"})
+        await websocket.close(code=1013)
+        return
+    try:
+        decoder = AudioDecoder(format, sample_rate)
+    except (ValueError, ImportError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1003)
+        return
+
+    _active_sessions += 1
+    session = StreamingSession(model, language if language != "auto" else None)
+    new_audio = asyncio.Event()
+    closed = False
+    connected = True
+
+    async def send(event: dict):
+        nonlocal connected
+        if not connected:
+            return
+        try:
+            await websocket.send_json(event)
+        except Exception:
+            connected = False
+
+    async def decode_loop():
+        # Распознавание идёт в потоке; пока оно работает, приём аудио продолжается
+        while not closed:
+            await new_audio.wait()
+            new_audio.clear()
+            while not closed and session.due():
+                try:
+                    events = await asyncio.to_thread(session.step)
+                except Exception as e:
+                    logger.error(f"Live transcription step failed: {e}", exc_info=True)
+                    events = [{"type": "error", "detail": str(e)}]
+                for event in events:
+                    await send(event)
+
+    decoder_task = asyncio.create_task(decode_loop())
+    try:
+        await send({"type": "ready", "model": model, "language": session.language})
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                connected = False
+                break
+            if message.get("bytes"):
+                session.add(decoder.decode(message["bytes"]))
+                new_audio.set()
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if command.get("type") == "stop":
+                    break
+    except WebSocketDisconnect:
+        connected = False
+    except Exception as e:
+        logger.error(f"Live transcription stream failed: {e}", exc_info=True)
+        await send({"type": "error", "detail": str(e)})
+    finally:
+        closed = True
+        new_audio.set()
+        try:
+            await decoder_task
+            # Дораспознаём остаток и сохраняем сессию, даже если клиент просто отключился
+            for event in await asyncio.to_thread(session.finish):
+                await send(event)
+            file_id = await asyncio.to_thread(save_session, session) if save else None
+            await send({"type": "done", "file_id": file_id, "duration": round(session.duration, 1)})
+        except Exception as e:
+            logger.error(f"Cannot finalize live session: {e}", exc_info=True)
+            await send({"type": "error", "detail": str(e)})
+        finally:
+            _active_sessions -= 1
+            if connected:
+                try:
+                    await websocket.close()
+                except Exception:
+                    pass
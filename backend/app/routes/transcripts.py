@@ -4,6 +4,10 @@ from typing import Optional
 from ..config import TEXT_DIR, AUDIO_DIR
 from ..database import SessionLocal
 from ..models import Transcript, Folder
+from ..progress import progress_registry
+from ..job_queue import job_queue
+from ..audio_cache import remove_pcm
+from ..segment_store import remove_segments
 from pathlib import Path
 
 router = APIRouter(prefix="/transcripts", tags=["transcripts"])
@@ -49,7 +53,7 @@ async def list_transcripts(folder_id: Optional[int] = Query(None), recent: bool
                     except:
                         pass
             
-            transcripts.append({
+            transcripts.append(progress_registry.apply(t.file_id, {
                 "id": t.file_id,
                 "filename": t.filename or "unknown",
                 "folder_id": t.folder_id,
@@ -63,7 +67,7 @@ async def list_transcripts(folder_id: Optional[int] = Query(None), recent: bool
                 "created_at": t.created_at.isoformat() if t.created_at else None,
                 "completed_at": t.completed_at.isoformat() if t.completed_at else None,
                 "error_message": t.error_message
-            })
+            }))
         
         return {"transcripts": transcripts}
     finally:
@@ -107,6 +111,9 @@ async def delete_transcript(file_id: str):
         if not transcript:
             raise HTTPException(status_code=404, detail="Транскрипция не найдена")
         
+        # Удаление отменяет обработку: задача снимается с очереди или останавливается воркером
+        job_queue.cancel(file_id)
+        
         # Удаляем файл транскрипции (игнорируем ошибки)
         try:
             text_path = TEXT_DIR / f"{file_id}.txt"
@@ -115,6 +122,8 @@ async def delete_transcript(file_id: str):
         except:
             pass
         
+        remove_segments(file_id)
+        
         # Удаляем аудиофайл (игнорируем ошибки)
         try:
             audio_files = list(AUDIO_DIR.glob(f"{file_id}_*"))
@@ -123,6 +132,14 @@ async def delete_transcript(file_id: str):
         except:
             pass
         
+        # Удаляем декодированный PCM, если это аудио не нужно другим транскрипциям
+        shared = transcript.audio_hash and db.query(Transcript).filter(
+            Transcript.audio_hash == transcript.audio_hash,
+            Transcript.file_id != file_id
+        ).count()
+        if not shared:
+            remove_pcm(transcript.audio_hash or file_id)
+        
         # Удаляем запись из БД
         db.delete(transcript)
         db.commit()
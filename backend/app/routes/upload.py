@@ -1,15 +1,22 @@
-from fastapi import APIRouter, UploadFile, Form, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import FileResponse
-from ..config import AUDIO_DIR, TEXT_DIR
-from ..models import Transcript
+from ..config import AUDIO_DIR, SPEECH_ANALYSIS_ON_UPLOAD, TEXT_DIR
+from ..models import Transcript, TranscriptionJob
 from ..database import SessionLocal
-from ..whisper_service import transcribe, transcribe_with_progress
+from ..whisper_service import DECODE_PROFILES, transcribe, transcribe_with_progress, allowed_models, model_size_mb
+from ..tasks import analyze_speech, find_audio_file, load_pcm, schedule_speech_analysis
+from ..audio_cache import SAMPLE_RATE, cached_speech_seconds, speech_timeline
+from ..job_queue import job_queue
+from ..progress import progress_registry
+from .. import admission, result_cache
+from ..segment_store import format_segments, read_partial, read_segments, save_edited_text, save_transcript
+from ..uploads import UploadError, receive_upload
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Optional
 from pydantic import BaseModel
+import asyncio
 import uuid
-import tempfile
 import logging
 from difflib import SequenceMatcher
 
@@ -50,75 +57,6 @@ def get_audio_duration(audio_path: Path) -> Optional[float]:
         return None
 
 
-def process_transcription_background(file_id: str, temp_path: Path, model: str, language: str = None, speaker_recognition: bool = False):
-    """Фоновая обработка транскрипции (выполняется в отдельном потоке)"""
-    
-    db = SessionLocal()
-    try:
-        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
-        if not transcript:
-            return
-        
-        # Callback для обновления прогресса
-        def update_progress(progress: float, message: str):
-            try:
-                # Создаём новую сессию для обновления прогресса
-                progress_db = SessionLocal()
-                try:
-                    progress_transcript = progress_db.query(Transcript).filter(Transcript.file_id == file_id).first()
-                    if progress_transcript:
-                        progress_transcript.progress = progress
-                        progress_transcript.status_message = message
-                        progress_db.commit()
-                finally:
-                    progress_db.close()
-            except Exception as e:
-                logger.error(f"Error updating progress: {e}")
-        
-        transcript.status = "processing"
-        transcript.progress = 5.0
-        lang_msg = f" ({language})" if language else " (авто)"
-        speaker_msg = " с распознаванием говорящих" if speaker_recognition else ""
-        transcript.status_message = f"Подготовка{lang_msg}..."
-        db.commit()
-        
-        # Транскрибируем с отслеживанием прогресса
-        # TODO: Реализовать поддержку speaker_recognition в transcribe_with_progress
-        text = transcribe_with_progress(str(temp_path), model, language=language, progress_callback=update_progress)
-        
-        # Сохраняем результат
-        text_path = TEXT_DIR / f"{file_id}.txt"
-        text_path.write_text(text, encoding="utf-8")
-        
-        # Обновляем статус
-        transcript.status = "completed"
-        transcript.progress = 100.0
-        transcript.status_message = "Готово"
-        transcript.completed_at = datetime.utcnow()
-        db.commit()
-        logger.info(f"Transcription completed: {file_id}")
-        
-    except Exception as e:
-        logger.error(f"Transcription failed for {file_id}: {e}", exc_info=True)
-        try:
-            transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
-            if transcript:
-                transcript.status = "failed"
-                transcript.error_message = str(e)
-                transcript.status_message = "Ошибка"
-                db.commit()
-        except:
-            pass
-    finally:
-        # Удаляем временный файл
-        if temp_path and temp_path.exists():
-            try:
-                temp_path.unlink()
-            except:
-                pass
-        db.close()
-
-
 def similarity(a: str, b: str) -> float:
     """Вычисляет схожесть двух строк (0.0 - 1.0)"""
     return SequenceMatcher(None, a.lower(), b.lower()).ratio()
@@ -159,75 +97,143 @@ async def check_duplicate(filename: str = Query(..., description="Имя фай
         db.close()
 
 
-@router.post("/upload")
-async def upload(file: UploadFile, model: str = Form("base"), language: str = Form("auto"), speaker_recognition: str = Form("false"), background_tasks: BackgroundTasks = None):
-    # Ограничение моделей для Railway
-    # С планом Hobby (8 GB RAM) можно использовать tiny, base и small
-    # Medium и Large всё ещё слишком тяжёлые
-    allowed_models = ["tiny", "base", "small"]
-    if model not in allowed_models:
+def parse_flag(value: Optional[str]) -> bool:
+    """Значение флага из формы ("true"/"1"/"yes"/"on")"""
+    return (value or "").lower() in ('true', '1', 'yes', 'on')
+
+
+def check_model(model: str):
+    """Разрешены модели, которые помещаются в бюджет памяти сервера (MODEL_MEMORY_BUDGET_MB)"""
+    models = allowed_models()
+    if model not in models:
         raise HTTPException(
             status_code=400, 
-            detail=f"Модель '{model}' слишком большая для этого сервера. Пожалуйста, используйте 'tiny', 'base' или 'small' для стабильной работы."
+            detail=f"Модель '{model}' слишком большая для этого сервера. Доступные модели: {', '.join(models)}."
         )
-    
-    uid = str(uuid.uuid4())
-    audio_path = AUDIO_DIR / f"{uid}_{file.filename}"
-    db = SessionLocal()
 
+
+def check_decode_profile(profile: Optional[str]) -> Optional[str]:
+    """Профиль декодирования из запроса: fast, balanced, accurate; пусто или "auto" — выбрать по очереди"""
+    if not profile or profile == "auto":
+        return None
+    if profile not in DECODE_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестный профиль '{profile}'. Доступные профили: auto, {', '.join(DECODE_PROFILES)}."
+        )
+    return profile
+
+
+def check_refine_model(model: str, refine_model: Optional[str]) -> Optional[str]:
+    """Модель уточнения для каскада: доступная на сервере и больше основной; пусто — без каскада"""
+    if not refine_model:
+        return None
+    check_model(refine_model)
+    if model_size_mb(refine_model) <= model_size_mb(model):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Модель уточнения '{refine_model}' должна быть больше основной модели '{model}'."
+        )
+    return refine_model
+
+
+def admit(model: Optional[str], owner: str, duration_seconds: Optional[float]):
+    """Проверка контроля приёма (см. admission.py): при отказе — 503/429 с Retry-After"""
     try:
-        # Сохраняем файл
-        content = await file.read()
-        audio_path.write_bytes(content)
+        admission.check(model, owner, duration_seconds)
+    except admission.AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+
+def start_transcription(uid: str, audio_path: Path, filename: str, audio_hash: str, model: str,
+                        language: str = "auto", speaker_recognition: bool = False, force: bool = False,
+                        word_timestamps: bool = False, owner: Optional[str] = None,
+                        priority: Optional[str] = None, decode_profile: Optional[str] = None,
+                        refine_model: Optional[str] = None, admitted: bool = False) -> dict:
+    """Зарегистрировать аудио, уже лежащее в AUDIO_DIR, и поставить его в очередь (или взять результат из кэша).
+
+    Общая точка входа для обычной и докачиваемой загрузки. При ошибке и при отказе
+    контроля приёма файл удаляется.
+    admitted — контроль приёма уже пройден (complete докачиваемой загрузки проверяет его,
+    пока файл ещё можно оставить для повтора), повторно не проверять.
+    """
+    db = SessionLocal()
 
-        # Получаем длительность аудио
+    try:
+        # Длительность — по заголовкам уже сохранённого файла (mutagen читает их на месте)
         duration_seconds = get_audio_duration(audio_path)
         if duration_seconds:
-            logger.info(f"Audio duration for {file.filename}: {duration_seconds:.2f} seconds")
+            logger.info(f"Audio duration for {filename}: {duration_seconds:.2f} seconds")
+
+        lang_param = language if language != 'auto' else None
+        # Такое аудио уже размечалось — длительность речи известна сразу
+        speech_seconds = cached_speech_seconds(audio_hash) if audio_hash else None
+
+        # Это аудио уже распознавали с теми же настройками — отдаём готовый результат
+        cached_segments = None if force else result_cache.lookup(
+            audio_hash, model, lang_param, speaker_recognition, word_timestamps, decode_profile, refine_model
+        )
+        # Результат из кэша очередь не нагружает; остальное проходит контроль приёма до создания записи
+        if cached_segments is None and owner and not admitted:
+            admit(model, owner, duration_seconds)
 
         # Создаём запись в БД
         transcript = Transcript(
             file_id=uid,
-            filename=file.filename,
+            filename=filename,
             model=model,
-            language=language if language != 'auto' else None,
+            language=lang_param,
             status="pending",
-            progress=10.0,
+            progress=0.0,
             status_message="Загрузка файла...",
             duration_seconds=duration_seconds,
+            speech_seconds=speech_seconds,
+            audio_hash=audio_hash,
+            user_id=admission.user_id(owner),
             created_at=datetime.utcnow()
         )
         db.add(transcript)
         db.commit()
         db.refresh(transcript)
 
-        # Копируем во временный файл с ASCII именем
-        ext = audio_path.suffix.lower()
-        temp_path = Path(tempfile.gettempdir()) / f"wf_{uuid.uuid4().hex}{ext}"
-        temp_path.write_bytes(content)
-        
-        # Запускаем обработку в фоне
-        lang_param = language if language != 'auto' else None
-        speaker_recognition_bool = speaker_recognition.lower() in ('true', '1', 'yes', 'on')
-        if background_tasks:
-            background_tasks.add_task(process_transcription_background, uid, temp_path, model, lang_param, speaker_recognition_bool)
-        else:
-            # Fallback: запускаем в том же потоке (если background_tasks не доступен)
-            import threading
-            thread = threading.Thread(
-                target=process_transcription_background,
-                args=(uid, temp_path, model, lang_param, speaker_recognition_bool)
-            )
-            thread.start()
+        if cached_segments is not None:
+            save_transcript(uid, cached_segments)
+            progress_registry.transition(uid, "completed", 100.0, "Готово (из кэша)")
+            logger.info(f"Transcript for {filename} served from result cache")
+            return {
+                "status": "completed",
+                "file_id": uid,
+                "filename": filename,
+                "model": model,
+                "language": language,
+                "speech_seconds": speech_seconds,
+                "cached": True,
+                "message": "Этот файл уже распознавался с такими настройками — результат взят из кэша"
+            }
+
+        # Ставим в очередь транскрипций (обработку выполнит пул воркеров)
+        job_queue.enqueue(uid, model, lang_param, speaker_recognition, duration_seconds, word_timestamps,
+                          owner, priority, decode_profile, refine_model)
+        if speech_seconds is None and SPEECH_ANALYSIS_ON_UPLOAD:
+            # Пока задача ждёт очереди, запись декодируется и размечается в фоне
+            schedule_speech_analysis(uid)
 
         return {
             "status": "pending",
             "file_id": uid,
-            "filename": file.filename,
+            "filename": filename,
             "model": model,
             "language": language,
+            "speech_seconds": speech_seconds,
+            # Место в очереди, оценка начала и готовности (queue_position, estimated_start_seconds, eta_seconds)
+            **(admission.estimate(uid) or {"queue_position": None}),
+            "cached": False,
             "message": "Файл загружен, обработка начата"
         }
+    except HTTPException:
+        db.rollback()
+        audio_path.unlink(missing_ok=True)
+        raise
     except Exception as e:
         db.rollback()
         if audio_path.exists():
@@ -236,6 +242,52 @@ async def upload(file: UploadFile, model: str = Form("base"), language: str = Fo
     finally:
         db.close()
 
+
+@router.post("/upload")
+async def upload(request: Request):
+    """Загрузить аудио и поставить в очередь.
+
+    Форма: file, model, language, speaker_recognition, force, word_timestamps, priority, decode_profile,
+    refine_model.
+    Файл пишется потоком сразу в хранилище. Тот же файл с теми же настройками берётся из кэша результатов
+    (force=true — распознать заново). word_timestamps=true — сохранить таймкоды слов.
+    priority=bulk — массовая загрузка: пропускает интерактивные задачи вперёд.
+    decode_profile — fast, balanced или accurate; по умолчанию выбирается по глубине очереди.
+    refine_model — каскад: запись распознаёт model, а сегменты, в которых она не уверена, —
+    заново эта (большая) модель.
+    Для больших файлов на нестабильной связи — докачиваемая загрузка, см. /uploads"""
+    uid = str(uuid.uuid4())
+    owner = admission.client_id(request)
+    # Пользователь уже упёрся в свой лимит — отказываем до приёма файла
+    admit(None, owner, 0)
+    try:
+        # Файл пишется блоками сразу под окончательным именем, SHA-256 считается по пути
+        received = await receive_upload(request, lambda filename: AUDIO_DIR / f"{uid}_{filename}")
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fields = received.fields
+    model = fields.get("model", "base")
+    try:
+        check_model(model)
+        decode_profile = check_decode_profile(fields.get("decode_profile"))
+        refine_model = check_refine_model(model, fields.get("refine_model"))
+    except HTTPException:
+        received.path.unlink(missing_ok=True)
+        raise
+
+    # Запись в БД, чтение заголовков файла и постановка в очередь — в потоке, не в цикле событий
+    return await asyncio.to_thread(
+        start_transcription, uid, received.path, received.filename, received.sha256, model,
+        language=fields.get("language", "auto"),
+        speaker_recognition=parse_flag(fields.get("speaker_recognition")),
+        force=parse_flag(fields.get("force")),
+        word_timestamps=parse_flag(fields.get("word_timestamps")),
+        owner=owner,
+        priority=fields.get("priority"),
+        decode_profile=decode_profile,
+        refine_model=refine_model
+    )
+
 @router.get("/transcript/{file_id}")
 async def get_transcript(file_id: str):
     db = SessionLocal()
@@ -246,12 +298,23 @@ async def get_transcript(file_id: str):
         
         # Если транскрипция ещё обрабатывается
         if transcript.status != "completed":
-            return {
+            status = progress_registry.apply(file_id, {
                 "file_id": file_id,
                 "status": transcript.status,
-                "progress": transcript.progress,
-                "message": "Транскрипция ещё обрабатывается" if transcript.status == "processing" else "Ожидает обработки"
-            }
+                "progress": transcript.progress
+            })
+            status["message"] = "Транскрипция ещё обрабатывается" if status["status"] == "processing" else "Ожидает обработки"
+            if status["status"] == "processing":
+                # Уже распознанные сегменты: их дописывают в хранилище по ходу работы
+                segments = read_partial(file_id)
+                status.update({
+                    "partial": True,
+                    "transcript": format_segments(segments),
+                    "segments": segments,
+                    "filename": transcript.filename,
+                    "model": transcript.model
+                })
+            return status
         
         # Если транскрипция готова
         text_path = TEXT_DIR / f"{file_id}.txt"
@@ -265,6 +328,7 @@ async def get_transcript(file_id: str):
             "file_id": file_id,
             "status": "completed",
             "transcript": text,
+            "segments": read_segments(file_id),
             "filename": transcript.filename,
             "model": transcript.model
         }
@@ -286,10 +350,11 @@ async def update_transcript(file_id: str, request: UpdateTranscriptRequest):
         if transcript.status != "completed":
             raise HTTPException(status_code=400, detail="Можно редактировать только завершённые транскрипции")
         
-        # Сохраняем обновлённый текст
+        # Сохраняем обновлённый текст и пересобираем по нему сегменты (один разбор на правку)
         text_path = TEXT_DIR / f"{file_id}.txt"
         try:
             text_path.write_text(request.transcript, encoding="utf-8")
+            save_edited_text(file_id, request.transcript)
         except Exception as e:
             logger.error(f"Error writing transcript file {file_id}: {e}")
             raise HTTPException(status_code=500, detail=f"Ошибка сохранения файла: {str(e)}")
@@ -315,20 +380,66 @@ async def get_status(file_id: str):
         if not transcript:
             raise HTTPException(status_code=404, detail="Файл не найден")
         
-        return {
+        # Ожидающей задаче — место в очереди, оценка начала и готовности;
+        # выполняемой — оценка оставшегося времени и текущий RTF (из реестра прогресса)
+        queue = admission.estimate(file_id) if transcript.status == "pending" else None
+
+        # Живой прогресс берём из памяти: в БД он сохраняется с задержкой
+        return progress_registry.apply(file_id, {
             "file_id": file_id,
             "status": transcript.status,
             "progress": transcript.progress,
             "status_message": transcript.status_message,
             "filename": transcript.filename,
             "model": transcript.model,
+            "decode_profile": transcript.decode_profile,
+            "refine_model": transcript.refine_model,
+            "duration_seconds": transcript.duration_seconds,
+            "speech_seconds": transcript.speech_seconds,
             "error_message": transcript.error_message,
+            "queue_position": None,
+            "eta_seconds": None,
+            "realtime_factor": None,
+            **(queue or {}),
             "created_at": transcript.created_at.isoformat() if transcript.created_at else None,
             "completed_at": transcript.completed_at.isoformat() if transcript.completed_at else None
-        }
+        })
     finally:
         db.close()
 
+@router.get("/audio/{file_id}/speech")
+async def get_speech_timeline(file_id: str):
+    """Участки речи записи (секунды) по разметке VAD из кэша — для шкалы плеера.
+
+    Если запись ещё не размечена, она декодируется и размечается сейчас (один раз).
+    """
+    db = SessionLocal()
+    try:
+        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+        if not transcript:
+            raise HTTPException(status_code=404, detail="Транскрипция не найдена")
+        need_seconds = transcript.speech_seconds is None
+    finally:
+        db.close()
+    if find_audio_file(file_id) is None:
+        raise HTTPException(status_code=404, detail="Аудиофайл не найден")
+
+    def timeline():
+        if need_seconds:
+            analyze_speech(file_id)
+        pcm = load_pcm(file_id)
+        return pcm.seconds(), speech_timeline(pcm)
+
+    duration, speech = await asyncio.to_thread(timeline)
+    regions = [[round(r["start"] / SAMPLE_RATE, 3), round(r["end"] / SAMPLE_RATE, 3)] for r in speech]
+    return {
+        "file_id": file_id,
+        "duration_seconds": round(duration, 3),
+        "speech_seconds": round(sum(end - start for start, end in regions), 3),
+        "regions": regions
+    }
+
+
 @router.get("/audio/{file_id}")
 async def get_audio_file(file_id: str):
     """Получить аудиофайл для воспроизведения"""
@@ -384,7 +495,7 @@ async def get_audio_file(file_id: str):
 
 
 @router.post("/retry/{file_id}")
-async def retry_transcript(file_id: str, background_tasks: BackgroundTasks = None):
+async def retry_transcript(file_id: str, request: Request):
     """Повторить обработку неудачной транскрипции"""
     db = SessionLocal()
     try:
@@ -396,107 +507,55 @@ async def retry_transcript(file_id: str, background_tasks: BackgroundTasks = Non
         if transcript.status == "processing":
             raise HTTPException(status_code=400, detail="Транскрипция уже обрабатывается")
         
-        # Ограничение моделей для Railway
-        # С планом Hobby (8 GB RAM) можно использовать tiny, base и small
-        allowed_models = ["tiny", "base", "small"]
+        # Разрешены модели, которые помещаются в бюджет памяти сервера
+        models = allowed_models()
         model = transcript.model
-        if model not in allowed_models:
+        if model not in models:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Модель '{model}' слишком большая для этого сервера. Пожалуйста, создайте новую транскрипцию с моделью 'tiny', 'base' или 'small'."
+                detail=f"Модель '{model}' слишком большая для этого сервера. Пожалуйста, создайте новую транскрипцию с одной из моделей: {', '.join(models)}."
             )
         
-        # Ищем аудиофайл
-        audio_files = list(AUDIO_DIR.glob(f"{file_id}_*"))
-        if not audio_files:
+        # Проверяем, что аудиофайл на месте
+        if find_audio_file(file_id) is None:
             raise HTTPException(status_code=404, detail="Аудиофайл не найден")
         
-        audio_path = audio_files[0]
-        
-        # Сбрасываем статус на pending
-        transcript.status = "pending"
-        transcript.progress = 10.0
-        transcript.error_message = None
-        transcript.completed_at = None
-        transcript.status_message = "Подготовка..."
-        db.commit()
-        
-        # Копируем файл во временную директорию
-        ext = audio_path.suffix.lower()
-        temp_path = Path(tempfile.gettempdir()) / f"wf_{uuid.uuid4().hex}{ext}"
-        temp_path.write_bytes(audio_path.read_bytes())
-        
-        # Запускаем обработку в фоне
-        if background_tasks:
-            background_tasks.add_task(process_transcription_background, file_id, temp_path, model)
-        else:
-            import threading
-            thread = threading.Thread(
-                target=process_transcription_background,
-                args=(file_id, temp_path, model)
-            )
-            thread.start()
-        
-        return {
-            "status": "pending",
-            "file_id": file_id,
-            "message": "Обработка перезапущена"
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        db.rollback()
-        error_msg = str(e).encode('ascii', 'replace').decode('ascii')
-        raise HTTPException(status_code=500, detail=f"Error: {error_msg}")
-    finally:
-        db.close()
+        if job_queue.queue_position(file_id) is not None:
+            raise HTTPException(status_code=400, detail="Транскрипция уже в очереди")
 
-    """Повторить обработку неудачной транскрипции"""
-    db = SessionLocal()
-    try:
-        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
-        if not transcript:
-            raise HTTPException(status_code=404, detail="Транскрипция не найдена")
-        
-        # Разрешаем повтор для любого статуса кроме "processing"
-        if transcript.status == "processing":
-            raise HTTPException(status_code=400, detail="Транскрипция уже обрабатывается")
-        
-        # Ищем аудиофайл
-        audio_files = list(AUDIO_DIR.glob(f"{file_id}_*"))
-        if not audio_files:
-            raise HTTPException(status_code=404, detail="Аудиофайл не найден")
-        
-        audio_path = audio_files[0]
+        owner = admission.client_id(request)
+        admit(model, owner, transcript.duration_seconds)
         
         # Сбрасываем статус на pending
         transcript.status = "pending"
-        transcript.progress = 10.0
+        transcript.progress = 0.0
         transcript.error_message = None
         transcript.completed_at = None
         transcript.status_message = "Подготовка..."
-        model = transcript.model
+        language = transcript.language
+        duration_seconds = transcript.duration_seconds
+        # Флаги задачи берём из прошлого запуска
+        last_job = db.query(TranscriptionJob).filter(
+            TranscriptionJob.file_id == file_id
+        ).order_by(TranscriptionJob.id.desc()).first()
+        speaker_recognition = bool(last_job and last_job.speaker_recognition)
+        word_timestamps = bool(last_job and last_job.word_timestamps)
+        priority = last_job.priority if last_job else None
+        decode_profile = last_job.decode_profile if last_job else None
+        refine_model = last_job.refine_model if last_job else None
+        if refine_model not in models:
+            # Модель уточнения больше не помещается в бюджет памяти — повторяем без каскада
+            refine_model = None
         db.commit()
         
-        # Копируем файл во временную директорию
-        ext = audio_path.suffix.lower()
-        temp_path = Path(tempfile.gettempdir()) / f"wf_{uuid.uuid4().hex}{ext}"
-        temp_path.write_bytes(audio_path.read_bytes())
-        
-        # Запускаем обработку в фоне
-        if background_tasks:
-            background_tasks.add_task(process_transcription_background, file_id, temp_path, model)
-        else:
-            import threading
-            thread = threading.Thread(
-                target=process_transcription_background,
-                args=(file_id, temp_path, model)
-            )
-            thread.start()
+        # Ставим в очередь транскрипций
+        job_queue.enqueue(file_id, model, language, speaker_recognition, duration_seconds, word_timestamps,
+                          owner, priority, decode_profile, refine_model)
         
         return {
             "status": "pending",
             "file_id": file_id,
+            **(admission.estimate(file_id) or {"queue_position": None}),
             "message": "Обработка перезапущена"
         }
     except HTTPException:
@@ -0,0 +1,239 @@
+"""
+Докачиваемая загрузка больших файлов.
+
+1. POST /uploads — объявить файл (имя, размер, по желанию SHA-256) и параметры распознавания.
+   Если аудио с таким SHA-256 уже есть на сервере, загрузка не нужна: сразу создаётся транскрипция.
+2. PUT /uploads/{id} с заголовком Content-Range: bytes start-end/size — очередной кусок.
+   start должен совпадать с принятым смещением, иначе 409 и текущее смещение.
+3. GET /uploads/{id} — принятое смещение (после обрыва связи продолжать с него).
+4. POST /uploads/{id}/complete — проверить файл и поставить транскрипцию в очередь.
+"""
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+import asyncio
+import logging
+import re
+import uuid
+
+from ..config import AUDIO_DIR, UPLOAD_CHUNK_BYTES
+from ..database import SessionLocal
+from ..models import UploadSession
+from .. import admission, uploads
+from ..uploads import UploadError
+from .upload import (
+    admit, check_decode_profile, check_model, check_refine_model, get_audio_duration, start_transcription
+)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/uploads", tags=["uploads"])
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class CreateUploadRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+    model: str = "base"
+    language: str = "auto"
+    speaker_recognition: bool = False
+    word_timestamps: bool = False
+    force: bool = False
+    decode_profile: Optional[str] = None  # fast, balanced, accurate; None — по глубине очереди
+    refine_model: Optional[str] = None  # Каскад: модель, которая заново распознаёт слабые сегменты
+
+
+def _get_session(db, upload_id: str) -> UploadSession:
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена или устарела")
+    return session
+
+
+def _state(session: UploadSession) -> dict:
+    return {
+        "upload_id": session.id,
+        "filename": session.filename,
+        "size": session.size,
+        "offset": uploads.received_bytes(session.id),
+        "chunk_size": UPLOAD_CHUNK_BYTES
+    }
+
+
+@router.post("")
+async def create_upload(request: CreateUploadRequest, http_request: Request):
+    """Начать докачиваемую загрузку; если файл с этим SHA-256 уже есть — обойтись без неё"""
+    check_model(request.model)
+    decode_profile = check_decode_profile(request.decode_profile)
+    refine_model = check_refine_model(request.model, request.refine_model)
+    owner = admission.client_id(http_request)
+    # Очередь уже переполнена — незачем принимать файл
+    admit(request.model, owner, 0)
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="Пустой файл")
+    sha256 = request.sha256.lower() if request.sha256 else None
+    if sha256 and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        raise HTTPException(status_code=400, detail="sha256 должен быть hex-строкой из 64 символов")
+
+    # Имя входит в путь AUDIO_DIR/{uid}_{имя} — без каталогов, разделителей и управляющих символов
+    filename = uploads.safe_filename(request.filename)
+    if not filename:
+        raise HTTPException(status_code=400, detail="Некорректное имя файла")
+
+    db = SessionLocal()
+    try:
+        uploads.cleanup_expired(db)
+
+        # Такое аудио уже хранится: новая транскрипция ссылается на тот же файл
+        stored = uploads.find_stored_audio(db, sha256) if sha256 else None
+        if stored is not None and stored.stat().st_size == request.size:
+            uid = str(uuid.uuid4())
+            target = AUDIO_DIR / f"{uid}_{filename}"
+            if uploads.link_stored_audio(stored, target):
+                logger.info(f"Upload of {filename} skipped: same audio already stored as {stored.name}")
+                result = await asyncio.to_thread(
+                    start_transcription, uid, target, filename, sha256, request.model, request.language,
+                    request.speaker_recognition, request.force, request.word_timestamps, owner,
+                    decode_profile=decode_profile,
+                    refine_model=refine_model
+                )
+                return {**result, "upload_id": None, "deduplicated": True}
+
+        session = uploads.create_session(
+            db, str(uuid.uuid4()),
+            filename=filename,
+            size=request.size,
+            sha256=sha256,
+            model=request.model,
+            language=request.language,
+            speaker_recognition=1 if request.speaker_recognition else 0,
+            word_timestamps=1 if request.word_timestamps else 0,
+            force=1 if request.force else 0,
+            decode_profile=decode_profile,
+            refine_model=refine_model
+        )
+        return {**_state(session), "deduplicated": False}
+    finally:
+        db.close()
+
+
+@router.get("/{upload_id}")
+async def get_upload(upload_id: str):
+    """Сколько байт уже принято: с этого смещения продолжать загрузку"""
+    db = SessionLocal()
+    try:
+        return _state(_get_session(db, upload_id))
+    finally:
+        db.close()
+
+
+@router.put("/{upload_id}")
+async def put_chunk(upload_id: str, request: Request):
+    """Принять кусок файла (Content-Range: bytes start-end/size; без заголовка — с текущего смещения до конца)"""
+    db = SessionLocal()
+    try:
+        session = _get_session(db, upload_id)
+        size = session.size
+    finally:
+        db.close()
+
+    async with uploads.session_lock(upload_id):
+        offset = uploads.received_bytes(upload_id)
+        header = request.headers.get("content-range")
+        if header:
+            match = _CONTENT_RANGE.fullmatch(header.strip())
+            if not match:
+                raise HTTPException(status_code=400, detail="Некорректный Content-Range")
+            start, end = int(match.group(1)), int(match.group(2))
+            if match.group(3) != "*" and int(match.group(3)) != size:
+                raise HTTPException(status_code=400, detail="Размер в Content-Range не совпадает с объявленным")
+        else:
+            start, end = offset, size - 1
+        if end < start or end >= size:
+            raise HTTPException(status_code=400, detail="Диапазон выходит за пределы файла")
+        if start != offset:
+            # Кусок уже принят или пропущен предыдущий: клиент продолжает с offset
+            return JSONResponse(status_code=409, content={
+                "detail": "Смещение не совпадает с принятым", "upload_id": upload_id, "offset": offset
+            })
+
+        try:
+            offset = await uploads.append_range(upload_id, start, end - start + 1, request.stream())
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            db = SessionLocal()
+            try:
+                db.query(UploadSession).filter(UploadSession.id == upload_id).update(
+                    {"updated_at": datetime.utcnow()}, synchronize_session=False
+                )
+                db.commit()
+            finally:
+                db.close()
+
+    return {"upload_id": upload_id, "offset": offset, "size": size}
+
+
+@router.post("/{upload_id}/complete")
+async def complete_upload(upload_id: str, request: Request):
+    """Проверить собранный файл (размер, SHA-256) и поставить транскрипцию в очередь.
+
+    При отказе контроля приёма (503/429) файл остаётся: complete можно повторить после Retry-After.
+    """
+    owner = admission.client_id(request)
+    db = SessionLocal()
+    try:
+        session = _get_session(db, upload_id)
+        async with uploads.session_lock(upload_id):
+            offset = uploads.received_bytes(upload_id)
+            if offset != session.size:
+                return JSONResponse(status_code=409, content={
+                    "detail": "Файл загружен не полностью", "upload_id": upload_id, "offset": offset
+                })
+            # Пересчёт по файлу (после перезапуска) читает его целиком — не в цикле событий
+            sha256 = await asyncio.to_thread(uploads.file_sha256, upload_id)
+            if session.sha256 and sha256 != session.sha256:
+                # Куски собрались с ошибкой — загрузку придётся повторить с начала
+                uploads.restart_session(upload_id)
+                raise HTTPException(status_code=422, detail="Контрольная сумма не совпадает, загрузите файл заново")
+            admit(session.model, owner, get_audio_duration(uploads.part_path(upload_id)))
+
+            uid = str(uuid.uuid4())
+            target = AUDIO_DIR / f"{uid}_{uploads.safe_filename(session.filename) or 'audio'}"
+            try:
+                uploads.move_to_storage(upload_id, target)
+            except OSError as e:
+                logger.error(f"Upload {upload_id}: cannot move file to storage: {e}")
+                raise HTTPException(status_code=500, detail=f"Не удалось перенести файл в хранилище: {e}")
+            params = (session.filename, session.model, session.language, bool(session.speaker_recognition),
+                      bool(session.force), bool(session.word_timestamps), session.decode_profile,
+                      session.refine_model)
+
+        filename, model, language, speaker_recognition, force, word_timestamps, decode_profile, refine_model = params
+        # Приём уже проверен выше; при ошибке здесь файл удаляется, а загрузка остаётся —
+        # её можно начать заново с нулевого смещения
+        result = await asyncio.to_thread(
+            start_transcription, uid, target, filename, sha256, model, language,
+            speaker_recognition, force, word_timestamps, owner,
+            decode_profile=decode_profile, refine_model=refine_model, admitted=True
+        )
+        db.delete(session)
+        db.commit()
+        return {**result, "upload_id": upload_id}
+    finally:
+        db.close()
+
+
+@router.delete("/{upload_id}")
+async def abort_upload(upload_id: str):
+    """Отменить загрузку и удалить принятые данные"""
+    db = SessionLocal()
+    try:
+        uploads.remove_session(db, _get_session(db, upload_id))
+        return {"upload_id": upload_id, "message": "Загрузка отменена"}
+    finally:
+        db.close()
@@ -0,0 +1,120 @@
+"""
+Скорость распознавания (RTF — real-time factor: секунд работы на секунду аудио) и оценка
+оставшегося времени задачи.
+
+История RTF хранится в БД по паре (модель, железо): до первых сегментов задачи оценка берётся
+из неё, затем плавно переходит к скорости, измеренной на самой задаче.
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+import logging
+import os
+import platform
+import time
+
+from .config import ADMISSION_DEFAULT_SPEED
+from .database import SessionLocal
+from .models import RealtimeFactor
+
+logger = logging.getLogger(__name__)
+
+# Вес исторической оценки: столько секунд аудио она "стоит" против измеренной на задаче
+PRIOR_AUDIO_SECONDS = 60.0
+# Историческое значение — скользящее среднее примерно по стольким последним задачам
+HISTORY_SAMPLES = 20
+# Задачи короче этого (секунды аудио) историю не обновляют: у них RTF — в основном загрузка модели
+MIN_SAMPLE_AUDIO_SECONDS = 10.0
+
+_hardware: Optional[str] = None
+
+
+def hardware_signature() -> str:
+    """На чём идёт распознавание: модель GPU или процессора и число ядер"""
+    global _hardware
+    if _hardware is None:
+        from .whisper_service import DEVICE
+
+        if DEVICE == "cuda":
+            import torch
+            name = f"cuda:{torch.cuda.get_device_name(0)}"
+        else:
+            name = platform.processor() or platform.machine()
+            try:
+                with open("/proc/cpuinfo", encoding="utf-8") as f:
+                    for line in f:
+                        if line.startswith("model name"):
+                            name = line.split(":", 1)[1].strip()
+                            break
+            except OSError:
+                pass
+            name = f"cpu:{name} x{os.cpu_count()}"
+        _hardware = name[:200]
+    return _hardware
+
+
+def historical_rtf(model: str) -> Optional[float]:
+    """RTF модели на этом железе по прошлым задачам (None — истории ещё нет)"""
+    db = SessionLocal()
+    try:
+        row = db.query(RealtimeFactor).filter(
+            RealtimeFactor.model == model,
+            RealtimeFactor.hardware == hardware_signature()
+        ).first()
+        return row.rtf if row else None
+    finally:
+        db.close()
+
+
+def record(model: str, audio_seconds: float, wall_seconds: float):
+    """Учесть в истории RTF завершённого распознавания"""
+    if audio_seconds < MIN_SAMPLE_AUDIO_SECONDS or wall_seconds <= 0:
+        return
+    rtf = wall_seconds / audio_seconds
+    db = SessionLocal()
+    try:
+        hardware = hardware_signature()
+        row = db.query(RealtimeFactor).filter(
+            RealtimeFactor.model == model,
+            RealtimeFactor.hardware == hardware
+        ).first()
+        if row is None:
+            row = RealtimeFactor(model=model, hardware=hardware, rtf=rtf, samples=0)
+            db.add(row)
+        else:
+            weight = 1.0 / min((row.samples or 0) + 1, HISTORY_SAMPLES)
+            row.rtf = row.rtf * (1 - weight) + rtf * weight
+        row.samples = (row.samples or 0) + 1
+        row.updated_at = datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Cannot record realtime factor for {model}: {e}")
+    finally:
+        db.close()
+
+
+class RecognitionClock:
+    """Оценка оставшегося времени распознавания audio_seconds секунд аудио"""
+
+    def __init__(self, model: str, audio_seconds: float):
+        self.model = model
+        self.audio_seconds = audio_seconds
+        self.started = time.monotonic()
+        self.prior_rtf = historical_rtf(model) or 1.0 / ADMISSION_DEFAULT_SPEED
+
+    def estimate(self, processed_seconds: float) -> Tuple[float, float]:
+        """(секунд до конца, текущий RTF) после распознавания processed_seconds секунд аудио.
+
+        RTF — время работы, делённое на распознанное аудио, с историческим значением в роли
+        PRIOR_AUDIO_SECONDS уже распознанных секунд: в начале оценка историческая, дальше — живая.
+        """
+        elapsed = time.monotonic() - self.started
+        rtf = (elapsed + self.prior_rtf * PRIOR_AUDIO_SECONDS) / (processed_seconds + PRIOR_AUDIO_SECONDS)
+        remaining = max(0.0, self.audio_seconds - processed_seconds)
+        return remaining * rtf, rtf
+
+    def finish(self) -> float:
+        """Распознавание завершено: записать измеренный RTF в историю. Возвращает время распознавания"""
+        wall = time.monotonic() - self.started
+        record(self.model, self.audio_seconds, wall)
+        return wall
@@ -0,0 +1,248 @@
+"""
+Структурированное хранилище сегментов транскрипции.
+
+Для каждой транскрипции рядом с текстом лежит {file_id}.segments.jsonl — по строке JSON на сегмент:
+    {"start": 1.23, "end": 4.56, "text": "...", "avg_logprob": -0.31, "no_speech_prob": 0.02,
+     "words": [[1.23, 1.5, "слово", 0.98], ...]}     # words — только если их запросили
+Это основной формат: экспорты, AI и редактор читают сегменты отсюда. Файл .txt со строками
+"[HH:MM:SS.mmm --> HH:MM:SS.mmm]  текст" остаётся производным представлением для показа и правки.
+
+Во время распознавания сегменты дописываются в файл по мере готовности (SegmentWriter), поэтому
+частичный результат можно читать до окончания задачи, а после падения он не теряется: конец
+последнего сегмента служит чекпоинтом, с которого задача продолжается после перезапуска.
+"""
+from pathlib import Path
+from typing import Iterable, List, Optional
+import json
+import logging
+import os
+import re
+import time
+
+from .config import SEGMENT_FSYNC_SECONDS, TEXT_DIR
+from .utils import format_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Строка текстового представления: [00:00:00 --> 00:00:05] или [00:00:00.000 --> 00:00:05.000]  Текст,
+# с распознаванием говорящих — [00:00:00.000 --> 00:00:05.000]  [Спикер 1] Текст
+_LINE_PATTERN = re.compile(r'\[(\d{2}:\d{2}:\d{2}(?:\.\d{1,3})?)\s*-->\s*(\d{2}:\d{2}:\d{2}(?:\.\d{1,3})?)\]\s*(?:\[Спикер (\d+)\]\s*)?(.*)')
+
+
+def segments_path(file_id: str) -> Path:
+    return TEXT_DIR / f"{file_id}.segments.jsonl"
+
+
+def _round_time(value) -> Optional[float]:
+    return round(float(value), 3) if value is not None else None
+
+
+def _compact(seg: dict) -> dict:
+    """Сегмент в виде для хранения: таймкоды до миллисекунд, слова — массивами"""
+    item = {"start": _round_time(seg.get("start")), "end": _round_time(seg.get("end")), "text": seg["text"]}
+    for key in ("avg_logprob", "no_speech_prob"):
+        if seg.get(key) is not None:
+            item[key] = round(float(seg[key]), 4)
+    if seg.get("speaker") is not None:
+        item["speaker"] = seg["speaker"]
+    words = seg.get("words")
+    if words:
+        item["words"] = [
+            [round(float(w["start"]), 3), round(float(w["end"]), 3), w["word"], round(float(w.get("probability", 0.0)), 3)]
+            if isinstance(w, dict) else list(w)
+            for w in words
+        ]
+    return item
+
+
+def _expand(item: dict) -> dict:
+    """Сегмент из хранилища: слова снова словарями {start, end, word, probability}"""
+    seg = dict(item)
+    if "words" in seg:
+        seg["words"] = [{"start": w[0], "end": w[1], "word": w[2], "probability": w[3]} for w in seg["words"]]
+    return seg
+
+
+def _dump_line(seg: dict) -> str:
+    return json.dumps(_compact(seg), ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def dump_segments(path: Path, segments: Iterable[dict]):
+    """Записать сегменты в файл JSONL (атомарно: через временный файл)"""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for seg in segments:
+            f.write(_dump_line(seg))
+    os.replace(tmp_path, path)
+
+
+def load_segments(path: Path) -> List[dict]:
+    segments = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                segments.append(_expand(json.loads(line)))
+            except ValueError:
+                # Недописанная строка после падения посреди записи — всё до неё целое
+                logger.warning(f"Skipping truncated segment line in {path.name}")
+                break
+    return segments
+
+
+class SegmentWriter:
+    """Дописывает сегменты в хранилище по мере распознавания.
+
+    Каждая строка сразу уходит в файл (её видят читатели), fsync — не чаще SEGMENT_FSYNC_SECONDS,
+    чтобы не тормозить распознавание на медленных дисках.
+    """
+
+    def __init__(self, file_id: str, segments: Iterable[dict] = (), fsync_seconds: float = SEGMENT_FSYNC_SECONDS):
+        """Начать файл заново; segments — уже готовые сегменты (при продолжении с чекпоинта)"""
+        self.path = segments_path(file_id)
+        self.fsync_seconds = fsync_seconds
+        self.count = 0
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._last_sync = time.monotonic()
+        for seg in segments:
+            self.append(seg)
+
+    def append(self, seg: dict):
+        self._file.write(_dump_line(seg))
+        self._file.flush()
+        self.count += 1
+        if time.monotonic() - self._last_sync >= self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_segments(file_id: str, segments: Iterable[dict]):
+    """Записать сегменты транскрипции целиком"""
+    dump_segments(segments_path(file_id), segments)
+
+
+def save_transcript(file_id: str, segments: List[dict]) -> str:
+    """Сохранить результат транскрипции: сегменты и их текстовое представление. Возвращает текст"""
+    write_segments(file_id, segments)
+    text = format_segments(segments)
+    (TEXT_DIR / f"{file_id}.txt").write_text(text, encoding="utf-8")
+    return text
+
+
+def read_segments(file_id: str) -> Optional[List[dict]]:
+    """Сегменты транскрипции; None, если транскрипции нет.
+
+    Для транскрипций, созданных до появления хранилища, сегменты один раз
+    восстанавливаются из .txt и сохраняются.
+    """
+    path = segments_path(file_id)
+    if path.exists():
+        return load_segments(path)
+
+    text_path = TEXT_DIR / f"{file_id}.txt"
+    if not text_path.exists():
+        return None
+    segments = parse_text(text_path.read_text(encoding="utf-8"))
+    try:
+        write_segments(file_id, segments)
+    except OSError as e:
+        logger.warning(f"Cannot save segments for {file_id}: {e}")
+    return segments
+
+
+def read_partial(file_id: str) -> List[dict]:
+    """Сегменты, записанные текущей (или прерванной) задачей, без подстановки старого .txt"""
+    path = segments_path(file_id)
+    return load_segments(path) if path.exists() else []
+
+
+def checkpoint(segments: List[dict]) -> float:
+    """Секунда, с которой продолжать распознавание: конец последнего сегмента с таймкодом"""
+    ends = [seg["end"] for seg in segments if seg.get("end") is not None]
+    return max(ends) if ends else 0.0
+
+
+def remove_segments(file_id: str):
+    try:
+        segments_path(file_id).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Cannot remove segments for {file_id}: {e}")
+
+
+def format_segments(segments: Iterable[dict]) -> str:
+    """Текстовое представление: строки вида [HH:MM:SS.mmm --> HH:MM:SS.mmm]  текст"""
+    lines = []
+    for seg in segments:
+        if seg.get("start") is None:
+            lines.append(seg["text"])
+            continue
+        start = format_timestamp(seg["start"])
+        end = format_timestamp(seg["end"])
+        speaker = f"[Спикер {seg['speaker']}] " if seg.get("speaker") is not None else ""
+        lines.append(f"[{start} --> {end}]  {speaker}{seg['text']}")
+    return "\n".join(lines)
+
+
+def plain_text(segments: Iterable[dict]) -> str:
+    """Только текст сегментов, без таймкодов (для AI и поиска)"""
+    return " ".join(seg["text"] for seg in segments if seg.get("text"))
+
+
+def _to_seconds(value: str) -> float:
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def parse_text(text: str) -> List[dict]:
+    """Разобрать текстовое представление в сегменты (для старых транскрипций и правок в редакторе).
+
+    Строки без таймкода становятся сегментами со start/end = None.
+    """
+    segments = []
+    for line in text.strip().split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        match = _LINE_PATTERN.match(line)
+        if match:
+            segment = {
+                "start": _to_seconds(match.group(1)),
+                "end": _to_seconds(match.group(2)),
+                "text": match.group(4).strip()
+            }
+            if match.group(3):
+                segment["speaker"] = int(match.group(3))
+            segments.append(segment)
+        else:
+            segments.append({"start": None, "end": None, "text": line})
+    return segments
+
+
+def save_edited_text(file_id: str, text: str):
+    """Обновить сегменты после правки текста в редакторе.
+
+    У сегментов, чьи таймкоды и текст не изменились, сохраняются слова и оценки уверенности.
+    """
+    def key(seg: dict) -> tuple:
+        return _round_time(seg.get("start")), _round_time(seg.get("end")), seg.get("speaker"), seg["text"]
+
+    old = {key(seg): seg for seg in (read_segments(file_id) or [])}
+    segments = [old.get(key(seg), seg) for seg in parse_text(text)]
+    write_segments(file_id, segments)
+    return segments
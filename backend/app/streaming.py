@@ -0,0 +1,274 @@
+"""
+Потоковое распознавание речи с микрофона (WebSocket /ws/transcribe).
+
+Клиент присылает аудио небольшими кусками, сессия копит его в скользящем окне:
+- каждые STREAM_STEP_SECONDS нового аудио текущая фраза распознаётся заново — это
+  промежуточный результат (partial), который может меняться;
+- когда VAD видит паузу после речи (STREAM_MIN_SILENCE_MS), фраза распознаётся последний раз
+  и фиксируется (final), окно сдвигается за неё;
+- если пауз нет дольше STREAM_MAX_WINDOW_SECONDS, фиксируются все сегменты окна, кроме последнего.
+
+Используются те же модели Whisper, что и для файлов (через менеджер моделей), распознавание
+идёт в потоках процесса API. После закрытия потока сессия сохраняется как обычная транскрипция.
+"""
+from datetime import datetime
+from typing import List, Optional
+import hashlib
+import io
+import logging
+import threading
+import uuid
+import wave
+
+import numpy as np
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+from .audio_cache import SAMPLE_RATE, pcm_path
+from .config import AUDIO_DIR, PCM_DIR, STREAM_MAX_WINDOW_SECONDS, STREAM_MIN_SILENCE_MS, STREAM_STEP_SECONDS
+from .database import SessionLocal
+from .models import Transcript
+from .segment_store import save_transcript
+from .whisper_service import transcribe_window
+
+logger = logging.getLogger(__name__)
+
+# Форматы входящего аудио: PCM 16 кГц (или с sample_rate) и пакеты Opus (по пакету на сообщение, 48 кГц)
+AUDIO_FORMATS = ("pcm_s16le", "pcm_f32le", "opus")
+# Сколько символов уже распознанного текста подсказывать модели для следующего окна
+PROMPT_CHARS = 200
+# Хвост окна, который не выбрасываем при тишине: там может начинаться слово
+KEEP_TAIL_SECONDS = 0.5
+# Запас после конца речи при фиксации фразы (чтобы не обрезать последний звук)
+CUT_PADDING_SECONDS = 0.2
+
+
+class AudioDecoder:
+    """Переводит сообщения клиента в float32 PCM 16 кГц моно"""
+
+    def __init__(self, fmt: str = "pcm_s16le", sample_rate: int = SAMPLE_RATE):
+        if fmt not in AUDIO_FORMATS:
+            raise ValueError(f"Unsupported audio format {fmt}, expected one of {', '.join(AUDIO_FORMATS)}")
+        self.format = fmt
+        self.sample_rate = sample_rate
+        self._remainder = b""
+        self._codec = None
+        self._resampler = None
+        if fmt == "opus":
+            import av
+
+            self._codec = av.CodecContext.create("opus", "r")
+            self._codec.sample_rate = 48000
+            self._resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+        elif sample_rate != SAMPLE_RATE:
+            import av
+
+            # Микрофон браузера пишет в 44,1/48 кГц: ресемплер FFmpeg с фильтром нижних частот,
+            # иначе всё выше 8 кГц отразится в полосу речи. Он хранит состояние между сообщениями,
+            # так что на стыках кусков не бывает щелчков
+            self._resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+
+    def decode(self, data: bytes) -> np.ndarray:
+        if self.format == "opus":
+            return self._decode_opus(data)
+
+        width = 2 if self.format == "pcm_s16le" else 4
+        data = self._remainder + data
+        usable = len(data) - len(data) % width
+        self._remainder = data[usable:]
+        if self.format == "pcm_s16le":
+            audio = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+        else:
+            audio = np.frombuffer(data[:usable], dtype="<f4").astype(np.float32)
+        if self._resampler is not None and len(audio):
+            import av
+
+            frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(audio).reshape(1, -1), format="flt", layout="mono")
+            frame.sample_rate = self.sample_rate
+            return self._resample([frame])
+        return audio
+
+    def _decode_opus(self, data: bytes) -> np.ndarray:
+        import av
+
+        return self._resample(self._codec.decode(av.Packet(data)))
+
+    def _resample(self, frames) -> np.ndarray:
+        pieces = []
+        for frame in frames:
+            for resampled in self._resampler.resample(frame):
+                pieces.append(resampled.to_ndarray().reshape(-1))
+        return np.concatenate(pieces).astype(np.float32) if pieces else np.zeros(0, dtype=np.float32)
+
+
+class StreamingSession:
+    """Скользящее окно распознавания одной сессии.
+
+    add() вызывается из цикла приёма, step()/finish() — из одного потока распознавания.
+    Возвращают события для клиента: {"type": "partial", ...} и {"type": "final", "segments": [...]}.
+    """
+
+    def __init__(self, model: str, language: Optional[str] = None):
+        self.model = model
+        self.language = language
+        self.segments: List[dict] = []  # Зафиксированные сегменты с абсолютными таймкодами
+        self._recording: List[np.ndarray] = []  # Вся запись — для сохранения транскрипции
+        self._pending: List[np.ndarray] = []  # Пришло, но ещё не попало в окно
+        self._pending_samples = 0
+        self._lock = threading.Lock()
+        self._window = np.zeros(0, dtype=np.float32)
+        self._window_start = 0  # Позиция начала окна в записи (отсчёты)
+        self._last_partial = ""
+
+    @property
+    def duration(self) -> float:
+        return sum(len(piece) for piece in self._recording) / SAMPLE_RATE
+
+    def add(self, audio: np.ndarray):
+        if not len(audio):
+            return
+        with self._lock:
+            self._recording.append(audio)
+            self._pending.append(audio)
+            self._pending_samples += len(audio)
+
+    def due(self) -> bool:
+        """Набралось достаточно нового аудио для очередного шага"""
+        return self._pending_samples >= STREAM_STEP_SECONDS * SAMPLE_RATE
+
+    def step(self) -> List[dict]:
+        """Добавить новое аудио в окно и распознать его: зафиксировать законченные фразы или дать partial"""
+        self._take_pending()
+        window = self._window
+        if not len(window):
+            return []
+
+        min_silence = STREAM_MIN_SILENCE_MS * SAMPLE_RATE // 1000
+        speech = get_speech_timestamps(window, VadOptions(min_silence_duration_ms=STREAM_MIN_SILENCE_MS))
+        if not speech:
+            # Одна тишина: окно не растёт, хвост оставляем
+            self._advance(max(0, len(window) - int(KEEP_TAIL_SECONDS * SAMPLE_RATE)))
+            return self._partial_cleared()
+
+        last_end = speech[-1]["end"]
+        if len(window) - last_end >= min_silence:
+            # Фраза закончилась паузой — фиксируем всё до паузы
+            cut = min(len(window), last_end + int(CUT_PADDING_SECONDS * SAMPLE_RATE))
+            return self._finalize(cut)
+
+        if len(window) >= STREAM_MAX_WINDOW_SECONDS * SAMPLE_RATE:
+            # Говорят без пауз: фиксируем всё, кроме последнего (возможно, недоговорённого) сегмента
+            segments = self._decode(window)
+            if len(segments) > 1:
+                cut = int(segments[-1]["start"] * SAMPLE_RATE)
+                return self._commit(segments[:-1], cut)
+            return self._commit(segments, len(window))
+
+        segments = self._decode(window)
+        text = " ".join(seg["text"] for seg in segments)
+        if text == self._last_partial:
+            return []
+        self._last_partial = text
+        start = self._window_start / SAMPLE_RATE
+        return [{"type": "partial", "text": text, "start": start, "end": start + len(window) / SAMPLE_RATE}]
+
+    def finish(self) -> List[dict]:
+        """Поток закрыт: распознать остаток окна как финальный"""
+        self._take_pending()
+        if not len(self._window):
+            return []
+        speech = get_speech_timestamps(self._window, VadOptions(min_silence_duration_ms=STREAM_MIN_SILENCE_MS))
+        if not speech:
+            return self._partial_cleared()
+        return self._finalize(len(self._window))
+
+    def recording(self) -> np.ndarray:
+        with self._lock:
+            return np.concatenate(self._recording) if self._recording else np.zeros(0, dtype=np.float32)
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending, self._pending_samples = self._pending, [], 0
+        if pending:
+            self._window = np.concatenate([self._window] + pending)
+
+    def _advance(self, samples: int):
+        """Сдвинуть начало окна на samples отсчётов"""
+        self._window = self._window[samples:]
+        self._window_start += samples
+
+    def _decode(self, audio: np.ndarray) -> List[dict]:
+        prompt = " ".join(seg["text"] for seg in self.segments)[-PROMPT_CHARS:]
+        segments, language = transcribe_window(audio, self.model, self.language, prompt)
+        if self.language is None and segments:
+            # Язык определяем по первой фразе и дальше не переопределяем — иначе он скачет между окнами
+            self.language = language
+        return segments
+
+    def _finalize(self, cut: int) -> List[dict]:
+        return self._commit(self._decode(self._window[:cut]), cut)
+
+    def _commit(self, segments: List[dict], cut: int) -> List[dict]:
+        offset = self._window_start / SAMPLE_RATE
+        final = [dict(seg, start=seg["start"] + offset, end=seg["end"] + offset) for seg in segments]
+        self.segments.extend(final)
+        self._advance(cut)
+        self._last_partial = ""
+        return [{"type": "final", "segments": final}] if final else []
+
+    def _partial_cleared(self) -> List[dict]:
+        """Промежуточный текст больше не актуален (в окне осталась тишина)"""
+        if not self._last_partial:
+            return []
+        self._last_partial = ""
+        start = self._window_start / SAMPLE_RATE
+        return [{"type": "partial", "text": "", "start": start, "end": start}]
+
+
+def _wav_bytes(audio: np.ndarray) -> bytes:
+    """PCM float32 -> WAV 16 бит моно 16 кГц"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def save_session(session: StreamingSession, filename: Optional[str] = None) -> Optional[str]:
+    """Сохранить завершённую сессию как обычную транскрипцию (аудио WAV + сегменты). Возвращает file_id"""
+    audio = session.recording()
+    if not len(audio):
+        return None
+
+    file_id = str(uuid.uuid4())
+    filename = filename or f"live_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.wav"
+    data = _wav_bytes(audio)
+    audio_hash = hashlib.sha256(data).hexdigest()
+    (AUDIO_DIR / f"{file_id}_{filename}").write_bytes(data)
+    # PCM уже есть в памяти — кладём его в кэш, чтобы повтор не декодировал WAV
+    PCM_DIR.mkdir(parents=True, exist_ok=True)
+    if not pcm_path(audio_hash).exists():
+        np.save(pcm_path(audio_hash), audio)
+
+    save_transcript(file_id, session.segments)
+    db = SessionLocal()
+    try:
+        db.add(Transcript(
+            file_id=file_id,
+            filename=filename,
+            model=session.model,
+            language=session.language,
+            status="completed",
+            progress=100.0,
+            status_message="Готово (live)",
+            duration_seconds=len(audio) / SAMPLE_RATE,
+            audio_hash=audio_hash,
+            created_at=datetime.utcnow(),
+            completed_at=datetime.utcnow()
+        ))
+        db.commit()
+    finally:
+        db.close()
+    logger.info(f"Live session saved as {file_id} ({len(audio) / SAMPLE_RATE:.0f} sec, {len(session.segments)} segments)")
+    return file_id
@@ -5,15 +5,426 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 from .database import SessionLocal
 from .models import Transcript
-from .whisper_service import transcribe
-from .config import AUDIO_DIR, TEXT_DIR
+from .whisper_service import decode_options, decode_profile_name, transcribe, transcribe_segments, transcribe_batch
+from .segment_store import SegmentWriter, checkpoint, read_partial, remove_segments, save_transcript
+from .config import AUDIO_DIR, TEXT_DIR, TRANSCRIPTION_EXECUTOR, LONG_FILE_THRESHOLD_SECONDS
+from .progress import progress_registry
+from .job_queue import job_queue
+from .audio_cache import (
+    SAMPLE_RATE, PcmRef, ascii_path, ensure_pcm, prune_pcm, remove_pcm, speech_seconds, speech_timeline
+)
+from . import metrics, result_cache
+from .utils import format_timestamp
+from .rtf import RecognitionClock, record as record_rtf
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
+from typing import Dict, List, Optional
 import logging
-import tempfile
-import uuid
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Доля прогресса распознавания, отведённая уточнению слабых сегментов в каскаде
+CASCADE_PROGRESS_SHARE = 0.2
+
+# Как часто просматривать кэш PCM в поисках того, что пора удалить (секунды)
+PCM_PRUNE_INTERVAL_SECONDS = 60
+_last_pcm_prune = 0.0
+_pcm_prune_lock = threading.Lock()
+
+
+class TranscriptionCancelled(Exception):
+    """Задачу отменили (POST /jobs/{file_id}/cancel или удаление транскрипции)"""
+
+
+def _check_cancelled(cancel_event: Optional[threading.Event]):
+    """Прервать задачу, если её отменили (проверяется между сегментами)"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise TranscriptionCancelled()
+
+
+def discard_cancelled(file_id: str, pcm_key: Optional[str] = None):
+    """Убрать то, что оставила отменённая задача: частичные сегменты и PCM, если он больше никому не нужен.
+
+    pcm_key — ключ PCM на случай, если транскрипцию уже удалили из БД.
+    """
+    remove_segments(file_id)
+    db = SessionLocal()
+    try:
+        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+        if transcript is not None:
+            pcm_key = transcript.audio_hash or file_id
+        if not pcm_key:
+            return
+        shared = pcm_key != file_id and db.query(Transcript).filter(
+            Transcript.audio_hash == pcm_key,
+            Transcript.file_id != file_id
+        ).count()
+        if not shared:
+            remove_pcm(pcm_key)
+    finally:
+        db.close()
+
+
+def _mark_cancelled(file_id: str, pcm_key: Optional[str] = None):
+    discard_cancelled(file_id, pcm_key)
+    progress_registry.transition(file_id, "cancelled", message="Отменено")
+    logger.info(f"Transcription cancelled: {file_id}")
+
+
+def find_audio_file(file_id: str) -> Optional[Path]:
+    """Найти сохранённый аудиофайл по file_id"""
+    audio_files = list(AUDIO_DIR.glob(f"{file_id}_*"))
+    return audio_files[0] if audio_files else None
+
+
+def prune_pcm_cache():
+    """Почистить кэш PCM (не чаще раза в PCM_PRUNE_INTERVAL_SECONDS), не трогая записи в очереди и в работе"""
+    global _last_pcm_prune
+    with _pcm_prune_lock:
+        if time.monotonic() - _last_pcm_prune < PCM_PRUNE_INTERVAL_SECONDS:
+            return
+        _last_pcm_prune = time.monotonic()
+    db = SessionLocal()
+    try:
+        active = db.query(Transcript.file_id, Transcript.audio_hash).filter(
+            Transcript.status.in_(["pending", "processing"])
+        ).all()
+        prune_pcm({audio_hash or file_id for file_id, audio_hash in active})
+    except Exception as e:
+        logger.warning(f"PCM cache pruning failed: {e}")
+    finally:
+        db.close()
+
+
+def load_pcm(file_id: str) -> PcmRef:
+    """PCM записи из кэша; при первом обращении аудиофайл декодируется и сохраняется"""
+    prune_pcm_cache()
+    db = SessionLocal()
+    try:
+        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+        key = (transcript.audio_hash if transcript else None) or file_id
+    finally:
+        db.close()
+    audio_path = find_audio_file(file_id)
+    if audio_path is None:
+        raise FileNotFoundError(f"Audio file not found for {file_id}")
+    return ensure_pcm(audio_path, key)
+
+
+def get_segment_source():
+    """Функция распознавания для текущего режима исполнения (потоки или пул процессов)"""
+    if TRANSCRIPTION_EXECUTOR == "process":
+        from .process_pool import process_pool
+        return process_pool.transcribe_segments
+    return transcribe_segments
+
+
+def get_batch_source():
+    """Функция пакетного распознавания для текущего режима исполнения"""
+    if TRANSCRIPTION_EXECUTOR == "process":
+        from .process_pool import process_pool
+        return process_pool.transcribe_batch
+    return transcribe_batch
+
+
+def analyze_speech(file_id: str) -> Optional[float]:
+    """Декодировать запись и разметить в ней речь, сохранив длительность речи в транскрипции.
+
+    Запускается при загрузке, пока задача ждёт в очереди: запись, где почти одна тишина,
+    сразу получает оценку, а распознавание потом берёт PCM и разметку из кэша.
+    """
+    try:
+        seconds = speech_seconds(speech_timeline(load_pcm(file_id)))
+    except Exception as e:
+        logger.warning(f"Speech analysis failed for {file_id}: {e}")
+        return None
+    db = SessionLocal()
+    try:
+        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+        if transcript is not None:
+            transcript.speech_seconds = seconds
+            db.commit()
+    finally:
+        db.close()
+    return seconds
+
+
+# Анализ речи загруженных записей — по одной: декодирование и VAD не должны отнимать ядра у распознавания
+_speech_analysis = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speech")
+
+
+def schedule_speech_analysis(file_id: str):
+    """Поставить analyze_speech в фоновый поток"""
+    _speech_analysis.submit(analyze_speech, file_id)
+
+
+def process_transcription_batch(jobs: List, cancel_events: Optional[Dict[str, threading.Event]] = None) -> Dict[int, bool]:
+    """Пакетная обработка коротких записей одной модели и языка. Возвращает {id задачи: успех}
+
+    cancel_events — флаги отмены по file_id: результат отменённой записи не сохраняется.
+    """
+    cancel_events = cancel_events or {}
+    results = {}
+    ready = []  # (задача, PCM)
+    db = SessionLocal()
+    try:
+        for job in jobs:
+            transcript = db.query(Transcript).filter(Transcript.file_id == job.file_id).first()
+            if not transcript:
+                results[job.id] = False
+                continue
+            event = cancel_events.get(job.file_id)
+            if event is not None and event.is_set():
+                _mark_cancelled(job.file_id)
+                results[job.id] = False
+                continue
+            try:
+                audio = load_pcm(job.file_id)
+            except Exception as e:
+                logger.error(f"Cannot decode {job.file_id} for batch: {e}")
+                progress_registry.transition(job.file_id, "failed", message="Ошибка", error=str(e))
+                results[job.id] = False
+                continue
+            progress_registry.transition(job.file_id, "processing", 30.0, f"Пакетное распознавание ({len(jobs)} файлов)...")
+            # Пакет декодируется жадно, без повторов с температурой — как профиль fast
+            transcript.decode_profile = "fast"
+            ready.append((job, audio))
+        db.commit()
+        
+        if not ready:
+            return results
+        
+        stats = {}
+        meter = metrics.UsageMeter()
+        concurrent = job_queue.running_jobs()
+        started = time.monotonic()
+        try:
+            batch_segments = get_batch_source()([audio for _, audio in ready], ready[0][0].model, ready[0][0].language, stats)
+        except Exception as e:
+            # Пакетный путь не сработал — обрабатываем записи по одной обычным способом
+            logger.warning(f"Batched transcription failed ({e}), falling back to one-by-one processing")
+            for job, _ in ready:
+                results[job.id] = process_transcription_background(
+                    job.file_id, job.model, job.language, cancel_event=cancel_events.get(job.file_id),
+                    decode_profile=job.decode_profile
+                )
+            return results
+        
+        # Время и ресурсы батча делятся между записями пропорционально длительности
+        wall = time.monotonic() - started
+        if "cpu_seconds" not in stats:
+            stats.update(meter.stats())
+        lengths = [audio.seconds() for _, audio in ready]
+        speech = stats.get("speech_seconds") or [None] * len(ready)
+        concurrent = max(concurrent, job_queue.running_jobs())
+        
+        for (job, _), segments, length, job_speech in zip(ready, batch_segments, lengths, speech):
+            event = cancel_events.get(job.file_id)
+            if event is not None and event.is_set():
+                # Батч короткий, поэтому его не прерываем — просто не сохраняем отменённую запись
+                _mark_cancelled(job.file_id)
+                results[job.id] = False
+                continue
+            save_transcript(job.file_id, segments)
+            result_cache.store(job.file_id, segments)
+            share = length / sum(lengths) if sum(lengths) else 1.0 / len(ready)
+            # Короткие записи идут в основном батчами — без них история RTF для оценок ETA была бы неполной
+            record_rtf(job.model, length, wall * share)
+            metrics.record(job.file_id, job.model, "batch", length, wall * share, {
+                "speech_seconds": job_speech,
+                "cpu_seconds": stats["cpu_seconds"] * share,
+                "peak_rss_mb": stats.get("peak_rss_mb")
+            }, concurrent)
+            progress_registry.transition(job.file_id, "completed", 100.0, "Готово")
+            results[job.id] = True
+        logger.info(f"Batch transcription completed: {[job.file_id for job, _ in ready]}")
+        return results
+    finally:
+        db.close()
+
+
+def _shift_segment(seg: dict, offset: float) -> dict:
+    """Сдвинуть таймкоды сегмента (и его слов) на offset секунд"""
+    seg = dict(seg, start=seg["start"] + offset, end=seg["end"] + offset)
+    if seg.get("words"):
+        seg["words"] = [dict(w, start=w["start"] + offset, end=w["end"] + offset) for w in seg["words"]]
+    return seg
+
+
+def process_transcription_background(file_id: str, model: str, language: str = None, speaker_recognition: bool = False,
+                                     word_timestamps: bool = False, resume_from: Optional[float] = None,
+                                     cancel_event: Optional[threading.Event] = None,
+                                     decode_profile: Optional[str] = None,
+                                     refine_model: Optional[str] = None) -> bool:
+    """Фоновая обработка транскрипции (выполняется воркером очереди). Возвращает True при успехе.
+
+    resume_from — чекпоинт прерванной задачи (секунды): сегменты до него берутся из хранилища,
+    распознаётся только остаток записи.
+    cancel_event — флаг отмены: задача прерывается между сегментами, частичный результат удаляется.
+    decode_profile — профиль декодирования (None — по умолчанию); сохраняется в транскрипции для кэша.
+    refine_model — каскад: после распознавания моделью model слабые сегменты распознаются
+    этой моделью заново (см. cascade.py).
+    """
+    
+    db = SessionLocal()
+    pcm_key = None
+    try:
+        transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
+        if not transcript:
+            return False
+        pcm_key = transcript.audio_hash or file_id
+        decode_profile = decode_profile_name(decode_profile)
+        transcript.decode_profile = decode_profile
+        transcript.refine_model = refine_model
+        db.commit()
+        
+        duration = transcript.duration_seconds or 0
+        segments = []
+        offset = 0.0
+        if resume_from:
+            segments = [seg for seg in read_partial(file_id) if seg.get("end") is None or seg["end"] <= resume_from]
+            offset = checkpoint(segments)
+        # Доля записи, распознанная до перезапуска: прогресс остатка масштабируем в оставшуюся часть
+        done = min(offset / duration, 1.0) * 100 if duration else 0.0
+        # Распознавание доводит прогресс до ceiling; остаток — диаризация и сохранение
+        ceiling = 95.0 if speaker_recognition else 99.0
+        # В каскаде первый проход — до first_pass, уточнение слабых сегментов — от него до ceiling
+        first_pass = ceiling - (ceiling - done) * CASCADE_PROGRESS_SHARE if refine_model else ceiling
+        
+        lang_msg = f" ({language})" if language else " (авто)"
+        speaker_msg = " с распознаванием говорящих" if speaker_recognition else ""
+        if offset:
+            logger.info(f"Resuming {file_id} from {offset:.1f} sec ({len(segments)} segments kept)")
+            progress_registry.transition(file_id, "processing", done, f"Продолжение с {format_timestamp(offset)}{lang_msg}...")
+        else:
+            progress_registry.transition(file_id, "processing", 0.0, f"Подготовка{lang_msg}{speaker_msg}...")
+        
+        # Сегменты дописываем в хранилище по мере готовности: частичный результат
+        # доступен через GET /transcript, а конец последнего сегмента служит чекпоинтом
+        with SegmentWriter(file_id, segments) as writer:
+            # Декодированное аудио: при первом запуске декодируем, при повторах берём из кэша
+            full_pcm = load_pcm(file_id)
+            pcm = full_pcm.slice(int(offset * SAMPLE_RATE)) if offset else full_pcm
+            _check_cancelled(cancel_event)
+            
+            # Оценка оставшегося времени: историческая скорость модели, затем измеренная на этой записи
+            audio_seconds = pcm.seconds()
+            clock = RecognitionClock(model, audio_seconds)
+            # Метрики задачи: речь после VAD, а в режиме process — и ресурсы процесса пула
+            stats = {}
+            meter = metrics.UsageMeter()
+            concurrent = job_queue.running_jobs()
+            
+            # Callback для обновления прогресса (в память; в БД — не чаще раза в несколько секунд)
+            def update_progress(progress: float, message: str):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                eta, rtf = clock.estimate(audio_seconds * progress / 100)
+                progress_registry.update(file_id, done + (first_pass - done) * progress / 100, message,
+                                         eta_seconds=eta, realtime_factor=rtf)
+            
+            # Участки речи (диаризация, нарезка длинных записей, VAD перед Whisper) — из разметки
+            # записи в кэше: VAD считается один раз на запись, а не при каждом повторе и смене модели
+            speech = speech_timeline(full_pcm) if speaker_recognition else None
+            
+            # Транскрибируем с отслеживанием прогресса
+            segment_source = get_segment_source()
+            chunked = bool(LONG_FILE_THRESHOLD_SECONDS and duration - offset >= LONG_FILE_THRESHOLD_SECONDS)
+            if chunked:
+                # Длинная запись: режем по паузам и распознаём куски параллельно
+                from .chunking import transcribe_long
+                logger.info(f"Using chunked transcription for {file_id} ({duration - offset:.0f} sec)")
+                # Разметку для VAD профиля считаем здесь: иначе за неё возьмутся сразу несколько кусков
+                vad_parameters = decode_options(decode_profile).get("vad_parameters")
+                if vad_parameters is not None:
+                    speech_timeline(full_pcm, vad_parameters)
+                source = transcribe_long(pcm, model, language, update_progress,
+                                         segment_source=segment_source, word_timestamps=word_timestamps,
+                                         cancel_event=cancel_event, stats=stats, profile=decode_profile)
+            else:
+                source = segment_source(pcm, model, language, update_progress, word_timestamps, stats, decode_profile)
+            
+            # closing: при отмене генератор закрывается сразу — процесс пула перезапускается,
+            # куски длинной записи перестают распознаваться
+            with closing(source):
+                for segment in source:
+                    _check_cancelled(cancel_event)
+                    if offset:
+                        segment = _shift_segment(segment, offset)
+                    writer.append(segment)
+                    segments.append(segment)
+            _check_cancelled(cancel_event)
+            wall = clock.finish()
+            if "cpu_seconds" not in stats:
+                # Распознавание шло в потоках процесса API
+                stats.update(meter.stats())
+            metrics.record(file_id, model, "chunked" if chunked else "single", audio_seconds, wall, stats,
+                           max(concurrent, job_queue.running_jobs()))
+            if transcript.speech_seconds is None and not offset and stats.get("speech_seconds") is not None:
+                transcript.speech_seconds = stats["speech_seconds"]
+                db.commit()
+        
+        if refine_model:
+            # Каскад: слабые сегменты — заново моделью уточнения; язык — определённый первым проходом
+            from .cascade import refine
+            
+            def refine_progress(progress: float, message: str):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                progress_registry.update(file_id, first_pass + (ceiling - first_pass) * progress / 100, message)
+            
+            # Уточнение учитывается отдельной строкой метрик модели уточнения (mode="cascade"):
+            # аудио — окна, распознанные заново, время — весь проход уточнения
+            refine_stats = {}
+            refine_meter = metrics.UsageMeter()
+            refine_started = time.monotonic()
+            segments = refine(full_pcm, segments, refine_model, language or stats.get("language"), segment_source,
+                              word_timestamps, decode_profile, refine_progress, cancel_event, refine_stats)
+            _check_cancelled(cancel_event)
+            refined_seconds = refine_stats.pop("audio_seconds", 0.0)
+            if refined_seconds > 0:
+                refine_wall = time.monotonic() - refine_started
+                if "cpu_seconds" not in refine_stats:
+                    refine_stats.update(refine_meter.stats())
+                record_rtf(refine_model, refined_seconds, refine_wall)
+                metrics.record(file_id, refine_model, "cascade", refined_seconds, refine_wall, refine_stats,
+                               max(concurrent, job_queue.running_jobs()))
+        
+        if speaker_recognition:
+            # Говорящие — по тому же PCM и участкам речи; сегменты перезапишутся уже с метками
+            progress_registry.update(file_id, 95.0, "Распознавание говорящих...")
+            from .diarization import diarize
+            segments = diarize(full_pcm.load(), segments, speech)
+            _check_cancelled(cancel_event)
+        
+        # Сохраняем результат: сегменты (основной формат) и текстовое представление
+        save_transcript(file_id, segments)
+        result_cache.store(file_id, segments, speaker_recognition, word_timestamps)
+        
+        # Обновляем статус
+        progress_registry.transition(file_id, "completed", 100.0, "Готово")
+        logger.info(f"Transcription completed: {file_id}")
+        return True
+        
+    except TranscriptionCancelled:
+        _mark_cancelled(file_id, pcm_key)
+        return False
+    except Exception as e:
+        if cancel_event is not None and cancel_event.is_set():
+            # Например, транскрипцию удалили вместе с аудио посреди декодирования
+            logger.info(f"Transcription of {file_id} stopped after cancellation: {e}")
+            _mark_cancelled(file_id, pcm_key)
+            return False
+        logger.error(f"Transcription failed for {file_id}: {e}", exc_info=True)
+        progress_registry.transition(file_id, "failed", message="Ошибка", error=str(e))
+        return False
+    finally:
+        db.close()
+
+
 async def process_transcript(file_id: str, audio_path: Path, model: str, filename: str):
     """
     Асинхронная обработка транскрипции
@@ -56,12 +467,8 @@ async def process_transcript(file_id: str, audio_path: Path, model: str, filenam
         db.close()
 
 def update_progress(db: Session, file_id: str, progress: float, message: str):
-    """Обновить прогресс и сообщение статуса"""
-    transcript = db.query(Transcript).filter(Transcript.file_id == file_id).first()
-    if transcript:
-        transcript.progress = progress
-        transcript.status_message = message
-        db.commit()
+    """Обновить прогресс и сообщение статуса (через реестр: БД пишется не на каждый тик)"""
+    progress_registry.update(file_id, progress, message)
 
 
 def process_transcript_sync(file_id: str, audio_path, model: str, filename: str):
@@ -71,16 +478,6 @@ def process_transcript_sync(file_id: str, audio_path, model: str, filename: str)
     import threading
     from .whisper_service import transcribe_with_progress
     
-    # ВАЖНО: Копируем файл во временную папку ДО запуска потока
-    # Это решает проблему с Unicode путями в Windows потоках
-    source = Path(audio_path)
-    ext = source.suffix.lower()
-    temp_path = Path(tempfile.gettempdir()) / f"wf_{uuid.uuid4().hex}{ext}"
-    
-    # Копируем файл (это работает с Unicode на Windows)
-    temp_path.write_bytes(source.read_bytes())
-    temp_path_str = str(temp_path)
-    
     def run():
         db: Session = SessionLocal()
         try:
@@ -94,10 +491,12 @@ def process_transcript_sync(file_id: str, audio_path, model: str, filename: str)
             db.commit()
             
             def progress_callback(progress: float, message: str):
-                update_progress(db, file_id, progress, message)
+                # Доля распознанного аудио (0–100) — между подготовкой (5%) и сохранением (95%)
+                update_progress(db, file_id, 5.0 + 90.0 * progress / 100, message)
             
-            # Используем уже скопированный временный файл
-            text = transcribe_with_progress(temp_path_str, model, progress_callback)
+            # Unicode-пути в потоках на Windows: вместо копии файла — жёсткая ссылка с ASCII-именем
+            with ascii_path(Path(audio_path)) as safe_path:
+                text = transcribe_with_progress(str(safe_path), model, progress_callback)
             
             update_progress(db, file_id, 95.0, "Сохранение результата...")
             text_path = TEXT_DIR / f"{file_id}.txt"
@@ -123,11 +522,6 @@ def process_transcript_sync(file_id: str, audio_path, model: str, filename: str)
                 pass
         finally:
             db.close()
-            # Удаляем временный файл
-            try:
-                Path(temp_path_str).unlink(missing_ok=True)
-            except:
-                pass
     
     thread = threading.Thread(target=run, daemon=True)
     thread.start()
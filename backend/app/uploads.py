@@ -0,0 +1,319 @@
+"""
+Приём загружаемых файлов без промежуточных копий.
+
+UploadFile из Starlette сначала складывает файл во временный SpooledTemporaryFile, и обработчику
+приходится читать его и записывать ещё раз. Здесь multipart/form-data разбирается по мере
+прихода тела запроса: файл пишется блоками сразу туда, где будет храниться, а SHA-256 считается
+по пути. Память занимает только текущий блок, а не весь файл.
+
+Докачиваемая загрузка (/uploads) хранит недокачанный файл в UPLOAD_PARTS_DIR: принятое смещение —
+его размер на диске, поэтому после обрыва связи или перезапуска клиент продолжает с него.
+Готовый файл проверяется по SHA-256 и переносится в AUDIO_DIR переименованием.
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import re
+
+from fastapi import Request
+
+from .config import AUDIO_DIR, UPLOAD_PARTS_DIR, UPLOAD_SESSION_TTL_HOURS
+from .models import Transcript, UploadSession
+
+try:
+    from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Обычные поля формы короткие; ограничение не даёт набить память полем без filename
+MAX_FIELD_SIZE = 64 * 1024
+# Тело запроса набирается блоками такого размера, и каждый блок пишется на диск в потоке:
+# запись большого файла не останавливает цикл событий (другие запросы, SSE, WebSocket)
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+
+# Управляющие символы и разделители пути (в том числе ":" — поток NTFS на Windows)
+_UNSAFE_FILENAME_CHARS = re.compile(r'[\x00-\x1f\x7f/\\:]')
+
+
+class UploadError(ValueError):
+    """Некорректный запрос загрузки (не multipart, нет файла и т.п.)"""
+
+
+def safe_filename(name: str) -> str:
+    """Имя файла от клиента без пути, разделителей и управляющих символов ("" — если ничего не осталось).
+
+    Имя входит в путь AUDIO_DIR/{uid}_{имя}: "..\\" или "/" в нём не должны уводить из хранилища.
+    """
+    name = Path(name.replace("\\", "/")).name
+    return _UNSAFE_FILENAME_CHARS.sub("", name).strip().strip(".")
+
+
+class ReceivedUpload:
+    """Результат разбора формы: обычные поля и сохранённый файл"""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.path: Optional[Path] = None
+        self.size = 0
+        self.sha256: Optional[str] = None
+
+
+async def receive_upload(request: Request, target: Callable[[str], Path], file_field: str = "file") -> ReceivedUpload:
+    """Разобрать multipart-запрос, записав файл из поля file_field по пути target(filename).
+
+    При ошибке недописанный файл удаляется.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadError("Ожидается multipart/form-data")
+
+    result = ReceivedUpload()
+    hasher = hashlib.sha256()
+    headers: Dict[bytes, bytes] = {}
+    header_field = bytearray()
+    header_value = bytearray()
+    part = {"name": None, "value": bytearray(), "out": None}
+
+    def on_part_begin():
+        headers.clear()
+        part.update(name=None, value=bytearray(), out=None)
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8")
+        filename = options.get(b"filename")
+        if part["name"] != file_field or filename is None:
+            return
+        if result.path is not None:
+            raise UploadError("Можно загрузить только один файл")
+        result.filename = safe_filename(filename.decode("utf-8", "replace"))
+        if not result.filename:
+            raise UploadError("Некорректное имя файла")
+        result.path = target(result.filename)
+        try:
+            part["out"] = open(result.path, "wb")
+        except OSError as e:
+            result.path = None
+            raise UploadError(f"Не удалось сохранить файл: {e}")
+
+    def on_part_data(data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if part["out"] is not None:
+            hasher.update(chunk)
+            part["out"].write(chunk)
+            result.size += len(chunk)
+            return
+        part["value"].extend(chunk)
+        if len(part["value"]) > MAX_FIELD_SIZE:
+            raise UploadError(f"Поле формы '{part['name']}' слишком длинное")
+
+    def on_part_end():
+        if part["out"] is not None:
+            part["out"].close()
+            part["out"] = None
+        elif part["name"]:
+            result.fields[part["name"]] = part["value"].decode("utf-8", "replace")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        block = bytearray()
+        async for chunk in request.stream():
+            block.extend(chunk)
+            if len(block) >= WRITE_BLOCK_SIZE:
+                # Колбэки парсера (открытие файла, запись, хэш) выполняются в этом потоке
+                await asyncio.to_thread(parser.write, bytes(block))
+                block.clear()
+        if block:
+            await asyncio.to_thread(parser.write, bytes(block))
+        parser.finalize()
+        if result.path is None:
+            raise UploadError("Файл не передан")
+    except MultipartParseError as e:
+        _discard(part, result)
+        raise UploadError(f"Некорректный multipart: {e}")
+    except Exception:
+        _discard(part, result)
+        raise
+
+    result.sha256 = hasher.hexdigest()
+    return result
+
+
+def _discard(part: dict, result: ReceivedUpload):
+    """Закрыть и удалить недописанный файл"""
+    if part["out"] is not None:
+        part["out"].close()
+    if result.path is not None:
+        result.path.unlink(missing_ok=True)
+
+
+# Блок чтения при пересчёте хэша готового файла
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Хэш докачиваемых загрузок, посчитанный по пути: upload_id -> (смещение, hasher).
+# После перезапуска его нет — тогда хэш пересчитывается по файлу при завершении
+_hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+# Два PUT в одну загрузку не должны писать одновременно
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+def part_path(upload_id: str) -> Path:
+    return UPLOAD_PARTS_DIR / f"{upload_id}.part"
+
+
+def received_bytes(upload_id: str) -> int:
+    """Сколько байт загрузки уже принято (размер недокачанного файла)"""
+    try:
+        return part_path(upload_id).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def session_lock(upload_id: str) -> asyncio.Lock:
+    return _locks.setdefault(upload_id, asyncio.Lock())
+
+
+def find_stored_audio(db, sha256: str) -> Optional[Path]:
+    """Уже сохранённый аудиофайл с таким SHA-256, если есть"""
+    for (file_id,) in db.query(Transcript.file_id).filter(Transcript.audio_hash == sha256).all():
+        matches = list(AUDIO_DIR.glob(f"{file_id}_*"))
+        if matches:
+            return matches[0]
+    return None
+
+
+def link_stored_audio(source: Path, target: Path) -> bool:
+    """Сделать target жёсткой ссылкой на уже сохранённый файл (без копирования данных)"""
+    try:
+        os.link(source, target)
+        return True
+    except OSError as e:
+        logger.warning(f"Cannot hardlink {source.name} for deduplicated upload: {e}")
+        return False
+
+
+def create_session(db, upload_id: str, **fields) -> UploadSession:
+    UPLOAD_PARTS_DIR.mkdir(parents=True, exist_ok=True)
+    session = UploadSession(id=upload_id, created_at=datetime.utcnow(), updated_at=datetime.utcnow(), **fields)
+    db.add(session)
+    db.commit()
+    part_path(upload_id).touch()
+    _hashers[upload_id] = (0, hashlib.sha256())
+    return session
+
+
+def remove_session(db, session: UploadSession):
+    """Удалить загрузку вместе с недокачанным файлом"""
+    part_path(session.id).unlink(missing_ok=True)
+    _hashers.pop(session.id, None)
+    _locks.pop(session.id, None)
+    db.delete(session)
+    db.commit()
+
+
+def cleanup_expired(db):
+    """Удалить загрузки, которые не продолжались дольше UPLOAD_SESSION_TTL_HOURS"""
+    deadline = datetime.utcnow() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    expired = db.query(UploadSession).filter(UploadSession.updated_at < deadline).all()
+    for session in expired:
+        remove_session(db, session)
+    if expired:
+        logger.info(f"Removed {len(expired)} abandoned uploads")
+
+
+async def append_range(upload_id: str, start: int, limit: int, chunks: AsyncIterator[bytes]) -> int:
+    """Дописать в загрузку байты с позиции start (не больше limit). Возвращает новое смещение.
+
+    Принятые байты пишутся сразу: если связь оборвётся посреди куска, принятая часть сохранится.
+    """
+    offset, hasher = _hashers.get(upload_id, (None, None))
+    if offset != start:
+        # Хэш по пути потерян (перезапуск) — посчитаем при завершении по файлу
+        _hashers.pop(upload_id, None)
+        hasher = None
+    written = 0
+
+    def write(block: bytes):
+        out.write(block)
+        if hasher is not None:
+            hasher.update(block)
+
+    try:
+        with open(part_path(upload_id), "ab") as out:
+            # Блоками по WRITE_BLOCK_SIZE в потоке, как в receive_upload; набранный остаток
+            # дописывается и при обрыве связи, чтобы принятое смещение не откатилось
+            block = bytearray()
+            try:
+                async for chunk in chunks:
+                    if written + len(block) + len(chunk) > limit:
+                        raise UploadError("Данных больше, чем объявлено в Content-Range")
+                    block.extend(chunk)
+                    if len(block) >= WRITE_BLOCK_SIZE:
+                        await asyncio.to_thread(write, bytes(block))
+                        written += len(block)
+                        block.clear()
+            finally:
+                if block:
+                    await asyncio.to_thread(write, bytes(block))
+                    written += len(block)
+    finally:
+        if hasher is not None:
+            _hashers[upload_id] = (start + written, hasher)
+    return start + written
+
+
+def file_sha256(upload_id: str) -> str:
+    """SHA-256 докачанного файла: посчитанный по пути или, после перезапуска, заново по файлу"""
+    size = received_bytes(upload_id)
+    offset, hasher = _hashers.get(upload_id, (None, None))
+    if hasher is not None and offset == size:
+        return hasher.hexdigest()
+    hasher = hashlib.sha256()
+    with open(part_path(upload_id), "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def restart_session(upload_id: str):
+    """Начать загрузку заново (собранный файл не прошёл проверку)"""
+    part_path(upload_id).write_bytes(b"")
+    _hashers[upload_id] = (0, hashlib.sha256())
+
+
+def move_to_storage(upload_id: str, target: Path):
+    """Перенести докачанный файл в хранилище (переименование в той же файловой системе)"""
+    os.replace(part_path(upload_id), target)
+    _hashers.pop(upload_id, None)
+    _locks.pop(upload_id, None)
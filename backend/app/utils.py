@@ -1,7 +1,14 @@
 def format_timestamp(seconds: float) -> str:
-    ms = int((seconds % 1) * 1000)
-    s = int(seconds)
+    total_ms = int(round(seconds * 1000))
+    s, ms = divmod(total_ms, 1000)
     h = s // 3600
     m = (s % 3600) // 60
     s = s % 60
     return f"{h:02}:{m:02}:{s:02}.{ms:03}"
+
+
+def format_clock(seconds: float) -> str:
+    """Длительность для сообщений прогресса: M:SS или H:MM:SS"""
+    total = int(seconds)
+    h, m, s = total // 3600, (total % 3600) // 60, total % 60
+    return f"{h}:{m:02}:{s:02}" if h else f"{m}:{s:02}"
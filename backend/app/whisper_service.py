@@ -3,11 +3,18 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
 from faster_whisper import WhisperModel
-from .utils import format_timestamp
-from typing import Callable, Optional
-import tempfile
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.transcribe import restore_speech_timestamps
+from faster_whisper.vad import VadOptions, collect_chunks, get_speech_timestamps
+from .utils import format_clock, format_timestamp
+from .config import DECODE_PROFILE_DEFAULT, LONG_FILE_WORKERS, WHISPER_CPU_THREADS
+from .model_manager import model_manager
+from .audio_cache import SAMPLE_RATE, PcmRef, ascii_path, speech_seconds, speech_timeline
+from .segment_store import format_segments
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+import ctranslate2
+import numpy as np
 from pathlib import Path
-import uuid
 import torch
 import logging
 
@@ -17,64 +24,144 @@ logger = logging.getLogger(__name__)
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 COMPUTE_TYPE = "float16" if torch.cuda.is_available() else "int8"
 
-# Кэш для модели (чтобы не загружать каждый раз)
-_model_cache = {}
+# Примерный объём памяти загруженной модели (МБ) — для бюджета менеджера моделей
+# и проверки, какие модели вообще помещаются на этот сервер
+WHISPER_MODEL_SIZES_MB = {
+    "tiny": 150,
+    "base": 250,
+    "small": 650,
+    "medium": 1700,
+    "large-v2": 3300,
+    "large-v3": 3300,
+    "large": 3300,
+}
+
+
+# Профили декодирования: точность в обмен на скорость. Параметры профиля входят в ключ кэша
+# результатов: при их изменении старые результаты из кэша не используются
+DECODE_PROFILES = {
+    # Глубокая очередь: жадный поиск без повторных проходов с повышенной температурой,
+    # VAD режет паузы агрессивнее — Whisper получает меньше аудио
+    "fast": dict(
+        beam_size=1,
+        temperature=0.0,
+        vad_filter=True,
+        vad_parameters=dict(
+            threshold=0.6,
+            min_silence_duration_ms=300
+        ),
+        condition_on_previous_text=False,
+        compression_ratio_threshold=2.4,
+        log_prob_threshold=-1.0,
+        no_speech_threshold=0.6
+    ),
+    "balanced": dict(
+        beam_size=1,  # Быстрый поиск
+        vad_filter=True,  # Фильтрация тишины
+        vad_parameters=dict(
+            min_silence_duration_ms=500
+        ),
+        condition_on_previous_text=False,
+        compression_ratio_threshold=2.4,
+        log_prob_threshold=-1.0,
+        no_speech_threshold=0.6
+    ),
+    # Лучевой поиск, контекст предыдущего текста, VAD бережнее к тихой речи; в 3–5 раз медленнее balanced
+    "accurate": dict(
+        beam_size=5,
+        best_of=5,
+        vad_filter=True,
+        vad_parameters=dict(
+            threshold=0.35,
+            min_silence_duration_ms=1000,
+            speech_pad_ms=400
+        ),
+        condition_on_previous_text=True,
+        compression_ratio_threshold=2.4,
+        log_prob_threshold=-1.0,
+        no_speech_threshold=0.6
+    ),
+}
+
+
+def decode_profile_name(profile: Optional[str] = None) -> str:
+    """Имя профиля: заданный или DECODE_PROFILE_DEFAULT (неизвестное имя в настройке — balanced)"""
+    if profile in DECODE_PROFILES:
+        return profile
+    return DECODE_PROFILE_DEFAULT if DECODE_PROFILE_DEFAULT in DECODE_PROFILES else "balanced"
+
+
+def decode_options(profile: Optional[str] = None) -> dict:
+    """Параметры model.transcribe для профиля (None — профиль по умолчанию)"""
+    return DECODE_PROFILES[decode_profile_name(profile)]
+
+
+def normalize_model_name(model_name: str) -> str:
+    """Маппинг имен моделей: openai/whisper-large-v3 -> large-v3"""
+    if model_name.startswith("openai/whisper-"):
+        return model_name.replace("openai/whisper-", "")
+    if model_name.startswith("whisper-"):
+        return model_name.replace("whisper-", "")
+    return model_name
+
+
+def model_size_mb(model_name: str) -> float:
+    return WHISPER_MODEL_SIZES_MB.get(normalize_model_name(model_name), WHISPER_MODEL_SIZES_MB["large"])
+
+
+def allowed_models() -> List[str]:
+    """Модели Whisper, которые помещаются в бюджет памяти сервера"""
+    return [name for name, size in WHISPER_MODEL_SIZES_MB.items() if model_manager.fits(size)]
+
+
+def _model_key(model_name: str) -> str:
+    return f"whisper:{normalize_model_name(model_name)}"
 
 
 def _get_model(model_name: str):
-    """Получить модель из кэша или загрузить новую"""
-    if model_name not in _model_cache:
-        logger.info(f"Loading model {model_name} on {DEVICE} with compute_type={COMPUTE_TYPE}")
-        # Маппинг имен моделей: openai/whisper-large-v3 -> large-v3
-        if model_name.startswith("openai/whisper-"):
-            model_name = model_name.replace("openai/whisper-", "")
-        elif model_name.startswith("whisper-"):
-            model_name = model_name.replace("whisper-", "")
-        
-        _model_cache[model_name] = WhisperModel(
-            model_name,
+    """Получить модель из менеджера моделей или загрузить новую"""
+    name = normalize_model_name(model_name)
+
+    def load():
+        logger.info(f"Loading model {name} on {DEVICE} with compute_type={COMPUTE_TYPE}")
+        return WhisperModel(
+            name,
             device=DEVICE,
-            compute_type=COMPUTE_TYPE
+            compute_type=COMPUTE_TYPE,
+            cpu_threads=WHISPER_CPU_THREADS,
+            # Несколько воркеров CTranslate2 позволяют параллельно распознавать куски длинных файлов
+            num_workers=LONG_FILE_WORKERS
         )
-        logger.info(f"Model {model_name} loaded successfully")
-    return _model_cache[model_name]
+
+    return model_manager.get(_model_key(name), load, model_size_mb(name))
+
+
+def warmup(model_name: str):
+    """Загрузить модель и прогнать короткий синтетический клип, чтобы первая задача не ждала загрузки"""
+    model = _get_model(model_name)
+    # Прогретая модель остаётся в памяти: иначе после простоя первая задача снова ждала бы загрузки
+    model_manager.pin(_model_key(model_name))
+    t = np.arange(2 * 16000, dtype=np.float32) / 16000
+    clip = (0.1 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    with model_manager.hold(_model_key(model_name)):
+        # Без VAD: на тоне он отрезал бы всё, а нам нужен полный проход энкодера и декодера
+        segments, _ = model.transcribe(clip, language="en", beam_size=1, vad_filter=False,
+                                       condition_on_previous_text=False)
+        for _ in segments:
+            pass
 
 
 def transcribe(audio_path, model_name, language=None):
     """Простая транскрипция с опциональным указанием языка"""
-    source = Path(audio_path)
-    
-    # Проверяем, нужно ли копировать (если путь уже temp - не копируем)
-    temp_dir = tempfile.gettempdir()
-    if str(source).startswith(temp_dir):
-        # Файл уже во временной папке
-        safe_path = str(source)
-        need_cleanup = False
-    else:
-        # Копируем во временную папку
-        ext = source.suffix.lower()
-        temp_path = Path(temp_dir) / f"wf_{uuid.uuid4().hex}{ext}"
-        temp_path.write_bytes(source.read_bytes())
-        safe_path = str(temp_path)
-        need_cleanup = True
-    
-    try:
+    # Не-ASCII путь подменяем жёсткой ссылкой с ASCII-именем, а не копией файла
+    with ascii_path(Path(audio_path)) as safe_path:
         model = _get_model(model_name)
         
-        # Оптимизированные параметры для быстрой обработки
         segments, info = model.transcribe(
-            safe_path,
-            beam_size=1,  # Быстрый поиск (вместо 5)
+            str(safe_path),
             language=language,  # Язык если указан
-            vad_filter=True,  # Фильтрация тишины (ускоряет обработку)
-            vad_parameters=dict(
-                min_silence_duration_ms=500  # Минимальная длительность тишины
-            ),
-            condition_on_previous_text=False,  # Не зависит от предыдущего текста (быстрее)
-            compression_ratio_threshold=2.4,
-            log_prob_threshold=-1.0,
-            no_speech_threshold=0.6,
-            word_timestamps=True  # Для форматирования с таймкодами
+            word_timestamps=True,  # Для форматирования с таймкодами
+            **decode_options()
         )
 
         lines = []
@@ -85,81 +172,240 @@ def transcribe(audio_path, model_name, language=None):
             lines.append(f"[{start} --> {end}]  {text}")
 
         return "\n".join(lines)
-    finally:
-        if need_cleanup:
-            try:
-                os.remove(safe_path)
-            except:
-                pass
 
 
-def transcribe_with_progress(audio_path: str, model_name: str, 
-                              language: Optional[str] = None,
-                              progress_callback: Optional[Callable[[float, str], None]] = None):
-    """Транскрибирует аудио с отслеживанием прогресса"""
-    # Файл уже должен быть во временной папке (скопирован в tasks.py)
-    safe_path = audio_path
+def transcribe_segments(audio_path: Union[str, np.ndarray, PcmRef], model_name: str,
+                        language: Optional[str] = None,
+                        progress_callback: Optional[Callable[[float, str], None]] = None,
+                        word_timestamps: bool = False, stats: Optional[dict] = None,
+                        profile: Optional[str] = None) -> Iterator[dict]:
+    """Транскрибирует аудио (путь к файлу, PCM 16 кГц или ссылка на закэшированный PCM)
+    и по мере готовности отдаёт сегменты {start, end, text, avg_logprob, no_speech_prob[, words]}.
+
+    word_timestamps включает выравнивание слов — это заметно дороже, поэтому только по запросу.
+    progress_callback получает долю уже распознанного аудио (0–100): конец последнего сегмента
+    к длительности записи.
+    stats — словарь, куда записываются speech_seconds: длительность речи после VAD (для метрик),
+    и language: язык записи (заданный или определённый моделью).
+    profile — профиль декодирования (DECODE_PROFILES; None — профиль по умолчанию).
+    Для PCM из кэша участки речи берутся из сохранённой разметки записи (audio_cache.speech_timeline),
+    а не считаются VAD внутри model.transcribe заново.
+    """
+    profile = decode_profile_name(profile)
+    options = dict(DECODE_PROFILES[profile])
+    speech = None
+    if isinstance(audio_path, PcmRef) and options.pop("vad_filter", False):
+        speech = speech_timeline(audio_path, options.pop("vad_parameters", {}))
+    # PCM из кэша читается через memory-map и подаётся модели без декодирования
+    safe_path = audio_path.load() if isinstance(audio_path, PcmRef) else audio_path
     
     try:
-        if progress_callback:
-            progress_callback(5.0, "Подготовка...")
+        if isinstance(safe_path, np.ndarray):
+            size_info = f"{len(safe_path) / 16000:.0f} сек"
+        else:
+            size_info = f"{os.path.getsize(safe_path) / (1024 * 1024):.1f} МБ"
         
-        file_size = os.path.getsize(safe_path)
-        file_size_mb = file_size / (1024 * 1024)
+        if speech is not None and not speech:
+            # Речи в записи нет — модель не нужна
+            if stats is not None:
+                stats["speech_seconds"] = 0.0
+                stats["language"] = language
+            if progress_callback:
+                progress_callback(100.0, "Речь не обнаружена")
+            return
         
         if progress_callback:
-            progress_callback(10.0, f"Загрузка модели {model_name}...")
+            progress_callback(0.0, f"Загрузка модели {model_name}...")
         
         model = _get_model(model_name)
         
-        if progress_callback:
-            progress_callback(25.0, "Модель загружена...")
-        
         if progress_callback:
             device_info = f"GPU ({DEVICE})" if DEVICE == "cuda" else "CPU"
             lang_msg = f" ({language})" if language else " (авто)"
-            progress_callback(30.0, f"Распознавание на {device_info}{lang_msg} ({file_size_mb:.1f} МБ)...")
+            progress_callback(0.0, f"Распознавание на {device_info}{lang_msg} ({size_info}, профиль {profile})...")
         
-        # Оптимизированные параметры для быстрой обработки
-        segments, info = model.transcribe(
-            safe_path,
-            beam_size=1,  # Быстрый поиск
-            language=language,  # Язык если указан
-            vad_filter=True,  # Фильтрация тишины
-            vad_parameters=dict(
-                min_silence_duration_ms=500
-            ),
-            condition_on_previous_text=False,
-            compression_ratio_threshold=2.4,
-            log_prob_threshold=-1.0,
-            no_speech_threshold=0.6,
-            word_timestamps=True
-        )
-        
-        if progress_callback:
-            progress_callback(50.0, "Обработка сегментов...")
-        
-        lines = []
-        segment_count = 0
-        
-        # Обрабатываем генератор сегментов
-        for seg in segments:
-            start = format_timestamp(seg.start)
-            end = format_timestamp(seg.end)
-            text = seg.text.strip()
-            lines.append(f"[{start} --> {end}]  {text}")
-            segment_count += 1
+        # Модель занята, пока отдаём сегменты: менеджер не выгрузит её посреди задачи
+        with model_manager.hold(_model_key(model_name)):
+            # Оптимизированные параметры для быстрой обработки
+            segments, info = model.transcribe(
+                # Только речь, склеенная так же, как это делает vad_filter
+                collect_chunks(safe_path, speech) if speech else safe_path,
+                language=language,  # Язык если указан
+                word_timestamps=word_timestamps,
+                **options
+            )
+            
+            total = info.duration
+            speech_duration = info.duration_after_vad
+            if speech:
+                # Таймкоды склеенной речи -> таймкоды записи
+                segments = restore_speech_timestamps(segments, speech, SAMPLE_RATE)
+                total = len(safe_path) / SAMPLE_RATE
+                speech_duration = speech_seconds(speech)
+            if stats is not None:
+                stats["speech_seconds"] = speech_duration
+                stats["language"] = info.language
             
-            # Обновляем прогресс каждые 10 сегментов
-            if progress_callback and segment_count % 10 == 0:
-                progress = min(50.0 + (segment_count * 0.5), 90.0)
-                progress_callback(progress, f"Обработано сегментов: {segment_count}...")
+            # Обрабатываем генератор сегментов
+            for seg in segments:
+                item = {
+                    "start": seg.start,
+                    "end": seg.end,
+                    "text": seg.text.strip(),
+                    "avg_logprob": seg.avg_logprob,
+                    "no_speech_prob": seg.no_speech_prob
+                }
+                if word_timestamps and seg.words:
+                    item["words"] = [
+                        {"start": w.start, "end": w.end, "word": w.word.strip(), "probability": w.probability}
+                        for w in seg.words
+                    ]
+                yield item
+                
+                # Прогресс — по времени: паузы, пропущенные VAD, засчитываются вместе со следующим сегментом
+                if progress_callback and total:
+                    progress_callback(min(100.0, 100.0 * seg.end / total),
+                                      f"Распознано {format_clock(seg.end)} из {format_clock(total)}...")
         
         if progress_callback:
-            progress_callback(90.0, "Форматирование...")
-        
-        return "\n".join(lines)
+            progress_callback(100.0, "Распознавание завершено")
     
     except Exception as e:
         logger.error(f"Transcription error: {e}", exc_info=True)
         raise
+
+
+def transcribe_window(audio: np.ndarray, model_name: str, language: Optional[str] = None,
+                      prompt: Optional[str] = None) -> tuple:
+    """Распознать короткое окно PCM (потоковый режим). Возвращает (сегменты, язык).
+
+    prompt — хвост уже распознанного текста: помогает модели не терять контекст между окнами.
+    """
+    model = _get_model(model_name)
+    with model_manager.hold(_model_key(model_name)):
+        # Окно живой речи перераспознаётся по нескольку раз — профиль не зависит от очереди и настроек
+        segments, info = model.transcribe(audio, language=language, initial_prompt=prompt or None,
+                                          **DECODE_PROFILES["balanced"])
+        items = [
+            {
+                "start": seg.start,
+                "end": seg.end,
+                "text": seg.text.strip(),
+                "avg_logprob": seg.avg_logprob,
+                "no_speech_prob": seg.no_speech_prob
+            }
+            for seg in segments
+        ]
+    return [item for item in items if item["text"]], info.language
+
+
+def transcribe_with_progress(audio_path: str, model_name: str, 
+                              language: Optional[str] = None,
+                              progress_callback: Optional[Callable[[float, str], None]] = None):
+    """Транскрибирует аудио с отслеживанием прогресса"""
+    return format_segments(transcribe_segments(audio_path, model_name, language, progress_callback))
+
+
+def _batch_windows(audio: Union[np.ndarray, PcmRef], max_seconds: float = 30.0) -> Tuple[List[tuple], float]:
+    """Разбить короткую запись на окна речи не длиннее max_seconds (в отсчётах).
+    Возвращает окна и длительность речи в секундах.
+    """
+    vad_parameters = dict(min_silence_duration_ms=500, max_speech_duration_s=max_seconds)
+    if isinstance(audio, PcmRef):
+        speech = speech_timeline(audio, vad_parameters)
+    else:
+        speech = get_speech_timestamps(audio, VadOptions(**vad_parameters))
+    max_samples = int(max_seconds * 16000)
+    windows = []
+    for region in speech:
+        if windows and region["end"] - windows[-1][0] <= max_samples:
+            windows[-1] = (windows[-1][0], region["end"])
+        else:
+            windows.append((region["start"], region["end"]))
+    return windows, speech_seconds(speech)
+
+
+def transcribe_batch(audios: List[Union[np.ndarray, PcmRef]], model_name: str,
+                     language: Optional[str] = None, stats: Optional[dict] = None) -> List[List[dict]]:
+    """Пакетная транскрипция коротких записей (PCM 16 кГц) одним проходом энкодера и декодера.
+
+    Каждая запись режется VAD на окна до 30 секунд, окна всех записей кодируются
+    и декодируются одним батчем, затем сегменты раскладываются обратно по записям.
+    stats — словарь, куда записывается speech_seconds: список длительностей речи по записям.
+    """
+    model = _get_model(model_name)
+    extractor = model.feature_extractor
+
+    owners, bounds, features, speech = [], [], [], []
+    for index, audio in enumerate(audios):
+        windows, seconds = _batch_windows(audio)
+        speech.append(seconds)
+        if isinstance(audio, PcmRef):
+            audio = audio.load()
+        for start, end in windows:
+            chunk = audio[start:end]
+            mel = extractor(chunk)[:, :extractor.nb_max_frames]
+            if mel.shape[1] < extractor.nb_max_frames:
+                mel = np.pad(mel, [(0, 0), (0, extractor.nb_max_frames - mel.shape[1])])
+            owners.append(index)
+            bounds.append((start / 16000, end / 16000))
+            features.append(mel)
+
+    if stats is not None:
+        stats["speech_seconds"] = speech
+    results: List[List[dict]] = [[] for _ in audios]
+    if not features:
+        return results
+
+    # Модель занята на весь проход: LRU и выгрузка по простою не должны забрать её посреди батча
+    with model_manager.hold(_model_key(model_name)):
+        batch = ctranslate2.StorageView.from_array(np.ascontiguousarray(np.stack(features).astype(np.float32)))
+        encoder_output = model.model.encode(batch, to_cpu=False)
+
+        # Язык: заданный для всего батча или определённый по первому окну каждой записи
+        languages = [language] * len(features)
+        if language is None and model.model.is_multilingual:
+            detected = model.model.detect_language(encoder_output)
+            per_audio = {}
+            for i, owner in enumerate(owners):
+                per_audio.setdefault(owner, detected[i][0][0][2:-2])
+            languages = [per_audio[owner] for owner in owners]
+
+        tokenizers = {}
+        prompts = []
+        for lang in languages:
+            if lang not in tokenizers:
+                tokenizers[lang] = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language=lang or "en")
+            tokenizer = tokenizers[lang]
+            prompts.append(list(tokenizer.sot_sequence) + [tokenizer.no_timestamps])
+
+        outputs = model.model.generate(
+            encoder_output,
+            prompts,
+            beam_size=1,
+            max_length=448,
+            return_scores=True,
+            return_no_speech_prob=True,
+            suppress_blank=True,
+            suppress_tokens=[-1]
+        )
+
+    for i, output in enumerate(outputs):
+        tokens = output.sequences_ids[0]
+        avg_logprob = output.scores[0] * len(tokens) / (len(tokens) + 1)
+        # Тот же критерий тишины, что и в обычном transcribe (no_speech_threshold/log_prob_threshold)
+        if output.no_speech_prob > 0.6 and avg_logprob < -1.0:
+            continue
+        text = tokenizers[languages[i]].decode(tokens).strip()
+        if not text:
+            continue
+        start, end = bounds[i]
+        results[owners[i]].append({
+            "start": start,
+            "end": end,
+            "text": text,
+            "avg_logprob": avg_logprob,
+            "no_speech_prob": output.no_speech_prob
+        })
+
+    return results
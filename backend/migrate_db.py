@@ -61,133 +61,34 @@ def migrate():
         else:
             print("[OK] duration_seconds column already exists")
         
-        # 3. Create transcript_ai table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transcript_ai (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                transcript_id INTEGER NOT NULL REFERENCES transcripts(id),
-                file_id VARCHAR NOT NULL,
-                summary TEXT,
-                summary_created_at DATETIME,
-                keywords TEXT,
-                keywords_created_at DATETIME,
-                sentiment TEXT,
-                sentiment_created_at DATETIME,
-                category VARCHAR,
-                category_confidence REAL,
-                category_created_at DATETIME,
-                translations TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        print("[OK] transcript_ai table created/checked")
-        
-        # 4. Create conversations table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                language VARCHAR NOT NULL,
-                level VARCHAR NOT NULL,
-                topic VARCHAR,
-                total_messages INTEGER DEFAULT 0,
-                total_corrections INTEGER DEFAULT 0,
-                duration_seconds INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        print("[OK] conversations table created/checked")
-        
-        # 5. Create conversation_messages table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id INTEGER NOT NULL REFERENCES conversations(id),
-                role VARCHAR NOT NULL,
-                content TEXT NOT NULL,
-                original_text TEXT,
-                is_corrected INTEGER DEFAULT 0,
-                correction_data TEXT,
-                audio_url VARCHAR,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        print("[OK] conversation_messages table created/checked")
-        
-        conn.commit()
-        print("\n[SUCCESS] Migration completed!")
-        
-    except Exception as e:
-        print(f"[ERROR] Migration failed: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
-
-if __name__ == "__main__":
-    migrate()
-
-"""
-import sqlite3
-import os
-
-# Database path
-DB_PATH = os.path.join(os.path.dirname(__file__), "db.sqlite3")
-
-def migrate():
-    print(f"Migrating database: {DB_PATH}")
-    
-    if not os.path.exists(DB_PATH):
-        print("Database not found. It will be created when server starts.")
-        return
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    try:
-        # 1. Create folders table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS folders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name VARCHAR NOT NULL,
-                user_id INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        print("[OK] folders table created/checked")
-        
-        # 2. Check columns in transcripts
-        cursor.execute("PRAGMA table_info(transcripts)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        # Add folder_id if missing
-        if 'folder_id' not in columns:
-            cursor.execute("ALTER TABLE transcripts ADD COLUMN folder_id INTEGER REFERENCES folders(id)")
-            print("[OK] folder_id column added to transcripts")
+        # Add audio_hash if missing (content hash for the transcript result cache)
+        if 'audio_hash' not in columns:
+            cursor.execute("ALTER TABLE transcripts ADD COLUMN audio_hash VARCHAR")
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_transcripts_audio_hash ON transcripts (audio_hash)")
+            print("[OK] audio_hash column added to transcripts")
         else:
-            print("[OK] folder_id column already exists")
+            print("[OK] audio_hash column already exists")
         
-        # Add status_message if missing
-        if 'status_message' not in columns:
-            cursor.execute("ALTER TABLE transcripts ADD COLUMN status_message VARCHAR")
-            print("[OK] status_message column added to transcripts")
+        # Add decode_profile if missing (decoding profile the transcript was recognized with)
+        if 'decode_profile' not in columns:
+            cursor.execute("ALTER TABLE transcripts ADD COLUMN decode_profile VARCHAR")
+            print("[OK] decode_profile column added to transcripts")
         else:
-            print("[OK] status_message column already exists")
+            print("[OK] decode_profile column already exists")
         
-        # Add language if missing
-        if 'language' not in columns:
-            cursor.execute("ALTER TABLE transcripts ADD COLUMN language VARCHAR")
-            print("[OK] language column added to transcripts")
+        # Add speech_seconds if missing (speech duration from the cached VAD timeline)
+        if 'speech_seconds' not in columns:
+            cursor.execute("ALTER TABLE transcripts ADD COLUMN speech_seconds REAL")
+            print("[OK] speech_seconds column added to transcripts")
         else:
-            print("[OK] language column already exists")
+            print("[OK] speech_seconds column already exists")
         
-        # Add duration_seconds if missing
-        if 'duration_seconds' not in columns:
-            cursor.execute("ALTER TABLE transcripts ADD COLUMN duration_seconds REAL")
-            print("[OK] duration_seconds column added to transcripts")
+        # Add refine_model if missing (cascade: model that re-decodes low-confidence segments)
+        if 'refine_model' not in columns:
+            cursor.execute("ALTER TABLE transcripts ADD COLUMN refine_model VARCHAR")
+            print("[OK] refine_model column added to transcripts")
         else:
-            print("[OK] duration_seconds column already exists")
+            print("[OK] refine_model column already exists")
         
         # 3. Create transcript_ai table if not exists
         cursor.execute("""
@@ -244,6 +145,40 @@ def migrate():
         """)
         print("[OK] conversation_messages table created/checked")
         
+        # 6. transcription_jobs: add columns introduced after the table was created
+        # (the table itself is created by the server on startup)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transcription_jobs'")
+        if cursor.fetchone():
+            cursor.execute("PRAGMA table_info(transcription_jobs)")
+            job_columns = [col[1] for col in cursor.fetchall()]
+            new_job_columns = {
+                "duration_seconds": "REAL",
+                "word_timestamps": "INTEGER DEFAULT 0",
+                "resume_from": "REAL",
+                "owner": "VARCHAR",
+                "priority": "VARCHAR",
+                "decode_profile": "VARCHAR",
+                "refine_model": "VARCHAR",
+            }
+            for name, column_type in new_job_columns.items():
+                if name not in job_columns:
+                    cursor.execute(f"ALTER TABLE transcription_jobs ADD COLUMN {name} {column_type}")
+                    print(f"[OK] {name} column added to transcription_jobs")
+                else:
+                    print(f"[OK] {name} column already exists")
+        
+        # 7. upload_sessions: same for resumable uploads
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='upload_sessions'")
+        if cursor.fetchone():
+            cursor.execute("PRAGMA table_info(upload_sessions)")
+            session_columns = [col[1] for col in cursor.fetchall()]
+            for name in ("decode_profile", "refine_model"):
+                if name not in session_columns:
+                    cursor.execute(f"ALTER TABLE upload_sessions ADD COLUMN {name} VARCHAR")
+                    print(f"[OK] {name} column added to upload_sessions")
+                else:
+                    print(f"[OK] {name} column already exists in upload_sessions")
+        
         conn.commit()
         print("\n[SUCCESS] Migration completed!")
         
@@ -37,21 +37,124 @@ async function apiCheckDuplicate(filename) {
     return await response.json();
 }
 
-async function apiUploadAudio(file, model, language = 'auto', speakerRecognition = false) {
+// Токен входа: по нему сервер считает лимиты очереди на пользователя (без него — на IP)
+function authHeaders(headers = {}) {
+    const token = localStorage.getItem("token");
+    return token ? { ...headers, "Authorization": `Bearer ${token}` } : headers;
+}
+
+// Файлы больше этого размера загружаются кусками с докачкой (/uploads): обрыв связи не начинает загрузку заново
+const RESUMABLE_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+// Сколько раз подряд повторять кусок, прежде чем сдаться
+const UPLOAD_RETRY_LIMIT = 5;
+
+async function apiUploadAudio(file, model, language = 'auto', speakerRecognition = false, force = false, wordTimestamps = false) {
+    if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+        return await apiUploadAudioResumable(file, model, language, speakerRecognition, force, wordTimestamps);
+    }
     const formData = new FormData();
     formData.append("file", file);
     formData.append("model", model);
     formData.append("language", language);
     formData.append("speaker_recognition", speakerRecognition ? "true" : "false");
+    // force: распознать заново, даже если результат для этого файла уже есть в кэше
+    formData.append("force", force ? "true" : "false");
+    // wordTimestamps: сохранить таймкоды и уверенность для каждого слова
+    formData.append("word_timestamps", wordTimestamps ? "true" : "false");
 
     const response = await safeFetch(`${API_BASE}/upload`, {
         method: "POST",
+        headers: authHeaders(),
         body: formData
     });
 
     return await response.json();
 }
 
+async function fetchUploadState(uploadId) {
+    try {
+        const response = await fetch(`${API_BASE}/uploads/${uploadId}`);
+        return response.ok ? await response.json() : null;
+    } catch {
+        return null;
+    }
+}
+
+async function apiUploadAudioResumable(file, model, language = 'auto', speakerRecognition = false, force = false, wordTimestamps = false) {
+    // Незаконченная загрузка этого же файла (например, до перезагрузки страницы) продолжается с принятого места
+    const storageKey = `upload:${file.name}:${file.size}:${file.lastModified}:${model}:${language}`;
+    const savedId = localStorage.getItem(storageKey);
+    let state = savedId ? await fetchUploadState(savedId) : null;
+    if (!state) {
+        const response = await safeFetch(`${API_BASE}/uploads`, {
+            method: "POST",
+            headers: authHeaders({
+                "Content-Type": "application/json"
+            }),
+            body: JSON.stringify({
+                filename: file.name,
+                size: file.size,
+                model: model,
+                language: language,
+                speaker_recognition: speakerRecognition,
+                word_timestamps: wordTimestamps,
+                force: force
+            })
+        });
+        state = await response.json();
+        if (!state.upload_id) {
+            return state; // Такой файл уже есть на сервере — загрузка не понадобилась
+        }
+        localStorage.setItem(storageKey, state.upload_id);
+    }
+
+    let offset = state.offset;
+    let failures = 0;
+    while (offset < file.size) {
+        const end = Math.min(offset + state.chunk_size, file.size);
+        let response;
+        try {
+            response = await fetch(`${API_BASE}/uploads/${state.upload_id}`, {
+                method: "PUT",
+                headers: {
+                    "Content-Range": `bytes ${offset}-${end - 1}/${file.size}`
+                },
+                body: file.slice(offset, end)
+            });
+        } catch (error) {
+            response = null;
+        }
+        if (response && (response.ok || response.status === 409)) {
+            // 409: сервер принял другое количество байт — продолжаем с его смещения
+            offset = (await response.json()).offset;
+            failures = 0;
+            continue;
+        }
+        if (response && response.status < 500) {
+            const data = await response.json().catch(() => ({}));
+            localStorage.removeItem(storageKey);
+            throw new Error(data.detail || `Ошибка загрузки: ${response.status}`);
+        }
+        failures += 1;
+        if (failures > UPLOAD_RETRY_LIMIT) {
+            throw new Error("Связь с сервером прервалась. Загрузите файл ещё раз — она продолжится с того же места.");
+        }
+        // Связь оборвалась: ждём и узнаём у сервера, сколько он успел принять
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+        const current = await fetchUploadState(state.upload_id);
+        if (current) {
+            offset = current.offset;
+        }
+    }
+
+    const response = await safeFetch(`${API_BASE}/uploads/${state.upload_id}/complete`, {
+        method: "POST",
+        headers: authHeaders()
+    });
+    localStorage.removeItem(storageKey);
+    return await response.json();
+}
+
 async function apiGetTranscript(fileId) {
     const response = await safeFetch(`${API_BASE}/transcript/${fileId}`);
     return await response.json();
@@ -81,6 +184,14 @@ async function apiGetStatus(fileId) {
 
 async function apiRetryTranscript(fileId) {
     const response = await safeFetch(`${API_BASE}/retry/${fileId}`, {
+        method: "POST",
+        headers: authHeaders()
+    });
+    return await response.json();
+}
+
+async function apiCancelTranscript(fileId) {
+    const response = await safeFetch(`${API_BASE}/jobs/${fileId}/cancel`, {
         method: "POST"
     });
     return await response.json();
@@ -278,6 +389,11 @@ window.getAudioUrl = function(fileId) {
     return `${API_BASE}/audio/${fileId}`;
 };
 
+async function apiGetSpeechTimeline(fileId) {
+    const response = await safeFetch(`${API_BASE}/audio/${fileId}/speech`);
+    return await response.json();
+}
+
 // === Conversation API ===
 
 async function apiStartConversation(language, level, topic = null) {
@@ -228,7 +228,8 @@ async function startRecording() {
         window.speechRecognitionManager.setLanguage(currentLanguage);
         console.log('Language set to:', currentLanguage);
         
-        const started = window.speechRecognitionManager.start();
+        // Серверный движок запускается асинхронно (доступ к микрофону, WebSocket)
+        const started = await window.speechRecognitionManager.start();
         console.log('Start result:', started);
         
         if (!started) {
@@ -205,7 +205,13 @@ async function performUpload(file, model, language, speakerRecognition = false)
         
         // Начинаем отслеживать статус обработки
         updateProgress(50, "Ожидание начала обработки...");
-        showMessage(`Файл загружен! ID: ${currentFileId}. Обработка начата...`, "success");
+        if (data.cached) {
+            showMessage(`Файл уже распознавался с такими настройками — результат взят из кэша. ID: ${currentFileId}`, "success");
+        } else {
+            // eta_seconds — оценка сервера по очереди и скорости модели
+            const eta = data.eta_seconds ? ` Ожидаемое время готовности: ~${formatElapsedTime(data.eta_seconds)}.` : "";
+            showMessage(`Файл загружен! ID: ${currentFileId}. Обработка начата...${eta}`, "success");
+        }
         
         // Сбрасываем форму загрузки, но продолжаем отслеживать статус
         resetUploadForm();
@@ -501,12 +507,14 @@ function getStatusBadge(status, progress, statusMessage) {
     const pendingText = typeof t === 'function' ? t('status.pending') : 'Ожидание';
     const completedText = typeof t === 'function' ? t('status.completed') : 'Готово';
     const failedText = typeof t === 'function' ? t('status.failed') : 'Ошибка';
+    const cancelledText = typeof t === 'function' ? t('status.cancelled') : 'Отменено';
     
     const badges = {
         'pending': `<span class="status-badge status-pending">${pendingText}</span>`,
         'processing': `<span class="status-badge status-processing">${Math.round(progress)}%</span>`,
         'completed': `<span class="status-badge status-completed">${completedText}</span>`,
-        'failed': `<span class="status-badge status-failed">${failedText}</span>`
+        'failed': `<span class="status-badge status-failed">${failedText}</span>`,
+        'cancelled': `<span class="status-badge status-cancelled">${cancelledText}</span>`
     };
     return badges[status] || '';
 }
@@ -521,11 +529,13 @@ function getActionsForStatus(transcript) {
     const downloadText = typeof t === 'function' ? t('transcripts.download') : 'Скачать';
     const retryText = typeof t === 'function' ? t('transcripts.retry') : 'Повторить';
     const processingText = typeof t === 'function' ? t('upload.processing') : 'Обработка...';
+    const cancelTitle = typeof t === 'function' ? t('action.cancel') : 'Отменить обработку';
     
     const renameBtn = `<button class="btn btn-secondary btn-small" onclick="renameTranscript('${transcript.id}', '${escapeHtml(transcript.filename || '')}')" title="${renameTitle}">✏️</button>`;
     const deleteBtn = `<button class="btn btn-danger btn-small" onclick="deleteTranscript('${transcript.id}', '${escapeHtml(transcript.filename || '')}')" title="${deleteTitle}">🗑️</button>`;
     const moveBtn = `<button class="btn btn-secondary btn-small" onclick="openMoveToFolderModal('${transcript.id}', '${escapeHtml(transcript.filename || '')}', ${transcript.folder_id || 'null'})" title="${moveTitle}">📂</button>`;
     const exportBtn = `<button class="btn btn-secondary btn-small" onclick="openExportModal('${transcript.id}', '${escapeHtml(transcript.filename || '')}')" title="${exportTitle}">📤</button>`;
+    const cancelBtn = `<button class="btn btn-secondary btn-small" onclick="cancelTranscript('${transcript.id}')" title="${cancelTitle}">⏹️</button>`;
     const aiBtn = `<button class="btn btn-primary btn-small" onclick="openAIModal('${transcript.id}', '${escapeHtml(transcript.filename || '')}')" title="${aiTitle}">🤖</button>`;
     
     if (transcript.status === 'completed') {
@@ -538,16 +548,27 @@ function getActionsForStatus(transcript) {
             ${renameBtn}
             ${deleteBtn}
         `;
-    } else if (transcript.status === 'failed') {
+    } else if (transcript.status === 'failed' || transcript.status === 'cancelled') {
         return `
             <button class="btn btn-secondary" onclick="retryTranscript('${transcript.id}')">${retryText}</button>
             ${moveBtn}
             ${renameBtn}
             ${deleteBtn}
         `;
+    } else if (transcript.status === 'processing') {
+        // Уже распознанную часть можно читать, не дожидаясь конца обработки
+        return `
+            <span class="processing-text">${processingText}</span>
+            <button class="btn btn-secondary btn-small" onclick="viewTranscript('${transcript.id}')">${viewText}</button>
+            ${cancelBtn}
+            ${moveBtn}
+            ${renameBtn}
+            ${deleteBtn}
+        `;
     } else {
         return `
             <span class="processing-text">${processingText}</span>
+            ${cancelBtn}
             ${moveBtn}
             ${renameBtn}
             ${deleteBtn}
@@ -567,7 +588,7 @@ function formatDate(dateString) {
     });
 }
 
-// Отслеживание статуса обработки
+// Отслеживание статуса обработки: file_id -> обработчик событий статуса
 const trackingIntervals = {};
 const timerIntervals = {}; // Интервалы для таймеров
 
@@ -670,80 +691,183 @@ function stopTimer(fileId) {
     sessionStorage.removeItem(timerKey);
 }
 
+// Общий канал событий (SSE) для всех отслеживаемых файлов вместо опроса /status;
+// подписка только на отслеживаемые file_id, при смене их набора — переподключение
+let jobEventSource = null;
+let jobEventSourceKey = '';
+let jobEventSourceTimeout = null;
+// События приходят только по своим файлам, поэтому сдвиг очереди из-за чужих задач догоняем опросом
+const QUEUE_REFRESH_INTERVAL_MS = 15000;
+let queueRefreshInterval = null;
+// Последний известный статус задач: по смене статуса любой задачи пересчитываем места в очереди
+const lastJobStatus = {};
+let queueRefreshTimeout = null;
+
+function formatQueueStatus(status) {
+    let text = `В очереди: ${status.queue_position}-я`;
+    if (status.estimated_start_seconds > 0) {
+        text += `, начало через ~${formatElapsedTime(status.estimated_start_seconds)}`;
+    } else {
+        text += ", скоро начнётся";
+    }
+    if (status.eta_seconds) {
+        text += `, готово через ~${formatElapsedTime(status.eta_seconds)}`;
+    }
+    return text;
+}
+
+// Другая задача началась или завершилась — ожидающие сдвинулись в очереди (запросы схлопываются)
+function scheduleQueueRefresh() {
+    if (queueRefreshTimeout) {
+        return;
+    }
+    queueRefreshTimeout = setTimeout(() => {
+        queueRefreshTimeout = null;
+        Object.keys(trackingIntervals)
+            .filter(fileId => lastJobStatus[fileId] === 'pending')
+            .forEach(fileId => refreshStatusOnce(fileId));
+    }, 1000);
+}
+
+function ensureJobEventSource() {
+    if (typeof EventSource === 'undefined') {
+        return;
+    }
+    // Файлы обычно добавляются пачкой (загрузка списка) — переподключаемся один раз
+    clearTimeout(jobEventSourceTimeout);
+    jobEventSourceTimeout = setTimeout(connectJobEventSource, 200);
+}
+
+function connectJobEventSource() {
+    jobEventSourceTimeout = null;
+    const fileIds = Object.keys(trackingIntervals).sort();
+    const key = fileIds.join(',');
+    if (jobEventSource && key === jobEventSourceKey) {
+        return;
+    }
+    if (jobEventSource) {
+        jobEventSource.close();
+        jobEventSource = null;
+        clearInterval(queueRefreshInterval);
+        queueRefreshInterval = null;
+    }
+    if (fileIds.length === 0) {
+        return;
+    }
+    const query = fileIds.map(fileId => `file_id=${encodeURIComponent(fileId)}`).join('&');
+    jobEventSource = new EventSource(`${API_BASE}/events/jobs?${query}`);
+    jobEventSourceKey = key;
+    jobEventSource.addEventListener('job', (e) => {
+        try {
+            const event = JSON.parse(e.data);
+            const previous = lastJobStatus[event.file_id];
+            const handler = trackingIntervals[event.file_id];
+            if (typeof handler === 'function') {
+                handler(event);
+            }
+            if (event.status !== 'pending' && event.status !== previous) {
+                lastJobStatus[event.file_id] = event.status;
+                scheduleQueueRefresh();
+            }
+        } catch (err) {
+            console.error("Error handling job event:", err);
+        }
+    });
+    // При обрыве EventSource переподключается сам; состояние догоняем одним запросом статуса
+    jobEventSource.addEventListener('open', () => {
+        Object.keys(trackingIntervals).forEach(fileId => refreshStatusOnce(fileId));
+    });
+    queueRefreshInterval = setInterval(scheduleQueueRefresh, QUEUE_REFRESH_INTERVAL_MS);
+}
+
+async function refreshStatusOnce(fileId) {
+    try {
+        if (typeof apiGetStatus !== 'function') {
+            return;
+        }
+        const status = await apiGetStatus(fileId);
+        const handler = trackingIntervals[fileId];
+        if (typeof handler === 'function') {
+            handler(status);
+        }
+    } catch (err) {
+        console.error("Error checking status:", err);
+    }
+}
+
 function trackProcessingStatus(fileId) {
     // Если уже отслеживаем этот файл, не запускаем повторно
     if (trackingIntervals[fileId]) {
         return;
     }
     
-    const checkStatus = async () => {
-        try {
-            if (typeof apiGetStatus !== 'function') {
-                return;
+    const applyStatus = (update) => {
+        const status = { ...update, id: fileId };
+        lastJobStatus[fileId] = status.status;
+        
+        // Обновляем элемент в списке
+        const item = document.querySelector(`[data-file-id="${fileId}"]`);
+        if (item) {
+            const statusBadge = getStatusBadge(status.status, status.progress, status.status_message);
+            const header = item.querySelector('.transcript-header');
+            if (header) {
+                const h3 = header.querySelector('h3');
+                header.innerHTML = h3.outerHTML + statusBadge;
             }
             
-            const status = await apiGetStatus(fileId);
+            // Обновляем прогресс
+            const progressBar = item.querySelector('.progress-bar-small');
+            if (progressBar && status.progress !== null && status.progress !== undefined) {
+                progressBar.style.width = status.progress + '%';
+            }
             
-            // Обновляем элемент в списке
-            const item = document.querySelector(`[data-file-id="${fileId}"]`);
-            if (item) {
-                const statusBadge = getStatusBadge(status.status, status.progress, status.status_message);
-                const header = item.querySelector('.transcript-header');
-                if (header) {
-                    const h3 = header.querySelector('h3');
-                    header.innerHTML = h3.outerHTML + statusBadge;
-                }
-                
-                // Обновляем прогресс
-                const progressBar = item.querySelector('.progress-bar-small');
-                if (progressBar) {
-                    progressBar.style.width = status.progress + '%';
-                }
-                
-                // Обновляем сообщение статуса
-                const statusMessage = item.querySelector('.status-message');
-                if (statusMessage && status.status_message) {
-                    statusMessage.textContent = status.status_message;
-                }
-                
-                // Запускаем таймер, если его еще нет, но есть время начала
-                if ((status.status === 'processing' || status.status === 'pending') && status.created_at) {
-                    const timerElement = item.querySelector('.processing-timer[data-file-id="' + fileId + '"]');
-                    if (!timerElement) {
-                        // Если таймера нет, добавляем его
-                        const progressSection = item.querySelector('.progress-section');
-                        if (progressSection) {
-                            const startTime = new Date(status.created_at).getTime();
-                            const timerHtml = `<p class="processing-timer" data-file-id="${fileId}" data-start-time="${startTime}">⏱️ <span class="timer-value">00:00</span></p>`;
-                            progressSection.insertAdjacentHTML('beforeend', timerHtml);
-                            startTimer(fileId, startTime);
-                        }
+            // Обновляем сообщение статуса; ожидающей задаче показываем место в очереди
+            const statusMessage = item.querySelector('.status-message');
+            if (statusMessage && status.status === 'pending' && status.queue_position) {
+                statusMessage.textContent = formatQueueStatus(status);
+            } else if (statusMessage && status.status_message) {
+                // eta_seconds — по скорости распознавания этой записи (до первых сегментов — по истории)
+                const eta = status.status === 'processing' && status.eta_seconds != null
+                    ? ` · осталось ~${formatElapsedTime(status.eta_seconds)}` : '';
+                statusMessage.textContent = status.status_message + eta;
+            }
+            
+            // Запускаем таймер, если его еще нет, но есть время начала
+            if ((status.status === 'processing' || status.status === 'pending') && status.created_at) {
+                const timerElement = item.querySelector('.processing-timer[data-file-id="' + fileId + '"]');
+                if (!timerElement) {
+                    // Если таймера нет, добавляем его
+                    const progressSection = item.querySelector('.progress-section');
+                    if (progressSection) {
+                        const startTime = new Date(status.created_at).getTime();
+                        const timerHtml = `<p class="processing-timer" data-file-id="${fileId}" data-start-time="${startTime}">⏱️ <span class="timer-value">00:00</span></p>`;
+                        progressSection.insertAdjacentHTML('beforeend', timerHtml);
+                        startTimer(fileId, startTime);
                     }
                 }
-                
-                // Обновляем действия
-                const actionsDiv = item.querySelector('.transcript-actions');
-                if (actionsDiv) {
-                    actionsDiv.innerHTML = getActionsForStatus(status);
-                }
             }
             
-            // Если обработка завершена или провалилась, останавливаем отслеживание и таймер
-            if (status.status === 'completed' || status.status === 'failed') {
-                clearInterval(trackingIntervals[fileId]);
-                delete trackingIntervals[fileId];
-                stopTimer(fileId);
-                // Обновляем весь список
-                loadTranscripts();
+            // Обновляем действия
+            const actionsDiv = item.querySelector('.transcript-actions');
+            if (actionsDiv) {
+                actionsDiv.innerHTML = getActionsForStatus(status);
             }
-        } catch (err) {
-            console.error("Error checking status:", err);
+        }
+        
+        // Если обработка завершена или провалилась, прекращаем отслеживание и таймер
+        if (status.status === 'completed' || status.status === 'failed' || status.status === 'cancelled') {
+            delete trackingIntervals[fileId];
+            stopTimer(fileId);
+            ensureJobEventSource();
+            // Обновляем весь список
+            loadTranscripts();
         }
     };
     
-    // Проверяем статус каждые 2 секунды
-    trackingIntervals[fileId] = setInterval(checkStatus, 2000);
-    checkStatus(); // Первая проверка сразу
+    // Обновления приходят через SSE; текущее состояние берём одним запросом
+    trackingIntervals[fileId] = applyStatus;
+    ensureJobEventSource();
+    refreshStatusOnce(fileId);
 }
 
 function escapeHtml(text) {
@@ -763,7 +887,8 @@ window.viewTranscript = async function(fileId) {
     try {
         const data = await apiGetTranscript(fileId);
         
-        if (data.status && data.status !== 'completed') {
+        // partial: транскрипция ещё идёт, показываем уже распознанную часть
+        if (data.status && data.status !== 'completed' && !data.partial) {
             alert("Транскрипция ещё не готова. Статус: " + data.status);
             return;
         }
@@ -815,6 +940,19 @@ window.retryTranscript = async function(fileId) {
     }
 };
 
+window.cancelTranscript = async function(fileId) {
+    const message = typeof t === 'function' ? t('confirm.cancel') : "Остановить обработку этого файла?";
+    if (confirm(message)) {
+        try {
+            const data = await apiCancelTranscript(fileId);
+            showMessage(data.message || "Обработка отменена", "success");
+            await loadTranscripts();
+        } catch (err) {
+            alert("Ошибка: " + err.message);
+        }
+    }
+};
+
 window.renameTranscript = async function(fileId, currentName) {
     const newName = prompt("Введите новое имя файла:", currentName);
     
@@ -1152,7 +1290,8 @@ window.openDuplicateModal = function(filename, similarFiles) {
                 'completed': 'Завершён',
                 'processing': 'Обрабатывается',
                 'pending': 'В очереди',
-                'failed': 'Ошибка'
+                'failed': 'Ошибка',
+                'cancelled': 'Отменено'
             }[statusClass] || 'Неизвестно';
             
             const date = file.created_at ? new Date(file.created_at).toLocaleDateString() : 'Неизвестно';
@@ -1804,6 +1943,9 @@ window.openTranscriptViewModal = async function(fileId, transcriptData) {
     console.log('Loading audio from:', audioUrl);
     audioEl.src = audioUrl;
     
+    // Участки речи на шкале плеера
+    showSpeechTimeline(fileId);
+    
     // Обработка ошибок загрузки аудио
     audioEl.addEventListener('error', (e) => {
         console.error('Audio load error:', e);
@@ -1861,6 +2003,9 @@ window.closeTranscriptViewModal = function() {
             audioPlayer.currentTime = 0;
         }
         
+        const progressBar = document.getElementById('audioProgress');
+        if (progressBar) progressBar.style.background = '';
+        
         // Сбрасываем состояние
         transcriptSegments = [];
         currentSegmentIndex = -1;
@@ -1881,6 +2026,43 @@ window.closeTranscriptViewModal = function() {
     }
 };
 
+// Подсветка участков речи на шкале плеера (разметка VAD с сервера), тишина остаётся серой
+async function showSpeechTimeline(fileId) {
+    const progressBar = document.getElementById('audioProgress');
+    if (!progressBar) return;
+    progressBar.style.background = '';
+    
+    let timeline;
+    try {
+        timeline = await apiGetSpeechTimeline(fileId);
+    } catch (err) {
+        console.warn('Speech timeline unavailable:', err);
+        return;
+    }
+    // Пока разметка грузилась, могли открыть другую запись
+    if (transcriptViewFileId !== fileId || !timeline.duration_seconds) return;
+    
+    const silence = '#e5e7eb';
+    const speech = '#c7d2fe';
+    const stops = [];
+    let lastEnd = -1;
+    timeline.regions.forEach(([start, end]) => {
+        const from = start / timeline.duration_seconds * 100;
+        const to = end / timeline.duration_seconds * 100;
+        // Паузы уже 0.3% шкалы всё равно не видны — склеиваем, чтобы не раздувать градиент
+        if (lastEnd >= 0 && from - lastEnd < 0.3) {
+            stops.splice(-2, 2);
+        } else {
+            stops.push(`${silence} ${from.toFixed(2)}%`, `${speech} ${from.toFixed(2)}%`);
+        }
+        stops.push(`${speech} ${to.toFixed(2)}%`, `${silence} ${to.toFixed(2)}%`);
+        lastEnd = to;
+    });
+    if (stops.length) {
+        progressBar.style.background = `linear-gradient(to right, ${silence} 0%, ${stops.join(', ')}, ${silence} 100%)`;
+    }
+}
+
 // Рендеринг сегментов транскрипции
 function renderTranscriptSegments() {
     const container = document.getElementById('transcriptText');
@@ -60,6 +60,7 @@ const TRANSLATIONS = {
         'status.processing': 'Обработка',
         'status.completed': 'Готово',
         'status.failed': 'Ошибка',
+        'status.cancelled': 'Отменено',
         
         // Sidebar
         'sidebar.labels': 'Ярлыки',
@@ -82,6 +83,7 @@ const TRANSLATIONS = {
         // Actions
         'action.rename': 'Переименовать',
         'action.delete': 'Удалить',
+        'action.cancel': 'Отменить обработку',
         'action.move': 'Переместить в папку',
         'action.export': 'Экспорт',
         
@@ -147,6 +149,7 @@ const TRANSLATIONS = {
         'confirm.deleteFile': 'Удалить "{filename}"?\n\nЭто действие нельзя отменить. Будут удалены аудиофайл и транскрипция.',
         'confirm.deleteFolder': 'Удалить папку "{name}"?\n\nФайлы внутри папки не будут удалены.',
         'confirm.retry': 'Повторить обработку этого файла?',
+        'confirm.cancel': 'Остановить обработку этого файла?',
         'confirm.enterNewName': 'Введите новое имя файла:',
         'confirm.enterFolderName': 'Введите новое название папки:',
         
@@ -281,6 +284,7 @@ const TRANSLATIONS = {
         'status.processing': 'Processing',
         'status.completed': 'Completed',
         'status.failed': 'Failed',
+        'status.cancelled': 'Cancelled',
         
         // Sidebar
         'sidebar.labels': 'Labels',
@@ -303,6 +307,7 @@ const TRANSLATIONS = {
         // Actions
         'action.rename': 'Rename',
         'action.delete': 'Delete',
+        'action.cancel': 'Cancel processing',
         'action.move': 'Move to folder',
         'action.export': 'Export',
         
@@ -368,6 +373,7 @@ const TRANSLATIONS = {
         'confirm.deleteFile': 'Delete "{filename}"?\n\nThis action cannot be undone. Audio file and transcription will be deleted.',
         'confirm.deleteFolder': 'Delete folder "{name}"?\n\nFiles inside the folder will not be deleted.',
         'confirm.retry': 'Retry processing this file?',
+        'confirm.cancel': 'Stop processing this file?',
         'confirm.enterNewName': 'Enter new file name:',
         'confirm.enterFolderName': 'Enter new folder name:',
         
@@ -502,6 +508,7 @@ const TRANSLATIONS = {
         'status.processing': 'Verarbeitung',
         'status.completed': 'Fertig',
         'status.failed': 'Fehler',
+        'status.cancelled': 'Abgebrochen',
         
         // Sidebar
         'sidebar.labels': 'Labels',
@@ -524,6 +531,7 @@ const TRANSLATIONS = {
         // Actions
         'action.rename': 'Umbenennen',
         'action.delete': 'Löschen',
+        'action.cancel': 'Verarbeitung abbrechen',
         'action.move': 'In Ordner verschieben',
         'action.export': 'Exportieren',
         
@@ -589,6 +597,7 @@ const TRANSLATIONS = {
         'confirm.deleteFile': '"{filename}" löschen?\n\nDiese Aktion kann nicht rückgängig gemacht werden.',
         'confirm.deleteFolder': 'Ordner "{name}" löschen?\n\nDateien im Ordner werden nicht gelöscht.',
         'confirm.retry': 'Verarbeitung dieser Datei wiederholen?',
+        'confirm.cancel': 'Verarbeitung dieser Datei stoppen?',
         'confirm.enterNewName': 'Neuen Dateinamen eingeben:',
         'confirm.enterFolderName': 'Neuen Ordnernamen eingeben:',
         
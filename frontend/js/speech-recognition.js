@@ -1,6 +1,7 @@
 /**
  * Speech Recognition Module
- * Использует Web Speech API для распознавания речи в реальном времени
+ * Распознавание речи в реальном времени: сервером через WebSocket (ServerSpeechRecognition)
+ * или, если браузер этого не умеет, через Web Speech API (SpeechRecognitionManager)
  */
 
 class SpeechRecognitionManager {
@@ -159,6 +160,175 @@ class SpeechRecognitionManager {
     }
 }
 
-// Глобальный экземпляр
-window.speechRecognitionManager = new SpeechRecognitionManager();
+/**
+ * Распознавание речи нашим сервером (Whisper) через WebSocket /ws/transcribe.
+ * Интерфейс тот же, что у SpeechRecognitionManager: микрофон пишется в PCM 16 кГц,
+ * сервер возвращает промежуточный текст и финальные фразы.
+ */
+class ServerSpeechRecognition {
+    constructor(model = 'base') {
+        this.model = model;
+        this.language = 'de';
+        this.isRecording = false;
+        this.socket = null;
+        this.stream = null;
+        this.audioContext = null;
+        this.processor = null;
+        this.onResultCallback = null;
+        this.onErrorCallback = null;
+        this.onStartCallback = null;
+        this.onEndCallback = null;
+        this.finalResults = [];
+        // Реплики тренажёра не сохраняются транскрипциями (иначе каждая фраза — запись в списке и WAV на диске)
+        this.saveSession = false;
+    }
+    
+    static isAvailable() {
+        return !!(window.WebSocket && navigator.mediaDevices && navigator.mediaDevices.getUserMedia &&
+            (window.AudioContext || window.webkitAudioContext));
+    }
+    
+    setLanguage(language) {
+        this.language = language || 'de';
+    }
+    
+    async start() {
+        if (this.isRecording) {
+            console.warn('Запись уже идёт');
+            return false;
+        }
+        
+        try {
+            this.stream = await navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1, echoCancellation: true } });
+        } catch (error) {
+            console.error('Нет доступа к микрофону:', error);
+            if (this.onErrorCallback) this.onErrorCallback('not-allowed');
+            return false;
+        }
+        
+        const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+        this.audioContext = new AudioContextClass();
+        const sampleRate = this.audioContext.sampleRate;
+        const wsBase = API_BASE.replace(/^http/, 'ws');
+        const params = new URLSearchParams({
+            model: this.model,
+            language: this.language,
+            format: 'pcm_s16le',
+            sample_rate: String(sampleRate),
+            save: String(this.saveSession)
+        });
+        this.socket = new WebSocket(`${wsBase}/ws/transcribe?${params}`);
+        this.socket.binaryType = 'arraybuffer';
+        this.finalResults = [];
+        
+        this.socket.onopen = () => {
+            const source = this.audioContext.createMediaStreamSource(this.stream);
+            this.processor = this.audioContext.createScriptProcessor(4096, 1, 1);
+            this.processor.onaudioprocess = (event) => {
+                if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
+                // float32 [-1, 1] -> int16; частоту сервер приводит к 16 кГц сам
+                const input = event.inputBuffer.getChannelData(0);
+                const pcm = new Int16Array(input.length);
+                for (let i = 0; i < input.length; i++) {
+                    const sample = Math.max(-1, Math.min(1, input[i]));
+                    pcm[i] = sample < 0 ? sample * 0x8000 : sample * 0x7FFF;
+                }
+                this.socket.send(pcm.buffer);
+            };
+            source.connect(this.processor);
+            this.processor.connect(this.audioContext.destination);
+            this.isRecording = true;
+            if (this.onStartCallback) this.onStartCallback();
+        };
+        
+        this.socket.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            if (event.type === 'partial') {
+                if (this.onResultCallback) {
+                    this.onResultCallback({ interim: event.text, final: '', isFinal: false });
+                }
+            } else if (event.type === 'final') {
+                const text = event.segments.map(seg => seg.text).join(' ').trim();
+                if (!text) return;
+                this.finalResults.push(text);
+                if (this.onResultCallback) {
+                    this.onResultCallback({ interim: '', final: text, isFinal: true });
+                }
+            } else if (event.type === 'error') {
+                console.error('Server speech recognition error:', event.detail);
+                if (this.onErrorCallback) this.onErrorCallback(event.detail);
+            }
+        };
+        
+        this.socket.onerror = () => {
+            if (this.onErrorCallback) this.onErrorCallback('network');
+        };
+        
+        this.socket.onclose = () => {
+            this.releaseAudio();
+            this.socket = null;
+            const wasRecording = this.isRecording;
+            this.isRecording = false;
+            if (wasRecording && this.onEndCallback) this.onEndCallback();
+        };
+        
+        return true;
+    }
+    
+    stop() {
+        // Сервер дораспознает остаток, пришлёт финальные фразы и закроет соединение сам
+        this.releaseAudio();
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({ type: 'stop' }));
+        }
+    }
+    
+    abort() {
+        this.releaseAudio();
+        if (this.socket) {
+            this.socket.close();
+        }
+    }
+    
+    releaseAudio() {
+        if (this.processor) {
+            this.processor.disconnect();
+            this.processor.onaudioprocess = null;
+            this.processor = null;
+        }
+        if (this.stream) {
+            this.stream.getTracks().forEach(track => track.stop());
+            this.stream = null;
+        }
+        if (this.audioContext) {
+            this.audioContext.close();
+            this.audioContext = null;
+        }
+    }
+    
+    onResult(callback) {
+        this.onResultCallback = callback;
+    }
+    
+    onError(callback) {
+        this.onErrorCallback = callback;
+    }
+    
+    onStart(callback) {
+        this.onStartCallback = callback;
+    }
+    
+    onEnd(callback) {
+        this.onEndCallback = callback;
+    }
+    
+    isSupported() {
+        return ServerSpeechRecognition.isAvailable();
+    }
+}
+
+// Глобальный экземпляр: распознаёт наш сервер; Web Speech API — запасной вариант для старых браузеров
+window.speechRecognitionManager = ServerSpeechRecognition.isAvailable()
+    ? new ServerSpeechRecognition()
+    : new SpeechRecognitionManager();
 